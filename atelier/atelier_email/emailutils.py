@@ -1,15 +1,23 @@
+import importlib
+import itertools
+import logging
+
 import django_rq
 from django.conf import settings
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-import html2text
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
+
+from atelier.atelier_email import plaintext, template_cache
+
+logger = logging.getLogger(__name__)
 
 
 def convert_html_to_plaintext(html):
     """
     Convert the given ``html`` to plain text.
+
+    Uses :func:`atelier.atelier_email.plaintext.get_default_converter`.
     """
-    return html2text.html2text(html)
+    return plaintext.get_default_converter().convert(html)
 
 
 def send_with_delay(send_kwargs):
@@ -21,6 +29,59 @@ def send_with_delay(send_kwargs):
     other_sent_mail(**send_kwargs)
 
 
+class BulkEmailError(Exception):
+    """
+    Raised by :func:`.send_bulk_with_delay` when some of the emails could not be sent.
+
+    Attributes:
+        failed_references (list): The ``email_references`` of the emails that failed.
+    """
+    def __init__(self, email_class_path, failed_references):
+        self.failed_references = failed_references
+        super().__init__(f'Failed to send {len(failed_references)} {email_class_path} emails: {failed_references!r}')
+
+
+def import_email_class(email_class_path):
+    """
+    Import an :class:`.AbstractEmail` subclass from the path returned
+    by :meth:`.AbstractEmail.get_email_class_path`.
+    """
+    module_path, class_qualname = email_class_path.split(':')
+    email_class = importlib.import_module(module_path)
+    for attribute in class_qualname.split('.'):
+        email_class = getattr(email_class, attribute)
+    return email_class
+
+
+def send_bulk_with_delay(email_class_path, email_references):
+    """
+    RQ task for sending emails enqueued with :meth:`.AbstractEmail.bulk_delay`.
+
+    The emails are made with :meth:`.AbstractEmail.from_reference`, so they are
+    rendered in the worker, and they are all sent over a single connection.
+    Failing emails are logged, and does not stop the rest of the emails from being sent,
+    but :class:`.BulkEmailError` is raised when all the emails have been tried, so the
+    RQ job ends up as failed.
+
+    :param email_class_path: See :meth:`.AbstractEmail.get_email_class_path`.
+    :param email_references: List of kwargs for :meth:`.AbstractEmail.from_reference`.
+    :raises BulkEmailError: If any of the emails failed.
+    """
+    email_class = import_email_class(email_class_path)
+    failed_references = []
+    last_exception = None
+    with get_connection() as connection:
+        for email_reference in email_references:
+            try:
+                email_class.from_reference(**email_reference).send(connection=connection)
+            except Exception as exception:
+                logger.exception('Failed to send %s to %r.', email_class_path, email_reference)
+                failed_references.append(email_reference)
+                last_exception = exception
+    if failed_references:
+        raise BulkEmailError(email_class_path, failed_references) from last_exception
+
+
 class AbstractEmail(object):
     """
     Abstract class for sending email.
@@ -186,7 +247,8 @@ class AbstractEmail(object):
         Render the subject. You can override this if you want to
         adjust template rendering or avoid using a template.
         """
-        subject = render_to_string(self.get_subject_template(), self.get_context_data()).strip()
+        subject = template_cache.render_email_template(
+            self.get_subject_template(), self.get_context_data()).strip()
         return '{}{}'.format(self.get_subject_prefix(), subject)
 
     def render_html_message(self):
@@ -194,7 +256,7 @@ class AbstractEmail(object):
         Render the html message. You can override this if you want to
         adjust template rendering or avoid using a template.
         """
-        return render_to_string(self.get_html_message_template(), self.get_context_data())
+        return template_cache.render_email_template(self.get_html_message_template(), self.get_context_data())
 
     def __get_rendered_html_message(self):
         """
@@ -217,7 +279,7 @@ class AbstractEmail(object):
         """
         template_name = self.get_plaintext_message_template()
         if template_name:
-            return render_to_string(template_name, self.get_context_data()).strip()
+            return template_cache.render_email_template(template_name, self.get_context_data()).strip()
         else:
             return convert_html_to_plaintext(self.__get_rendered_html_message())
 
@@ -295,11 +357,37 @@ class AbstractEmail(object):
             'recipient_list': self.get_recipient_list()
         }
 
-    def send(self):
+    def make_email_message(self, connection=None):
+        """
+        Make a :class:`django.core.mail.EmailMultiAlternatives` for the email, just like
+        :meth:`django.core.mail.send_mail` does with :meth:`.get_send_mail_kwargs`.
+
+        Useful when you want to send many emails over a single connection
+        with ``connection.send_messages()``.
+
+        Parameters:
+            connection: An optional email backend instance (see :func:`django.core.mail.get_connection`).
+        """
+        send_mail_kwargs = self.get_send_mail_kwargs()
+        email_message = EmailMultiAlternatives(
+            subject=send_mail_kwargs['subject'],
+            body=send_mail_kwargs['message'],
+            from_email=send_mail_kwargs['from_email'],
+            to=send_mail_kwargs['recipient_list'],
+            connection=connection)
+        if send_mail_kwargs.get('html_message'):
+            email_message.attach_alternative(send_mail_kwargs['html_message'], 'text/html')
+        return email_message
+
+    def send(self, connection=None):
         """
         Send the email.
+
+        Parameters:
+            connection: An optional email backend instance to send the email with. A new
+                connection is opened (and closed) for the email if this is ``None``.
         """
-        send_mail(**self.get_send_mail_kwargs())
+        send_mail(connection=connection, **self.get_send_mail_kwargs())
 
     def delay(self):
         """
@@ -310,6 +398,68 @@ class AbstractEmail(object):
 
         django_rq.enqueue(send_with_delay, kwargs)
 
+    @classmethod
+    def get_email_class_path(cls):
+        """
+        Get the import path of this class for :meth:`.bulk_delay`.
+
+        Raises:
+            ValueError: If the class can not be imported (E.g.: if it is defined in a function).
+        """
+        if '<locals>' in cls.__qualname__:
+            raise ValueError(f'{cls.__qualname__} must be defined at module level to be used with bulk_delay().')
+        return f'{cls.__module__}:{cls.__qualname__}'
+
+    @classmethod
+    def from_reference(cls, **kwargs):
+        """
+        Make an email object from the kwargs sent to :meth:`.bulk_delay`. Called in the RQ worker.
+
+        Defaults to sending the kwargs to the constructor. Override this to load
+        the data for the email from references, E.g.: to turn a ``user_id``
+        into a User object::
+
+            class WelcomeEmail(emailutils.AbstractEmail):
+                subject_template = 'myapp/welcome/subject.txt'
+                html_message_template = 'myapp/welcome/html_message.html'
+
+                @classmethod
+                def from_reference(cls, user_id):
+                    user = User.objects.get(id=user_id)
+                    return cls(recipient=user.email, extra_context_data={'user': user})
+
+            WelcomeEmail.bulk_delay({'user_id': user_id} for user_id in user_ids)
+        """
+        return cls(**kwargs)
+
+    @classmethod
+    def bulk_delay(cls, email_references, batch_size=100):
+        """
+        Send many emails of this class as RQ tasks.
+
+        Unlike :meth:`.delay`, nothing is rendered when enqueuing. Only the
+        ``email_references`` are enqueued, and the emails are made with
+        :meth:`.from_reference` and rendered in the worker. Keep the references small
+        (E.g.: ids instead of objects) to keep the jobs small.
+
+        Args:
+            email_references: Iterable of kwargs dicts for :meth:`.from_reference`. Must be picklable.
+                Defaults to the constructor kwargs, E.g.: ``{'recipient': ..., 'extra_context_data': {...}}``.
+            batch_size (int): Number of emails per RQ job.
+
+        Returns:
+            int: The number of RQ jobs enqueued.
+        """
+        email_class_path = cls.get_email_class_path()
+        email_references = iter(email_references)
+        job_count = 0
+        while True:
+            batch = list(itertools.islice(email_references, batch_size))
+            if not batch:
+                return job_count
+            django_rq.enqueue(send_bulk_with_delay, email_class_path, batch)
+            job_count += 1
+
     def get_default_from_email(self):
         """
         Get the fallback value for ``from_email``. Defaults to
@@ -0,0 +1,46 @@
+import time
+
+import html2text
+from django.core.management.base import BaseCommand
+
+from atelier.atelier_email import emailutils, plaintext
+
+
+class Command(BaseCommand):
+    help = 'Benchmark converting the HTML of our email templates to plaintext with html2text ' \
+           'and the fast converter.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversions', type=int, default=500,
+                            help='Number of conversions per converter. Defaults to 500.')
+
+    def get_html_messages(self):
+        class DemoEmail(emailutils.AbstractEmail):
+            subject_template = 'atelier_email/atelier_email_send_testmail/subject.txt'
+            html_message_template = 'atelier_email/atelier_email_send_testmail/html_message.html'
+        return {
+            'atelier_email_send_testmail': DemoEmail(
+                recipient='test@example.com', extra_context_data={'name': 'Test Name'}).render_html_message(),
+            'login code': '<p>Your login code is</p><p><strong>123456</strong></p>',
+        }
+
+    def benchmark(self, convert, html, conversions):
+        start = time.perf_counter()
+        for index in range(conversions):
+            convert(html)
+        elapsed = time.perf_counter() - start
+        return conversions / elapsed
+
+    def handle(self, *args, **options):
+        conversions = options['conversions']
+        converters = [
+            ('html2text.html2text', html2text.html2text),
+            ('html2text converter', plaintext.HtmlToPlaintextConverter().convert),
+            ('fast converter', plaintext.HtmlToPlaintextConverter(use_fast_converter=True).convert),
+        ]
+        for name, html in self.get_html_messages().items():
+            self.stdout.write(f'{name} ({len(html)} characters, fast converter supported: '
+                              f'{plaintext.FastHtmlToPlaintextParser.can_convert(html)}):')
+            for label, convert in converters:
+                throughput = self.benchmark(convert=convert, html=html, conversions=conversions)
+                self.stdout.write(f'  {label}: {throughput:.0f} conversions/s')
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+
+from atelier.atelier_email import emailutils, template_cache
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rendering the atelier_email_send_testmail email with the template loaders ' \
+           'from the TEMPLATES setting and with the atelier_email compiled template cache.'
+
+    subject_template = 'atelier_email/atelier_email_send_testmail/subject.txt'
+    html_message_template = 'atelier_email/atelier_email_send_testmail/html_message.html'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=500,
+                            help='Number of times to render the email. Defaults to 500.')
+
+    def get_context_data(self):
+        email = emailutils.AbstractEmail(recipient='test@example.com', extra_context_data={'name': 'Test Name'})
+        return email.get_context_data()
+
+    def benchmark(self, render, renders):
+        context_data = self.get_context_data()
+        start = time.perf_counter()
+        for index in range(renders):
+            render(self.subject_template, context_data)
+            render(self.html_message_template, context_data)
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        renders = options['renders']
+        template_cache.clear_email_template_cache()
+        results = [
+            ('TEMPLATES loaders', self.benchmark(render=render_to_string, renders=renders)),
+            ('Email template cache', self.benchmark(render=template_cache.render_email_template, renders=renders)),
+        ]
+        for label, elapsed in results:
+            self.stdout.write(f'{label}: {elapsed:.2f}s ({elapsed / renders * 1000:.3f} ms per email)')
+        self.stdout.write(f'Speedup: {results[0][1] / results[1][1]:.1f}x')
@@ -0,0 +1,171 @@
+import re
+from html.parser import HTMLParser
+
+import html2text
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class FastHtmlToPlaintextParser(HTMLParser):
+    """
+    A small HTML to plaintext converter for the restricted HTML produced by our email
+    templates (tables, paragraphs, line breaks, headings, lists, bold, italic and links).
+
+    The output uses the same markdown style as ``html2text``, but without line
+    wrapping and the more advanced formatting, so it is not identical to the ``html2text``
+    output. Use :meth:`.can_convert` to check if a HTML document only uses the supported tags.
+    """
+
+    #: Tags that start and end a block of text.
+    BLOCK_TAGS = {
+        'p', 'div', 'table', 'tbody', 'thead', 'tfoot', 'tr', 'td', 'th', 'center',
+        'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ul', 'ol', 'li', 'blockquote',
+    }
+
+    #: Tags that are ignored (the text inside them is still included).
+    IGNORED_TAGS = {'html', 'body', 'span', 'font', 'meta', 'img', 'hr', 'u'}
+
+    #: Tags where the content is skipped.
+    SKIPPED_CONTENT_TAGS = {'head', 'style', 'script', 'title'}
+
+    #: Inline formatting tags, and the markdown they are converted to.
+    FORMATTING_TAGS = {'strong': '**', 'b': '**', 'em': '_', 'i': '_'}
+
+    SUPPORTED_TAGS = BLOCK_TAGS | IGNORED_TAGS | SKIPPED_CONTENT_TAGS | set(FORMATTING_TAGS) | {'a', 'br'}
+
+    TAG_PATTERN = re.compile(r'<\s*/?\s*([a-zA-Z][a-zA-Z0-9]*)')
+    WHITESPACE_PATTERN = re.compile(r'\s+')
+
+    @classmethod
+    def can_convert(cls, html):
+        """
+        Returns ``True`` if the given ``html`` only contains tags supported by this converter.
+        """
+        return all(tag.lower() in cls.SUPPORTED_TAGS for tag in cls.TAG_PATTERN.findall(html))
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self.current_block = []
+        self.skip_depth = 0
+        self.link_stack = []
+        self.in_list_item = False
+
+    def _end_block(self):
+        text = ''.join(self.current_block)
+        text = '\n'.join(self.WHITESPACE_PATTERN.sub(' ', line).strip() for line in text.split('\n'))
+        if text.strip():
+            self.blocks.append((text.strip(), self.in_list_item))
+        self.current_block = []
+        self.in_list_item = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_CONTENT_TAGS:
+            self.skip_depth += 1
+        elif self.skip_depth:
+            return
+        elif tag in self.BLOCK_TAGS:
+            self._end_block()
+            if tag == 'li':
+                self.in_list_item = True
+                self.current_block.append('* ')
+        elif tag == 'br':
+            self.current_block.append('\n')
+        elif tag in self.FORMATTING_TAGS:
+            self.current_block.append(self.FORMATTING_TAGS[tag])
+        elif tag == 'a':
+            self.link_stack.append(dict(attrs).get('href'))
+            self.current_block.append('[')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_CONTENT_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif self.skip_depth:
+            return
+        elif tag in self.BLOCK_TAGS:
+            self._end_block()
+        elif tag in self.FORMATTING_TAGS:
+            self.current_block.append(self.FORMATTING_TAGS[tag])
+        elif tag == 'a' and self.link_stack:
+            href = self.link_stack.pop()
+            self.current_block.append(f']({href})' if href else ']')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.current_block.append(data)
+
+    def convert(self, html):
+        self.feed(html)
+        self.close()
+        self._end_block()
+        output = []
+        previous_is_list_item = False
+        for text, is_list_item in self.blocks:
+            if output:
+                # List items are separated by a single newline, like html2text does
+                output.append('\n' if is_list_item and previous_is_list_item else '\n\n')
+            output.append(text)
+            previous_is_list_item = is_list_item
+        return ''.join(output) + '\n\n'
+
+
+class HtmlToPlaintextConverter(object):
+    """
+    Converts HTML to plaintext with ``html2text``, or with :class:`.FastHtmlToPlaintextParser`
+    if ``use_fast_converter`` is ``True`` and the HTML only uses the tags it supports.
+
+    Results are not cached. Most emails are unique per receiver (E.g.: login codes),
+    so a cache would rarely be hit, and would keep the content of recently sent
+    emails in memory.
+
+    Args:
+        use_fast_converter (bool): Use :class:`.FastHtmlToPlaintextParser` for HTML
+            it supports, and only use ``html2text`` for other HTML.
+        html2text_options (dict): Attributes to set on the ``html2text.HTML2Text`` objects.
+    """
+    def __init__(self, use_fast_converter=False, html2text_options=None):
+        self.use_fast_converter = use_fast_converter
+        self.html2text_options = html2text_options or {}
+
+    def make_html2text(self):
+        # HTML2Text objects keep state from the document they have handled,
+        # so we need a new one for each document.
+        html2text_parser = html2text.HTML2Text()
+        for attribute, value in self.html2text_options.items():
+            setattr(html2text_parser, attribute, value)
+        return html2text_parser
+
+    def convert(self, html):
+        """
+        Convert the given ``html`` to plaintext.
+        """
+        if self.use_fast_converter and FastHtmlToPlaintextParser.can_convert(html):
+            return FastHtmlToPlaintextParser().convert(html)
+        return self.make_html2text().handle(html)
+
+
+_default_converter = None
+
+
+def get_default_converter():
+    """
+    Get the :class:`.HtmlToPlaintextConverter` used by
+    :func:`atelier.atelier_email.emailutils.convert_html_to_plaintext`.
+
+    Configured with the following optional setting:
+
+    - ``ATELIER_EMAIL_PLAINTEXT_FAST_CONVERTER``: Defaults to ``False``.
+    """
+    global _default_converter
+    if _default_converter is None:
+        _default_converter = HtmlToPlaintextConverter(
+            use_fast_converter=getattr(settings, 'ATELIER_EMAIL_PLAINTEXT_FAST_CONVERTER', False))
+    return _default_converter
+
+
+@receiver(setting_changed)
+def _reset_default_converter_on_setting_changed(setting, **kwargs):
+    global _default_converter
+    if setting == 'ATELIER_EMAIL_PLAINTEXT_FAST_CONVERTER':
+        _default_converter = None
@@ -0,0 +1,85 @@
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import engines
+from django.template.engine import Engine
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def _make_email_template_engine():
+    """
+    Make a copy of the ``django`` template engine from the ``TEMPLATES`` setting
+    where the loaders are wrapped in the cached template loader.
+    """
+    default_engine = engines['django'].engine
+    loaders = list(default_engine.loaders)
+    if not (len(loaders) == 1 and isinstance(loaders[0], (list, tuple))
+            and loaders[0][0] == 'django.template.loaders.cached.Loader'):
+        loaders = [('django.template.loaders.cached.Loader', loaders)]
+    return Engine(
+        dirs=default_engine.dirs,
+        context_processors=default_engine.context_processors,
+        debug=default_engine.debug,
+        loaders=loaders,
+        string_if_invalid=default_engine.string_if_invalid,
+        file_charset=default_engine.file_charset,
+        libraries=default_engine.libraries,
+        builtins=[builtin for builtin in default_engine.builtins if builtin not in Engine.default_builtins],
+        autoescape=default_engine.autoescape)
+
+
+def get_email_template_engine():
+    """
+    Get the template engine used to render emails.
+
+    This is the same as the ``django`` template engine, except that compiled
+    templates are always cached, even when ``DEBUG=True``. Templates that
+    are included or extended by email templates (E.g.: the email header and footer)
+    are cached as well.
+
+    Set the ``ATELIER_EMAIL_CACHE_TEMPLATES`` setting to ``False``
+    to use the ``django`` template engine without caching.
+    """
+    global _engine
+    if not getattr(settings, 'ATELIER_EMAIL_CACHE_TEMPLATES', True):
+        return engines['django'].engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _make_email_template_engine()
+    return _engine
+
+
+def clear_email_template_cache():
+    """
+    Clear the cached email templates. Call this if the email templates
+    change while the process is running.
+    """
+    global _engine
+    with _engine_lock:
+        _engine = None
+
+
+@receiver(setting_changed)
+def _clear_email_template_cache_on_setting_changed(setting, **kwargs):
+    if setting in ('TEMPLATES', 'DEBUG', 'INSTALLED_APPS', 'ATELIER_EMAIL_CACHE_TEMPLATES'):
+        clear_email_template_cache()
+
+
+def render_email_template(template_name, context=None):
+    """
+    Render the template with the given ``template_name`` using
+    :func:`.get_email_template_engine`.
+
+    Args:
+        template_name: A template name, or a list of template names (the first existing template is used).
+        context (dict): Template context data.
+
+    Returns:
+        str: The rendered template.
+    """
+    return get_email_template_engine().render_to_string(template_name, context or {})
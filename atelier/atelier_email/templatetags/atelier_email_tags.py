@@ -1,11 +1,10 @@
 from django import template
-from django.template.loader import render_to_string
 
 register = template.Library()
 
 
 class AtelierEmailLinkNode(template.Node):
-    def __init__(self, nodelist, url, linkstyle_context_variable, template_name):
+    def __init__(self, nodelist, url, linkstyle_context_variable, template_name, link_template=None):
         if url[0] in ('"', "'"):
             url = url[1:-1]
         else:
@@ -15,6 +14,26 @@ class AtelierEmailLinkNode(template.Node):
         self.nodelist = nodelist
         self.linkstyle_context_variable = linkstyle_context_variable
         self.template_name = template_name
+        self.link_template = link_template
+
+    def get_link_template(self, context):
+        # Normally compiled at parse time. Templates created without a loader (E.g.:
+        # from_string()) have to compile the link template on the first render.
+        if self.link_template is None:
+            self.link_template = context.template.engine.get_template(self.template_name)
+        return self.link_template
+
+    def build_absolute_uri(self, context, url):
+        if 'request' not in context:
+            return url
+        if isinstance(self.url, template.Variable):
+            return context['request'].build_absolute_uri(url)
+        # Literal urls are the same for all links in the template, so we only
+        # build the absolute uri once per render.
+        cache_key = ('atelier_email_absolute_uri', url)
+        if cache_key not in context.render_context:
+            context.render_context[cache_key] = context['request'].build_absolute_uri(url)
+        return context.render_context[cache_key]
 
     def render(self, context):
         output = self.nodelist.render(context)
@@ -23,16 +42,21 @@ class AtelierEmailLinkNode(template.Node):
             url = self.url.resolve(context)
         else:
             url = self.url
-        if 'request' in context:
-            request = context['request']
-            url = request.build_absolute_uri(url)
+        url = self.build_absolute_uri(context=context, url=url)
 
         linkstyle = context.get(self.linkstyle_context_variable, '')
-        return render_to_string(self.template_name, {
+        return self.get_link_template(context).render(context.new({
             'url': url,
             'label': output.strip(),
             'linkstyle': linkstyle
-        }).strip()
+        })).strip()
+
+
+def _get_link_template(parser, template_name):
+    loader = getattr(parser.origin, 'loader', None)
+    if loader is None:
+        return None
+    return loader.engine.get_template(template_name)
 
 
 def _atelier_email_link(parser, token, linkstyle_context_variable, template_name):
@@ -47,7 +71,8 @@ def _atelier_email_link(parser, token, linkstyle_context_variable, template_name
     parser.delete_first_token()
     return AtelierEmailLinkNode(nodelist=nodelist, url=url,
                                 linkstyle_context_variable=linkstyle_context_variable,
-                                template_name=template_name)
+                                template_name=template_name,
+                                link_template=_get_link_template(parser=parser, template_name=template_name))
 
 
 def _atelier_email_buttonlink(parser, token, linkstyle_context_variable):
@@ -0,0 +1,49 @@
+from django.template import Context, engines
+from django.test import RequestFactory, TestCase
+
+from atelier.atelier_email.templatetags.atelier_email_tags import AtelierEmailLinkNode
+
+
+class TestAtelierEmailLink(TestCase):
+    def _render(self, template_string, context_data):
+        engine = engines['django'].engine
+        return engine.from_string(template_string).render(Context(context_data))
+
+    def test_literal_url(self):
+        output = self._render(
+            '{% load atelier_email_tags %}'
+            '{% atelier_email_link "http://example.com" %}A link{% end_atelier_email_link %}',
+            {'link_style': 'color: red;'})
+        self.assertEqual(output, '<a href="http://example.com" style="color: red;" target="_blank">A link</a>')
+
+    def test_variable_url(self):
+        output = self._render(
+            '{% load atelier_email_tags %}'
+            '{% atelier_email_link url %}A link{% end_atelier_email_link %}',
+            {'url': 'http://example.com/variable'})
+        self.assertIn('href="http://example.com/variable"', output)
+
+    def test_absolute_uri_is_built_once_per_render(self):
+        request = RequestFactory().get('/')
+        calls = []
+        build_absolute_uri = request.build_absolute_uri
+
+        def mock_build_absolute_uri(url):
+            calls.append(url)
+            return build_absolute_uri(url)
+        request.build_absolute_uri = mock_build_absolute_uri
+        output = self._render(
+            '{% load atelier_email_tags %}'
+            '{% atelier_email_link "/a" %}First{% end_atelier_email_link %}'
+            '{% atelier_email_primary_buttonlink "/a" %}Second{% end_atelier_email_primary_buttonlink %}',
+            {'request': request})
+        self.assertEqual(calls, ['/a'])
+        self.assertEqual(output.count('href="http://testserver/a"'), 2)
+
+    def test_link_template_compiled_at_parse_time(self):
+        engine = engines['django'].engine
+        template = engine.get_template('atelier_email/atelier_email_send_testmail/html_message.html')
+        link_nodes = template.nodelist.get_nodes_by_type(AtelierEmailLinkNode)
+        self.assertTrue(link_nodes)
+        for link_node in link_nodes:
+            self.assertIsNotNone(link_node.link_template)
@@ -1,7 +1,20 @@
+from unittest import mock
+
+import html2text
 from django.core import mail
-from django.test import TestCase
+from django.template import engines
+from django.test import TestCase, override_settings
+
+from atelier.atelier_email import emailutils, plaintext, template_cache
+
 
-from atelier.atelier_email import emailutils
+class BulkEmail(emailutils.AbstractEmail):
+    subject_template = 'atelier_email_testapp/abstractemail/subject.txt'
+    html_message_template = 'atelier_email_testapp/abstractemail/html_message.html'
+
+    @classmethod
+    def from_reference(cls, name):
+        return cls(recipient=f'{name.lower()}@example.com', extra_context_data={'name': name})
 
 
 class TestConvertHtmlToPlaintext(TestCase):
@@ -77,3 +90,81 @@ class TestAbstractEmail(TestCase):
             plaintext_message_template = 'atelier_email_testapp/abstractemail/plaintext_message.txt'
         MyEmail(recipient='test@example.com', extra_context_data={'name': 'Test'}).send()
         self.assertEqual(mail.outbox[0].body.strip(), 'Hello PlainText World Test')
+
+
+class TestTemplateCache(TestCase):
+    def setUp(self):
+        template_cache.clear_email_template_cache()
+
+    def tearDown(self):
+        template_cache.clear_email_template_cache()
+
+    def test_render_email_template(self):
+        self.assertEqual(
+            template_cache.render_email_template(
+                'atelier_email_testapp/abstractemail/subject.txt', {'name': 'Test'}).strip(),
+            'Hello, Test')
+
+    def test_templates_are_compiled_once(self):
+        engine = template_cache.get_email_template_engine()
+        self.assertIs(engine.get_template('atelier_email_testapp/abstractemail/subject.txt'),
+                      engine.get_template('atelier_email_testapp/abstractemail/subject.txt'))
+
+    def test_clear_email_template_cache(self):
+        engine = template_cache.get_email_template_engine()
+        template_cache.clear_email_template_cache()
+        self.assertIsNot(template_cache.get_email_template_engine(), engine)
+
+    @override_settings(ATELIER_EMAIL_CACHE_TEMPLATES=False)
+    def test_disabled(self):
+        self.assertIs(template_cache.get_email_template_engine(), engines['django'].engine)
+
+
+class TestHtmlToPlaintextConverter(TestCase):
+    def test_same_as_html2text(self):
+        html = '<p>Hello <strong>World</strong></p><p><a href="http://example.com">Example</a></p>'
+        self.assertEqual(plaintext.HtmlToPlaintextConverter().convert(html), html2text.html2text(html))
+
+    def test_fast_converter(self):
+        converter = plaintext.HtmlToPlaintextConverter(use_fast_converter=True)
+        self.assertEqual(
+            converter.convert('<table><tr><td><p>Hello <em>World</em></p><ul><li>A</li><li>B</li></ul>'
+                              '<a href="http://example.com">Example</a></td></tr></table>'),
+            'Hello _World_\n\n* A\n* B\n\n[Example](http://example.com)\n\n')
+
+    def test_fast_converter_falls_back_to_html2text(self):
+        html = '<pre>Hello</pre>'
+        self.assertFalse(plaintext.FastHtmlToPlaintextParser.can_convert(html))
+        converter = plaintext.HtmlToPlaintextConverter(use_fast_converter=True)
+        self.assertEqual(converter.convert(html), html2text.html2text(html))
+
+
+class TestBulkDelay(TestCase):
+    def test_bulk_delay(self):
+        with mock.patch('atelier.atelier_email.emailutils.django_rq.enqueue',
+                        side_effect=lambda task, *args: task(*args)) as mock_enqueue:
+            job_count = BulkEmail.bulk_delay(({'name': name} for name in ['A', 'B', 'C']), batch_size=2)
+        self.assertEqual(job_count, 2)
+        self.assertEqual(mock_enqueue.call_args_list[0][0][1:],
+                         ('atelier.atelier_email.tests.test_emailutils:BulkEmail', [{'name': 'A'}, {'name': 'B'}]))
+        self.assertEqual([email.subject for email in mail.outbox], ['Hello, A', 'Hello, B', 'Hello, C'])
+        self.assertEqual(mail.outbox[2].to, ['c@example.com'])
+
+    def test_send_bulk_with_delay_raises_after_sending_the_rest(self):
+        with self.assertRaises(emailutils.BulkEmailError) as context:
+            emailutils.send_bulk_with_delay(
+                BulkEmail.get_email_class_path(), [{'name': 'A'}, {'invalid': 'B'}, {'name': 'C'}])
+        self.assertEqual(context.exception.failed_references, [{'invalid': 'B'}])
+        self.assertIsInstance(context.exception.__cause__, TypeError)
+        self.assertEqual([email.subject for email in mail.outbox], ['Hello, A', 'Hello, C'])
+
+    def test_bulk_delay_nothing_to_send(self):
+        with mock.patch('atelier.atelier_email.emailutils.django_rq.enqueue') as mock_enqueue:
+            self.assertEqual(BulkEmail.bulk_delay([]), 0)
+        mock_enqueue.assert_not_called()
+
+    def test_bulk_delay_requires_module_level_class(self):
+        class LocalEmail(emailutils.AbstractEmail):
+            pass
+        with self.assertRaises(ValueError):
+            LocalEmail.bulk_delay([{'recipient': 'test@example.com'}])
@@ -1,13 +1,21 @@
 from django.contrib import admin
 
 from atelier.atelier_messages import basemessage_admin
-from atelier.atelier_messages.models import MessageReceiver, BaseMessage, SystemMessage, BaseMessageAttachment
+from atelier.atelier_messages.models import MessageReceiver, BaseMessage, SystemMessage, BaseMessageAttachment, \
+    MessageReceiverError
 
 
 class MessageReceiverAdmin(admin.ModelAdmin):
+    list_select_related = [
+        'user',
+        'message__sent_by',
+    ]
+    # Counting all receivers gets slow when there are many of them
+    show_full_result_count = False
     raw_id_fields = [
         'message',
         'user',
+        'error',
     ]
     list_display = [
         'id',
@@ -37,6 +45,29 @@ class MessageReceiverAdmin(admin.ModelAdmin):
 
 
 admin.site.register(MessageReceiver, MessageReceiverAdmin)
+
+
+class MessageReceiverErrorAdmin(admin.ModelAdmin):
+    list_display = [
+        'id',
+        'exception_type',
+        'fingerprint',
+        'created_datetime',
+    ]
+    search_fields = [
+        '=id',
+        '=fingerprint',
+        'exception_type',
+    ]
+    readonly_fields = [
+        'fingerprint',
+        'exception_type',
+        'exception_traceback',
+        'created_datetime',
+    ]
+
+
+admin.site.register(MessageReceiverError, MessageReceiverErrorAdmin)
 admin.site.register(BaseMessage, basemessage_admin.BaseMessageAdmin)
 
 
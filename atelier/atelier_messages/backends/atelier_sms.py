@@ -1,4 +1,7 @@
-from ievv_opensource.ievv_sms.sms_registry import send_sms
+import requests
+from django.conf import settings
+from ievv_opensource.ievv_sms import sms_registry
+from requests.adapters import HTTPAdapter
 
 from atelier.atelier_messages.backends import base
 
@@ -6,9 +9,28 @@ from atelier.atelier_messages.backends import base
 class AtelierSmsMessageSender(base.AbstractMessageSender):
     """
     Send SMS using atelier_sms.
+
+    Sends with the default ievv_sms backend through a pool of :meth:`.get_max_workers` threads.
+    If the backend class has ``supports_requests_session = True`` (like the linkmobility backend),
+    all the receivers of a message share one ``requests.Session`` (passed to the backend as the
+    ``requests_session`` kwarg).
+
+    If the backend returns a dict from ``send()`` (like the linkmobility backend does),
+    it is stored in the ``status_data`` of the receiver.
+
+    Optional settings:
+
+    - ``ATELIER_MESSAGES_SMS_MAX_WORKERS``: Number of concurrent SMS requests.
+      Defaults to ``ATELIER_MESSAGES_SEND_MAX_WORKERS``.
     """
     message_type = 'sms'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = None
+        self.sms_backend_class = None
+        self.sms_kwargs = None
+
     @property
     def send_as(self):
         """
@@ -20,7 +42,34 @@ class AtelierSmsMessageSender(base.AbstractMessageSender):
             .get('sms', {}) \
             .get('value', None)
 
+    def get_max_workers(self):
+        return getattr(settings, 'ATELIER_MESSAGES_SMS_MAX_WORKERS', None) or super().get_max_workers()
+
+    def make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.get_max_workers())
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def open_connection(self):
+        self.sms_backend_class = sms_registry.Registry.get_instance().get_backend_class_by_id(backend_id=None)
+        # The same for all receivers, so we only look them up once per message.
+        self.sms_kwargs = {
+            'message': self.message.message_content_plain,
+            'send_as': self.send_as,
+        }
+        if getattr(self.sms_backend_class, 'supports_requests_session', False):
+            self.session = self.make_session()
+            self.sms_kwargs['requests_session'] = self.session
+
+    def close_connection(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
     def send_message(self, message_receiver):
-        send_sms(phone_number=message_receiver.send_to,
-                 message=message_receiver.message.message_content_plain,
-                 send_as=self.send_as)
+        sms_backend = self.sms_backend_class(phone_number=message_receiver.send_to, **self.sms_kwargs)
+        result = sms_backend.send()
+        if isinstance(result, dict):
+            message_receiver.status_data = result
@@ -1,17 +1,78 @@
+import itertools
 import logging
-import traceback
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.db import connections
+from django.db.models import QuerySet
 from django.utils import timezone
 
-from atelier.atelier_messages.models import MessageReceiver
+from atelier.atelier_messages import messageframework_settings, metrics
+from atelier.atelier_messages.models import MessageReceiver, MessageReceiverError
+
+
+class DatabaseConnectionClosingThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ``ThreadPoolExecutor`` that closes the database connections of each of its
+    worker threads once, when the executor is shut down.
+
+    Worker threads get their own database connections if the tasks touch the database.
+    Closing them after each task would reconnect once per task, so the initializer of
+    each worker thread records the connections of the thread, and they are closed
+    when all the tasks are done.
+    """
+    def __init__(self, *args, **kwargs):
+        self._worker_database_connections = []
+        self._worker_database_connections_lock = threading.Lock()
+        super().__init__(*args, initializer=self._record_worker_database_connections, **kwargs)
+
+    def _record_worker_database_connections(self):
+        # The database connection objects are thread local, and created lazily, so these are
+        # the objects the tasks in this thread will use.
+        with self._worker_database_connections_lock:
+            self._worker_database_connections.extend(connections.all())
+
+    def _close_worker_database_connections(self):
+        with self._worker_database_connections_lock:
+            worker_database_connections = self._worker_database_connections
+            self._worker_database_connections = []
+        for connection in worker_database_connections:
+            # The connection belongs to a worker thread, so we must allow using it from this thread.
+            connection.inc_thread_sharing()
+            try:
+                connection.close()
+            finally:
+                connection.dec_thread_sharing()
+
+    def shutdown(self, wait=True, **kwargs):
+        super().shutdown(wait=wait, **kwargs)
+        if wait:
+            self._close_worker_database_connections()
 
 
 class AbstractMessageSender(object):
     """
     An abstract class for sending message. Must be subclassed.
+
+    Receivers are sent in chunks of :meth:`.get_chunk_size` receivers. Each chunk is
+    sent through a pool of :meth:`.get_max_workers` threads, and the resulting
+    status of the receivers in the chunk is written back with a single ``bulk_update``.
     """
     message_type = None
 
+    #: Number of receivers to load, send and write back per chunk.
+    #: Defaults to the ``ATELIER_MESSAGES_SEND_CHUNK_SIZE`` setting if ``None``.
+    chunk_size = None
+
+    #: Max number of receivers to send to concurrently.
+    #: Defaults to the ``ATELIER_MESSAGES_SEND_MAX_WORKERS`` setting if ``None``.
+    #: Only set this above ``1`` if :meth:`.send_message` is thread safe.
+    max_workers = None
+
+    #: The :class:`.MessageReceiver` fields written back after each chunk.
+    message_receiver_update_fields = ['status', 'status_data', 'sent_datetime', 'error']
+
     def __init__(self, message, message_receivers):
         self.message = message
         self.message_receivers = message_receivers
@@ -31,6 +92,32 @@ class AbstractMessageSender(object):
             raise ValueError('{}.message_type is None'.format(self.__class__.__name__))
         return self.message_type
 
+    def get_chunk_size(self):
+        """
+        Get the number of receivers to send per chunk.
+        """
+        return self.chunk_size or messageframework_settings.get_send_chunk_size()
+
+    def get_max_workers(self):
+        """
+        Get the max number of concurrent sends.
+        """
+        return self.max_workers or messageframework_settings.get_send_max_workers()
+
+    def open_connection(self):
+        """
+        Called once before sending to any of the receivers.
+
+        Override this to set up resources shared by all the sends in
+        :meth:`.send_messages`, like HTTP sessions or SMTP connections.
+        """
+
+    def close_connection(self):
+        """
+        Called once after sending to all the receivers, even if
+        sending crashes. Release anything set up in :meth:`.open_connection` here.
+        """
+
     def send_message(self, message_receiver):
         """
         Implement the sending of a message.
@@ -40,28 +127,142 @@ class AbstractMessageSender(object):
             def send_message(self, message_receiver):
                 # Create email or sms for messagereceiver and send it from ``self.message``.
 
+        Must not save ``message_receiver``. Changes to the fields in
+        :obj:`.message_receiver_update_fields` are written back in bulk.
         """
         raise NotImplementedError()
 
+    def iter_message_receiver_chunks(self):
+        """
+        Iterate over ``self.message_receivers`` yielding lists of at most
+        :meth:`.get_chunk_size` receivers.
+
+        QuerySets are paginated by id, so we never keep more than
+        one chunk of receivers in memory.
+        """
+        chunk_size = self.get_chunk_size()
+        if isinstance(self.message_receivers, QuerySet):
+            # status_data is reset before sending, so we do not need to load it
+            queryset = self.message_receivers.order_by('id').defer('status_data')
+            last_id = None
+            while True:
+                chunk_queryset = queryset
+                if last_id is not None:
+                    chunk_queryset = chunk_queryset.filter(id__gt=last_id)
+                chunk = list(chunk_queryset[:chunk_size])
+                if not chunk:
+                    break
+                yield chunk
+                if len(chunk) < chunk_size:
+                    break
+                last_id = chunk[-1].id
+        else:
+            iterator = iter(self.message_receivers)
+            while True:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+    def _send_to_message_receiver(self, message_receiver):
+        """
+        Send to a single receiver, and update the status fields of the receiver
+        (without saving it).
+
+        Returns:
+            tuple: ``None`` if sending succeeded, and ``(fingerprint, exception_type, exception_traceback)``
+            if it failed. See :class:`.MessageReceiverError`.
+        """
+        message_receiver.status_data = {}
+        message_receiver.error_id = None
+        try:
+            self.send_message(message_receiver=message_receiver)
+        except Exception as exception:
+            self.logger.exception('Sending message to MessageReceiver#%s failed with: %s',
+                                  message_receiver.id, exception)
+            message_receiver.status = MessageReceiver.STATUS_CHOICES.ERROR.value
+            message_receiver.status_data = {
+                'error_message': str(exception),
+            }
+            return MessageReceiverError.objects.describe_exception(exception)
+        else:
+            message_receiver.status = MessageReceiver.STATUS_CHOICES.SENT.value
+            message_receiver.sent_datetime = timezone.now()
+            return None
+
+    def _send_to_message_receiver_timed(self, message_receiver):
+        """
+        Same as :meth:`._send_to_message_receiver`, but returns
+        ``(error, seconds used)``.
+        """
+        start = time.perf_counter()
+        error = self._send_to_message_receiver(message_receiver=message_receiver)
+        return error, time.perf_counter() - start
+
+    def send_message_receiver_chunk(self, message_receivers, executor=None):
+        """
+        Send to a chunk of receivers, and write the result back to the database
+        with a single ``bulk_update``.
+
+        Errors are deduplicated, so each distinct traceback in the chunk
+        is only stored once (see :class:`.MessageReceiverError`).
+
+        Args:
+            message_receivers (list): List of :class:`.MessageReceiver` objects.
+            executor: An optional ``concurrent.futures.Executor``. If ``None``,
+                the receivers are sent one by one in the calling thread.
+        """
+        if executor is None:
+            results = [self._send_to_message_receiver_timed(message_receiver=message_receiver)
+                       for message_receiver in message_receivers]
+        else:
+            results = list(executor.map(self._send_to_message_receiver_timed, message_receivers))
+        errors = [error for error, seconds in results]
+        error_ids = MessageReceiverError.objects.get_or_create_many({
+            fingerprint: (exception_type, exception_traceback)
+            for fingerprint, exception_type, exception_traceback in filter(None, errors)
+        })
+        for message_receiver, error in zip(message_receivers, errors):
+            if error is not None:
+                message_receiver.error_id = error_ids[error[0]]
+        MessageReceiver.objects.bulk_update(message_receivers, fields=self.message_receiver_update_fields)
+        self.record_chunk_metrics(results)
+
+    def record_chunk_metrics(self, results):
+        """
+        Record the send latency and error metrics for a chunk (see :mod:`atelier.atelier_messages.metrics`).
+        Metrics are recorded once per chunk instead of once per receiver to keep the overhead low.
+
+        Args:
+            results (list): ``(error, seconds)`` tuple for each receiver in the chunk.
+        """
+        if not metrics.is_enabled() or not results:
+            return
+        backend = self.__class__.__name__
+        message_class = self.message.__class__.get_message_class_string()
+        metrics.observe_many(metrics.SEND_SECONDS, [seconds for error, seconds in results],
+                             backend=backend, message_type=self.get_message_type())
+        error_count = sum(1 for error, seconds in results if error is not None)
+        for status, count in (('error', error_count), ('sent', len(results) - error_count)):
+            if count:
+                metrics.increment(metrics.SENDS_TOTAL, count, backend=backend,
+                                  message_class=message_class, status=status)
+
     def send_messages(self):
         """
         Sends messages to message receivers.
 
         Do not override this method, override :meth:`~.AbstractMessageSender.send_message` instead.
         """
-        for message_receiver in self.message_receivers:
-            try:
-                self.send_message(message_receiver=message_receiver)
-            except Exception as exception:
-                self.logger.exception('Sending message to MessageReceiver#%s failed with: %s',
-                                      message_receiver.id, exception)
-                message_receiver.status = MessageReceiver.STATUS_CHOICES.ERROR.value
-                message_receiver.status_data = {
-                    'error_message': str(exception),
-                    'exception_traceback': traceback.format_exc()
-                }
-                message_receiver.save()
+        max_workers = self.get_max_workers()
+        self.open_connection()
+        try:
+            if max_workers > 1:
+                with DatabaseConnectionClosingThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for message_receivers in self.iter_message_receiver_chunks():
+                        self.send_message_receiver_chunk(message_receivers=message_receivers, executor=executor)
             else:
-                message_receiver.status = MessageReceiver.STATUS_CHOICES.SENT.value
-                message_receiver.sent_datetime = timezone.now()
-                message_receiver.save()
+                for message_receivers in self.iter_message_receiver_chunks():
+                    self.send_message_receiver_chunk(message_receivers=message_receivers)
+        finally:
+            self.close_connection()
@@ -1,9 +1,83 @@
+import smtplib
+import socket
+import threading
+
+from django.core import mail
+
 from atelier.atelier_messages.backends import base
 
 
+class DjangoEmailNotSentError(Exception):
+    """
+    Raised when the email backend reports that an email was not sent.
+    """
+
+
 class DjangoEmailMessageSender(base.AbstractMessageSender):
+    """
+    Send email using the Django email backend (the ``EMAIL_BACKEND`` setting).
+
+    Instead of opening a new connection for each email, each sending thread
+    opens one connection that is reused for all the emails it sends in a
+    :meth:`.send_messages` run. If the connection is lost, we reconnect
+    and retry the email once.
+    """
     message_type = 'email'
 
+    #: Exceptions from the email backend that makes us reconnect and retry sending the email.
+    reconnect_exceptions = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def open_connection(self):
+        self._local = threading.local()
+        self._connections = []
+
+    def close_connection(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def get_connection(self):
+        """
+        Get the email backend connection for the current thread. Opened on first use.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = mail.get_connection()
+            connection.open()
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def reconnect(self, connection):
+        connection.close()
+        connection.open()
+
+    def send_email_message(self, email_message):
+        """
+        Send the given :class:`django.core.mail.EmailMessage` over the connection
+        for the current thread.
+
+        Raises:
+            DjangoEmailNotSentError: If the email backend did not send the email.
+        """
+        connection = self.get_connection()
+        try:
+            sent_count = connection.send_messages([email_message])
+        except self.reconnect_exceptions as exception:
+            self.logger.warning('Lost the email backend connection (%s). Reconnecting.', exception)
+            self.reconnect(connection)
+            sent_count = connection.send_messages([email_message])
+        if not sent_count:
+            raise DjangoEmailNotSentError(f'The email backend did not send the email to {email_message.to}.')
+
     def send_message(self, message_receiver):
         email = self.message.prepare_email(message_receiver=message_receiver)
-        email.send()
+        self.send_email_message(email_message=email.make_email_message())
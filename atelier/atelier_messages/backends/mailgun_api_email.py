@@ -1,29 +1,138 @@
+import threading
+
 import requests
 from django.conf import settings
+from django.db import transaction
+from requests.adapters import HTTPAdapter
 
+from atelier.atelier_messages import ratelimit
 from atelier.atelier_messages.backends import base
+from atelier.atelier_messages.models import BaseMessage
 
 
 class MailgunApiEmailMessageSender(base.AbstractMessageSender):
+    """
+    Send email using the Mailgun API.
+
+    All the requests for a :meth:`.send_messages` run go through one
+    ``requests.Session``, so the TCP and TLS connections to Mailgun are
+    kept alive and reused across receivers.
+
+    Optional settings:
+
+    - ``MAILGUN_API_MAX_WORKERS``: Number of concurrent requests to Mailgun.
+      Defaults to ``ATELIER_MESSAGES_SEND_MAX_WORKERS``.
+    - ``MAILGUN_API_RATE_LIMIT``: Max number of requests per second. No limit if not set.
+    - ``MAILGUN_API_RATE_LIMIT_BURST``: Max burst of requests above the rate limit.
+      Defaults to ``MAILGUN_API_RATE_LIMIT``.
+
+    The Mailgun message id is stored in :obj:`.MessageReceiver.esp_message_id`, so that
+    delivery webhooks can update the status of each receiver (see
+    :mod:`atelier.atelier_messages.esp_events`).
+
+    The ok status and sending error of the message are merged into the message
+    when all the receivers are sent (see :meth:`.save_message_esp_status`).
+    """
     message_type = 'email'
+    message_receiver_update_fields = base.AbstractMessageSender.message_receiver_update_fields + ['esp_message_id']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = None
+        self.rate_limiter = None
+        self._message_lock = threading.Lock()
+        self._esp_ok_status = None
+        self._sending_error = None
+
+    def get_max_workers(self):
+        return getattr(settings, 'MAILGUN_API_MAX_WORKERS', None) or super().get_max_workers()
+
+    def make_rate_limiter(self):
+        rate_limit = getattr(settings, 'MAILGUN_API_RATE_LIMIT', None)
+        if not rate_limit:
+            return None
+        return ratelimit.TokenBucket(
+            rate=rate_limit,
+            capacity=getattr(settings, 'MAILGUN_API_RATE_LIMIT_BURST', None))
+
+    def make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.get_max_workers())
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def open_connection(self):
+        self.session = self.make_session()
+        self.session.auth = ('api', settings.MAILGUN_API_KEY)
+        self.rate_limiter = self.make_rate_limiter()
+
+    def close_connection(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+        self.save_message_esp_status()
 
-    def get_result_json_id(self, result):
+    def save_message_esp_status(self):
+        """
+        Merge the ok status and sending error of the receivers sent by this sender into the message.
+
+        Chunks of the same message may be sent concurrently by
+        :func:`~atelier.atelier_messages.tasks.send_message_chunk` jobs, so we lock and
+        re-read the message instead of saving our own copy of it.
+        An ``esp_ok_status`` of ``False`` is never changed back to ``True``.
+        """
+        if self._esp_ok_status is None:
+            return
+        with transaction.atomic():
+            message = BaseMessage.objects \
+                .select_for_update() \
+                .only('id', 'esp_ok_status', 'appspecific_metadata') \
+                .get(id=self.message.id)
+            message.esp_ok_status = self._esp_ok_status and message.esp_ok_status is not False
+            if self._sending_error is not None:
+                message.appspecific_metadata = dict(message.appspecific_metadata or {},
+                                                    mailgun_sending_error=self._sending_error)
+            message.save(update_fields=['esp_ok_status', 'appspecific_metadata'])
+        self.message.esp_ok_status = message.esp_ok_status
+        self.message.appspecific_metadata = message.appspecific_metadata
+
+    def get_result_json(self, result):
+        """
+        Get the JSON body of the Mailgun API response, or ``None`` if it is not
+        a JSON object (E.g.: an HTML error page from a proxy).
+        """
         try:
             result_json = result.json()
-            esp_message_id = result_json.get('id')
-            if esp_message_id.startswith('<'):
-                esp_message_id = esp_message_id[1:]
-            if esp_message_id.endswith('>'):
-                esp_message_id = esp_message_id[:-1]
-            return esp_message_id
-        except Exception:
+        except ValueError:
             return None
+        if not isinstance(result_json, dict):
+            return None
+        return result_json
 
-    def send_message(self, message_receiver):
-        email = self.message.prepare_email(message_receiver=message_receiver)
-        result = requests.post(
+    def get_result_json_id(self, result_json):
+        esp_message_id = (result_json or {}).get('id')
+        if not isinstance(esp_message_id, str):
+            return None
+        if esp_message_id.startswith('<'):
+            esp_message_id = esp_message_id[1:]
+        if esp_message_id.endswith('>'):
+            esp_message_id = esp_message_id[:-1]
+        return esp_message_id
+
+    def post_email(self, message_receiver, email):
+        """
+        Post the given ``email`` to the Mailgun API.
+
+        Requires :meth:`.open_connection` to be called first (:meth:`.send_messages` does that).
+
+        The result is stored in the ``esp_message_id`` and ``status_data`` of the ``message_receiver``,
+        and the ok status is merged into the message when all receivers are sent.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        result = self.session.post(
             f'{settings.MAILGUN_API_BASE_URL}/messages',
-            auth=('api', settings.MAILGUN_API_KEY),
             data={
                 'from': email.get_from_email(),
                 'to': email.get_recipient_list(),
@@ -32,11 +141,23 @@ class MailgunApiEmailMessageSender(base.AbstractMessageSender):
                 'html': email.render_html_message(),
             }
         )
-        self.message.esp_ok_status = result.ok
-        if not self.message.esp_ok_status:
-            self.message.appspecific_metadata['mailgun_sending_error'] = {
-                'about': 'Mailgun API reached, but returned "ok" was False, which means error!',
-                'data': result.json(),
-            }
-        self.message.esp_message_id = self.get_result_json_id(result)
-        self.message.save()
+        result_json = self.get_result_json(result)
+        esp_message_id = self.get_result_json_id(result_json)
+        message_receiver.esp_message_id = esp_message_id
+        message_receiver.status_data = {
+            'esp_message_id': esp_message_id,
+            'esp_ok_status': result.ok,
+            'esp_status_code': result.status_code,
+        }
+        with self._message_lock:
+            self._esp_ok_status = result.ok and self._esp_ok_status is not False
+            if not result.ok:
+                self._sending_error = {
+                    'about': 'Mailgun API reached, but returned "ok" was False, which means error!',
+                    'status_code': result.status_code,
+                    'data': result_json if result_json is not None else result.text[:1000],
+                }
+
+    def send_message(self, message_receiver):
+        email = self.message.prepare_email(message_receiver=message_receiver)
+        self.post_email(message_receiver=message_receiver, email=email)
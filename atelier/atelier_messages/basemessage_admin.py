@@ -2,6 +2,11 @@ from django.contrib import admin
 
 
 class BaseMessageAdmin(admin.ModelAdmin):
+    list_select_related = [
+        'sent_by',
+    ]
+    # Counting all messages gets slow when there are many of them
+    show_full_result_count = False
     raw_id_fields = [
         'sent_by',
         'created_by'
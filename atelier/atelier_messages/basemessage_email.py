@@ -1,23 +1,105 @@
+import re
+
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.utils.html import escape
 
+from atelier.atelier_email import template_cache
 from atelier.atelier_email.emailutils import AbstractEmail
 
 
+class PrerenderedEmail(object):
+    """
+    The subject, HTML message and plaintext message of an email rendered once
+    for all the receivers of a message.
+
+    The email is rendered for a receiver with :obj:`.SEND_TO_PLACEHOLDER` as ``send_to``,
+    and the placeholder is replaced with the ``send_to`` of each receiver
+    when the email is sent. See :obj:`atelier.atelier_messages.models.BaseMessage.render_email_once`.
+
+    This only works if the templates output ``send_to`` as is. If a template transforms it
+    (E.g.: with ``|lower`` or ``|truncatechars``, or by building a URL from it), the
+    placeholder is not found and every receiver gets the transformed placeholder.
+    :meth:`.has_transformed_send_to` detects case changes of the placeholder.
+    """
+
+    #: Used as ``send_to`` for the receiver we render the email for.
+    #: Only letters, so it is not changed by HTML escaping or the HTML to plaintext conversion.
+    SEND_TO_PLACEHOLDER = 'atelierMessagesSendToPlaceholder'
+
+    def __init__(self, subject, html_message, plaintext_message):
+        self.subject = subject
+        self.html_message = html_message
+        self.plaintext_message = plaintext_message
+
+    @classmethod
+    def from_email(cls, email):
+        """
+        Render the given :class:`atelier.atelier_email.emailutils.AbstractEmail`.
+        """
+        send_mail_kwargs = email.get_send_mail_kwargs()
+        return cls(subject=send_mail_kwargs['subject'],
+                   html_message=send_mail_kwargs['html_message'],
+                   plaintext_message=send_mail_kwargs['message'])
+
+    def has_transformed_send_to(self):
+        """
+        Returns ``True`` if the rendered email contains the placeholder with
+        changed case (E.g.: from the ``|lower`` filter), which means that the email
+        can not be rendered once for all the receivers.
+        """
+        pattern = re.compile(re.escape(self.SEND_TO_PLACEHOLDER), re.IGNORECASE)
+        return any(
+            match != self.SEND_TO_PLACEHOLDER
+            for text in (self.subject, self.html_message, self.plaintext_message)
+            for match in pattern.findall(text))
+
+    def render_subject(self, send_to):
+        return self.subject.replace(self.SEND_TO_PLACEHOLDER, send_to)
+
+    def render_html_message(self, send_to):
+        return self.html_message.replace(self.SEND_TO_PLACEHOLDER, escape(send_to))
+
+    def render_plaintext_message(self, send_to):
+        return self.plaintext_message.replace(self.SEND_TO_PLACEHOLDER, send_to)
+
+
 class BaseMessageEmail(AbstractEmail):
     html_message_template = 'atelier_messages/basemessage_email/basemessage_email.html'
     unsubscribe_message_template = None
 
-    def __init__(self, message, message_receiver, email_heading=None, include_header=True, *args, **kwargs):
+    #: Accepts the ``prerendered_email`` kwarg. See
+    #: :obj:`atelier.atelier_messages.models.BaseMessage.render_email_once`.
+    supports_prerendered_email = True
+
+    def __init__(self, message, message_receiver, email_heading=None, include_header=True,
+                 prerendered_email=None, *args, **kwargs):
+        """
+        Parameters:
+            prerendered_email (PrerenderedEmail): If provided, the subject and messages are
+                taken from this instead of being rendered from the templates.
+        """
         self.message = message
         self.message_receiver = message_receiver
         self.email_heading = email_heading
         self.include_header = include_header
+        self.prerendered_email = prerendered_email
         super().__init__(*args, **kwargs)
 
     def render_subject(self):
+        if self.prerendered_email:
+            return self.prerendered_email.render_subject(send_to=self.message_receiver.send_to)
         return self.message.subject
 
+    def render_html_message(self):
+        if self.prerendered_email:
+            return self.prerendered_email.render_html_message(send_to=self.message_receiver.send_to)
+        return super().render_html_message()
+
+    def render_plaintext_message(self):
+        if self.prerendered_email:
+            return self.prerendered_email.render_plaintext_message(send_to=self.message_receiver.send_to)
+        return super().render_plaintext_message()
+
     def get_context_data(self):
         context_data = super().get_context_data()
         context_data['message'] = self.message
@@ -35,5 +117,5 @@ class BaseMessageEmail(AbstractEmail):
     def render_unsubscribe_message(self):
         if not self.unsubscribe_message_template:
             return ''
-        return render_to_string(self.unsubscribe_message_template,
-                                self.get_unsubscribe_message_context_data()).strip()
+        return template_cache.render_email_template(self.unsubscribe_message_template,
+                                                    self.get_unsubscribe_message_context_data()).strip()
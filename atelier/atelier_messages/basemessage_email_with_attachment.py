@@ -1,4 +1,4 @@
-from django.template.loader import render_to_string
+from atelier.atelier_email import template_cache
 from atelier.atelier_email.emailutils import AbstractEmail
 
 
@@ -34,5 +34,5 @@ class BaseMessageEmailWithAttachments(AbstractEmail):
     def render_unsubscribe_message(self):
         if not self.unsubscribe_message_template:
             return ''
-        return render_to_string(self.unsubscribe_message_template,
-                                self.get_unsubscribe_message_context_data()).strip()
+        return template_cache.render_email_template(self.unsubscribe_message_template,
+                                                    self.get_unsubscribe_message_context_data()).strip()
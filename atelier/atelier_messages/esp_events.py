@@ -0,0 +1,188 @@
+"""
+Delivery status events from ESPs (Email Service Providers).
+
+Webhook requests only verify the event and push it to a Redis list (see :class:`.EspEventBuffer`).
+The :func:`atelier.atelier_messages.tasks.process_esp_events` RQ task pops the
+buffered events in batches, and updates the status of the matching
+:class:`~atelier.atelier_messages.models.MessageReceiver` objects with one query
+to find the receivers and one bulk update per batch. This means that a burst
+of webhook requests does not cause a database write per event.
+"""
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+
+import django_rq
+
+from atelier.atelier_messages import messageframework_settings
+
+
+#: Max age of the timestamp of a Mailgun webhook request. Older requests are rejected to
+#: avoid replay attacks.
+MAILGUN_SIGNATURE_MAX_AGE_SECONDS = 15 * 60
+
+
+def verify_mailgun_signature(signing_key, timestamp, token, signature, now=None):
+    """
+    Verify the signature of a Mailgun webhook request.
+
+    Args:
+        signing_key (str): The Mailgun HTTP webhook signing key.
+        timestamp (str): The ``signature.timestamp`` from the request.
+        token (str): The ``signature.token`` from the request.
+        signature (str): The ``signature.signature`` from the request.
+        now (float): The current unix timestamp. Defaults to ``time.time()``.
+
+    Returns:
+        bool: ``True`` if the signature is valid, and the timestamp is not
+        older than :obj:`.MAILGUN_SIGNATURE_MAX_AGE_SECONDS`.
+    """
+    if not (signing_key and timestamp and token and signature):
+        return False
+    try:
+        age = (now or time.time()) - float(timestamp)
+    except (TypeError, ValueError):
+        return False
+    if abs(age) > MAILGUN_SIGNATURE_MAX_AGE_SECONDS:
+        return False
+    expected_signature = hmac.new(
+        key=signing_key.encode('utf-8'),
+        msg='{}{}'.format(timestamp, token).encode('utf-8'),
+        digestmod=hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected_signature, str(signature))
+
+
+def parse_mailgun_event(event_data):
+    """
+    Parse the ``event-data`` of a Mailgun webhook request.
+
+    Only ``delivered`` events and ``failed`` events with ``permanent`` severity
+    change the status of a receiver. Temporary failures are retried by Mailgun,
+    so they are ignored.
+
+    Returns:
+        dict: A compact event dict for :func:`.apply_esp_events`, or ``None`` if
+        the event should be ignored.
+    """
+    event = event_data.get('event')
+    if event == 'delivered':
+        status = 'received'
+    elif event == 'failed' and event_data.get('severity') == 'permanent':
+        status = 'error'
+    else:
+        return None
+    esp_message_id = ((event_data.get('message') or {}).get('headers') or {}).get('message-id')
+    if not esp_message_id:
+        return None
+    delivery_status = event_data.get('delivery-status') or {}
+    return {
+        'esp_message_id': esp_message_id.strip('<>'),
+        'status': status,
+        'event': event,
+        'timestamp': event_data.get('timestamp'),
+        'reason': event_data.get('reason'),
+        'delivery_status_code': delivery_status.get('code'),
+        'delivery_status_message': delivery_status.get('message') or delivery_status.get('description'),
+    }
+
+
+def apply_esp_events(events):
+    """
+    Update the :class:`~atelier.atelier_messages.models.MessageReceiver` objects
+    matching the ``esp_message_id`` of the given events.
+
+    Uses one query to find the receivers, and one bulk update. If there
+    is more than one event for a receiver, the event with the latest timestamp wins.
+
+    Args:
+        events: Iterable of event dicts (see :func:`.parse_mailgun_event`).
+
+    Returns:
+        tuple: ``(updated_count, unmatched_events)`` where ``unmatched_events`` is a list
+        of the events with no matching receiver.
+    """
+    from atelier.atelier_messages.models import MessageReceiver
+
+    latest_events = {}
+    for event in events:
+        previous_event = latest_events.get(event['esp_message_id'])
+        if previous_event is None or (event.get('timestamp') or 0) >= (previous_event.get('timestamp') or 0):
+            latest_events[event['esp_message_id']] = event
+    if not latest_events:
+        return 0, []
+
+    message_receivers = list(
+        MessageReceiver.objects
+        .filter(esp_message_id__in=list(latest_events.keys()))
+        .only('id', 'esp_message_id', 'status', 'status_data'))
+    matched_esp_message_ids = set()
+    for message_receiver in message_receivers:
+        event = latest_events[message_receiver.esp_message_id]
+        matched_esp_message_ids.add(message_receiver.esp_message_id)
+        message_receiver.status = event['status']
+        message_receiver.status_data = dict(
+            message_receiver.status_data or {},
+            esp_event=event['event'],
+            esp_event_timestamp=event.get('timestamp'),
+            esp_event_reason=event.get('reason'),
+            esp_delivery_status_code=event.get('delivery_status_code'),
+            esp_delivery_status_message=event.get('delivery_status_message'))
+    if message_receivers:
+        MessageReceiver.objects.bulk_update(message_receivers, fields=['status', 'status_data'])
+    unmatched_events = [event for esp_message_id, event in latest_events.items()
+                        if esp_message_id not in matched_esp_message_ids]
+    return len(message_receivers), unmatched_events
+
+
+class EspEventBuffer(object):
+    """
+    A buffer for ESP events in a Redis list.
+
+    Uses the Redis connection of the message framework RQ queue.
+    """
+    #: The Redis key for the list of buffered events.
+    key = 'atelier_messages:esp_events'
+
+    #: The Redis key used to make sure only one :func:`~atelier.atelier_messages.tasks.process_esp_events`
+    #: job is scheduled at a time.
+    scheduled_key = 'atelier_messages:esp_events:scheduled'
+
+    def __init__(self, connection=None):
+        self.connection = connection or django_rq.get_connection(messageframework_settings.get_rq_queue_name())
+
+    def push(self, *events):
+        if events:
+            self.connection.rpush(self.key, *[json.dumps(event) for event in events])
+
+    def pop_batch(self, batch_size):
+        """
+        Remove and return up to ``batch_size`` events from the start of the buffer.
+        """
+        pipeline = self.connection.pipeline(transaction=True)
+        pipeline.lrange(self.key, 0, batch_size - 1)
+        pipeline.ltrim(self.key, batch_size, -1)
+        raw_events, _ = pipeline.execute()
+        return [json.loads(raw_event) for raw_event in raw_events]
+
+    def __len__(self):
+        return self.connection.llen(self.key)
+
+    def schedule_processing(self, delay=None):
+        """
+        Schedule :func:`~atelier.atelier_messages.tasks.process_esp_events` to run
+        after ``delay`` seconds, unless it is already scheduled. Events pushed
+        during the delay are handled by the same job.
+
+        Requires an RQ worker running with ``--with-scheduler``.
+        """
+        from atelier.atelier_messages.tasks import process_esp_events
+        if delay is None:
+            delay = messageframework_settings.get_esp_events_process_delay()
+        if self.connection.set(self.scheduled_key, 1, nx=True, ex=max(int(delay), 1) + 60):
+            django_rq.get_queue(messageframework_settings.get_rq_queue_name()).enqueue_in(
+                timedelta(seconds=delay), process_esp_events)
+
+    def clear_scheduled(self):
+        self.connection.delete(self.scheduled_key)
@@ -1,9 +1,17 @@
+import functools
+
 import requests
 from django.conf import settings
 
 from ievv_opensource.ievv_sms import sms_registry
 
 
+class LinkMobilityError(Exception):
+    """
+    Raised by :meth:`.Backend.send` when linkmobility does not accept the message.
+    """
+
+
 class Backend(sms_registry.AbstractSmsBackend):
     """
     A linkmobility (https://linkmobility.com) backend.
@@ -27,12 +35,19 @@ class Backend(sms_registry.AbstractSmsBackend):
 
     If this is not set, it defaults to 'https://wsx.sp247.net/sms'
 
+    Pass a ``requests.Session`` as the ``requests_session`` kwarg to reuse
+    connections to linkmobility when sending many messages.
+
     The backend_id for this backend is ``linkmobility``.
     """
     CHARACTER_REPLACE_MAP = {
         '–': '-'
     }
 
+    #: Accepts the ``requests_session`` kwarg. See
+    #: :class:`atelier.atelier_messages.backends.atelier_sms.AtelierSmsMessageSender`.
+    supports_requests_session = True
+
     @classmethod
     def get_backend_id(cls):
         return 'linkmobility'
@@ -42,11 +57,13 @@ class Backend(sms_registry.AbstractSmsBackend):
                  linkmobility_username=None,
                  linkmobility_password=None,
                  linkmobility_default_country_code=None,
+                 requests_session=None,
                  **kwargs):
         self._linkmobility_sender = linkmobility_sender
         self._linkmobility_username = linkmobility_username
         self._linkmobility_password = linkmobility_password
         self._linkmobility_default_country_code = linkmobility_default_country_code
+        self.requests_session = requests_session
         super().__init__(phone_number=phone_number, message=message, **kwargs)
 
     @property
@@ -69,16 +86,24 @@ class Backend(sms_registry.AbstractSmsBackend):
     def default_country_code(self):
         return self._linkmobility_default_country_code or settings.LINKMOBILITY_DEFAULT_COUNTRY_CODE
 
-    def replace_message_characters(self, message):
-        for from_char, to_char in self.CHARACTER_REPLACE_MAP.items():
+    @classmethod
+    def replace_message_characters(cls, message):
+        for from_char, to_char in cls.CHARACTER_REPLACE_MAP.items():
             message = message.replace(from_char, to_char)
         return message
 
-    def clean_message(self, message):
-        message = self.replace_message_characters(message)
+    @classmethod
+    @functools.lru_cache(maxsize=32)
+    def _clean_message(cls, message):
+        message = cls.replace_message_characters(message)
         message = message.encode('latin-1', errors='ignore').decode('latin-1')
         return message
 
+    def clean_message(self, message):
+        # Cached since the same message is cleaned for every receiver when
+        # sending a message to many receivers.
+        return self._clean_message(message)
+
     def clean_phone_number(self, phone_number):
         phone_number = self.STRIP_WHITESPACE_PATTERN.sub('', phone_number)
         if phone_number.startswith('+'):
@@ -100,12 +125,47 @@ class Backend(sms_registry.AbstractSmsBackend):
             "useDeliveryReport": False
         }
 
+    def parse_send_response(self, response):
+        """
+        Parse the response from the linkmobility send API.
+
+        Returns:
+            dict: With ``linkmobility_message_id``, ``linkmobility_result_code``
+            and ``linkmobility_description``.
+
+        Raises:
+            LinkMobilityError: If linkmobility did not accept the message, or the response
+                is not a JSON object.
+        """
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+        if not isinstance(response_data, dict):
+            raise LinkMobilityError(
+                f'Sending SMS to {self.cleaned_phone_number} failed with HTTP status '
+                f'{response.status_code} and an unexpected response: {response.text[:1000]}')
+        result = {
+            'linkmobility_message_id': response_data.get('messageId'),
+            'linkmobility_result_code': response_data.get('resultCode'),
+            'linkmobility_description': response_data.get('description'),
+        }
+        if not response.ok:
+            raise LinkMobilityError(
+                f'Sending SMS to {self.cleaned_phone_number} failed with HTTP status '
+                f'{response.status_code}: {result["linkmobility_description"] or response.text}')
+        return result
+
     def send(self):
         """
         Send the message using linkmobility.
+
+        Returns:
+            dict: See :meth:`.parse_send_response`.
         """
-        requests.post(
+        response = (self.requests_session or requests).post(
             f'{self.linkmobility_base_url}/send',
             json=self.linkmobility_postdata,
             auth=(self.linkmobility_username, self.linkmobility_password)
         )
+        return self.parse_send_response(response)
@@ -0,0 +1,302 @@
+"""
+Load test harness for the message pipeline (``prepare_message`` -> ``send_message`` -> backends).
+
+Messages are sent through stub email and SMS backends that only sleep for a configurable
+latency (and render the email, like the real email backends do), so the harness runs fully
+locally. Used by the ``atelier_messages_load_test`` management command.
+
+Two modes are supported:
+
+- ``sync``: The RQ tasks run in the current process (RQ ``is_async=False``, even if the queue
+  is configured with ``ASYNC=True``), so each message is prepared and sent when it is queued for sending.
+- ``workers``: All the messages are queued for sending, and then sent by ``worker_count``
+  RQ workers running in burst mode in forked processes.
+"""
+import functools
+import itertools
+import math
+import multiprocessing
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import django_rq
+from django.db import connection, connections
+from django.db.models import Count, Max
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from atelier.atelier_messages import backend_registry, messageframework_settings
+from atelier.atelier_messages.backends.base import AbstractMessageSender
+from atelier.atelier_messages.models import BaseMessage, MessageReceiver, SystemMessage
+
+
+class StubEmailMessageSender(AbstractMessageSender):
+    """
+    Renders the email for each receiver, and sleeps for :obj:`.latency` seconds
+    instead of sending it.
+    """
+    message_type = 'email'
+
+    #: Seconds to sleep per receiver.
+    latency = 0
+
+    def send_message(self, message_receiver):
+        email = self.message.prepare_email(message_receiver=message_receiver)
+        email.render_html_message()
+        email.render_plaintext_message()
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class StubSmsMessageSender(AbstractMessageSender):
+    """
+    Sleeps for :obj:`.latency` seconds instead of sending the SMS.
+    """
+    message_type = 'sms'
+
+    #: Seconds to sleep per receiver.
+    latency = 0
+
+    def send_message(self, message_receiver):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+def percentile(values, percent):
+    """
+    Get the ``percent`` percentile of ``values`` (nearest-rank method).
+    """
+    if not values:
+        return None
+    sorted_values = sorted(values)
+    rank = max(int(math.ceil(percent / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+class QueryCounter(object):
+    """
+    Database execute wrapper (see ``connection.execute_wrapper()``) that counts queries.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _run_burst_worker(queue_name, query_count_queue):
+    # Each forked process must make its own database connections.
+    connections.close_all()
+    from rq import SimpleWorker
+    queue = django_rq.get_queue(queue_name)
+    query_counter = QueryCounter()
+    # SimpleWorker runs the jobs in this process, so we can count their queries.
+    with connection.execute_wrapper(query_counter):
+        SimpleWorker([queue], connection=queue.connection).work(burst=True)
+    connections.close_all()
+    query_count_queue.put(query_counter.count)
+
+
+class MessagePipelineLoadTest(object):
+    """
+    Create and send ``message_count`` single receiver :class:`~atelier.atelier_messages.models.SystemMessage`
+    objects and ``broadcast_count`` broadcast messages with ``receivers_per_broadcast`` receivers each,
+    and report throughput, time-to-sent percentiles and queries per message for each of them.
+
+    All the messages are deleted when the load test is complete unless ``keep_messages`` is ``True``.
+
+    Args:
+        message_count (int): Number of single receiver messages.
+        broadcast_count (int): Number of broadcast messages.
+        receivers_per_broadcast (int): Number of receivers per broadcast message.
+        message_types (list): Message types to send. Defaults to ``['email']``.
+        latency (float): Seconds the stub backends use per receiver.
+        mode (str): ``"sync"`` or ``"workers"``.
+        worker_count (int): Number of RQ worker processes in the ``workers`` mode.
+        keep_messages (bool): Do not delete the messages when done.
+    """
+    MODE_SYNC = 'sync'
+    MODE_WORKERS = 'workers'
+
+    def __init__(self, message_count=100, broadcast_count=1, receivers_per_broadcast=1000,
+                 message_types=None, latency=0, mode=MODE_SYNC, worker_count=4, keep_messages=False):
+        if mode not in (self.MODE_SYNC, self.MODE_WORKERS):
+            raise ValueError(f'Invalid mode: {mode!r}')
+        self.message_count = message_count
+        self.broadcast_count = broadcast_count
+        self.receivers_per_broadcast = receivers_per_broadcast
+        self.message_types = message_types or ['email']
+        self.latency = latency
+        self.mode = mode
+        self.worker_count = worker_count
+        self.keep_messages = keep_messages
+        self.run_id = uuid.uuid4().hex
+
+    def make_backend_registry(self):
+        return backend_registry.MockableRegistry.make_mockregistry(
+            type('StubEmailMessageSender', (StubEmailMessageSender,), {'latency': self.latency}),
+            type('StubSmsMessageSender', (StubSmsMessageSender,), {'latency': self.latency}))
+
+    def _iter_broadcast_message_receivers(self, message, receiver_count):
+        receivers = (
+            MessageReceiver(message=message, message_type=message_type,
+                            send_to=f'loadtest{index}@example.com' if message_type == 'email' else f'+47{index:08d}')
+            for index in range(receiver_count)
+            for message_type in message.message_types)
+        while True:
+            chunk = list(itertools.islice(receivers, 1000))
+            if not chunk:
+                return
+            yield chunk
+
+    @contextmanager
+    def patch_pipeline(self):
+        """
+        Send through the stub backends, make broadcast messages prepare
+        ``virtual_message_receivers['load_test_receiver_count']`` receivers, and use
+        a synchronous RQ queue in the ``sync`` mode and an async RQ queue in the ``workers`` mode,
+        regardless of the ``ASYNC`` option of the queue in the ``RQ_QUEUES`` setting.
+        """
+        mockregistry = self.make_backend_registry()
+        original_prepare_message_receivers = SystemMessage.prepare_message_receivers
+        load_test = self
+
+        def prepare_message_receivers(message):
+            receiver_count = message.virtual_message_receivers.get('load_test_receiver_count')
+            if receiver_count is None:
+                return original_prepare_message_receivers(message)
+            return load_test._iter_broadcast_message_receivers(message=message, receiver_count=receiver_count)
+
+        with ExitStack() as stack:
+            # DEBUG=True makes Django keep every query in memory, which would ruin the measurement.
+            stack.enter_context(override_settings(DEBUG=False, ATELIER_MESSAGES_QUEUE_IN_REALTIME=True))
+            stack.enter_context(mock.patch.object(
+                backend_registry.Registry, 'get_instance', lambda: mockregistry))
+            stack.enter_context(mock.patch.object(
+                SystemMessage, 'prepare_message_receivers', prepare_message_receivers))
+            stack.enter_context(mock.patch.object(
+                django_rq, 'get_queue',
+                functools.partial(django_rq.get_queue, is_async=self.mode == self.MODE_WORKERS)))
+            yield
+
+    def create_messages(self, count, receiver_count=None):
+        virtual_message_receivers = {
+            'to_email': 'loadtest@example.com',
+            'to_phone_number': '+4790000000',
+        }
+        if receiver_count is not None:
+            virtual_message_receivers['load_test_receiver_count'] = receiver_count
+        return [
+            SystemMessage.objects.create_message(
+                message_types=self.message_types,
+                subject=f'Load test message {index}',
+                message_content_plain='Load test message.',
+                message_content_html='<p>Load test message.</p>',
+                virtual_message_receivers=virtual_message_receivers,
+                appspecific_metadata={'load_test_run_id': self.run_id})
+            for index in range(count)]
+
+    def _send_sync(self, messages):
+        time_to_sent = []
+        for message in messages:
+            start = time.perf_counter()
+            message.queue_for_sending()
+            time_to_sent.append(time.perf_counter() - start)
+        return time_to_sent
+
+    def _send_with_workers(self, messages):
+        queued_datetimes = {}
+        for message in messages:
+            queued_datetimes[message.id] = timezone.now()
+            message.queue_for_sending()
+        query_counts = self._run_workers()
+        last_sent_datetimes = dict(
+            MessageReceiver.objects
+            .filter(message_id__in=list(queued_datetimes.keys()))
+            .values('message_id')
+            .annotate(last_sent_datetime=Max('sent_datetime'))
+            .order_by()
+            .values_list('message_id', 'last_sent_datetime'))
+        time_to_sent = [
+            (last_sent_datetimes[message_id] - queued_datetime).total_seconds()
+            for message_id, queued_datetime in queued_datetimes.items()
+            if last_sent_datetimes.get(message_id) is not None]
+        return time_to_sent, sum(query_counts)
+
+    def _run_workers(self):
+        context = multiprocessing.get_context('fork')
+        query_count_queue = context.Queue()
+        connections.close_all()
+        processes = [
+            context.Process(target=_run_burst_worker,
+                            args=(messageframework_settings.get_rq_queue_name(), query_count_queue))
+            for _ in range(self.worker_count)]
+        for process in processes:
+            process.start()
+        query_counts = [query_count_queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+        return query_counts
+
+    def run_phase(self, name, count, receiver_count=None):
+        """
+        Create and send ``count`` messages.
+
+        Returns:
+            dict: The results.
+        """
+        messages = self.create_messages(count=count, receiver_count=receiver_count)
+        query_counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(query_counter):
+            if self.mode == self.MODE_SYNC:
+                time_to_sent = self._send_sync(messages)
+                worker_query_count = 0
+            else:
+                time_to_sent, worker_query_count = self._send_with_workers(messages)
+        elapsed = time.perf_counter() - start
+        message_ids = [message.id for message in messages]
+        status_counts = dict(
+            BaseMessage.objects.filter(id__in=message_ids)
+            .values('status').annotate(count=Count('id')).order_by().values_list('status', 'count'))
+        receiver_total = MessageReceiver.objects.filter(message_id__in=message_ids).count()
+        query_count = query_counter.count + worker_query_count
+        return {
+            'name': name,
+            'messages': count,
+            'receivers': receiver_total,
+            'elapsed_seconds': elapsed,
+            'messages_per_second': count / elapsed if elapsed else None,
+            'receivers_per_second': receiver_total / elapsed if elapsed else None,
+            'time_to_sent_p50': percentile(time_to_sent, 50),
+            'time_to_sent_p95': percentile(time_to_sent, 95),
+            'time_to_sent_p99': percentile(time_to_sent, 99),
+            'queries_per_message': query_count / count if count else None,
+            'status_counts': status_counts,
+        }
+
+    def delete_messages(self):
+        BaseMessage.objects.filter(appspecific_metadata__load_test_run_id=self.run_id).delete()
+
+    def run(self):
+        """
+        Run the load test.
+
+        Returns:
+            list: A result dict for the single receiver messages and the broadcast messages.
+        """
+        results = []
+        try:
+            with self.patch_pipeline():
+                if self.message_count:
+                    results.append(self.run_phase(name='single receiver', count=self.message_count))
+                if self.broadcast_count:
+                    results.append(self.run_phase(name='broadcast', count=self.broadcast_count,
+                                                  receiver_count=self.receivers_per_broadcast))
+        finally:
+            if not self.keep_messages:
+                self.delete_messages()
+        return results
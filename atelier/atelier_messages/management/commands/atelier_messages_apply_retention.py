@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from atelier.atelier_messages import messageframework_settings
+from atelier.atelier_messages.retention import MessageRetention
+
+
+class Command(BaseCommand):
+    help = 'Anonymize or delete messages and message receivers older than a number of days. ' \
+           'Safe to interrupt - running it again continues where it stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Process messages older than this many days. Defaults to the '
+                                 'ATELIER_MESSAGES_RETENTION_DAYS setting.')
+        parser.add_argument('--action', choices=MessageRetention.ACTIONS, default=None,
+                            help='Defaults to the ATELIER_MESSAGES_RETENTION_ACTION setting.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of objects per transaction. Defaults to 1000.')
+        parser.add_argument('--export', dest='export_path', default=None,
+                            help='Append the objects to this gzipped JSON lines file before processing them.')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to sleep between batches. Defaults to 0.')
+        parser.add_argument('--schedule-interval', type=int, default=None,
+                            help='Do not process anything now. Instead, schedule an RQ job that applies the '
+                                 'retention settings every SCHEDULE_INTERVAL seconds. Does nothing if the job '
+                                 'is already scheduled, or if ATELIER_MESSAGES_RETENTION_DAYS is not set.')
+
+    def write_progress(self, model_name, processed_count):
+        self.stdout.write(f'{model_name}: {processed_count}')
+
+    def schedule(self, interval_seconds):
+        from atelier.atelier_messages.tasks import schedule_message_retention
+        if messageframework_settings.get_retention_days() is None:
+            self.stdout.write('ATELIER_MESSAGES_RETENTION_DAYS is not set. Nothing scheduled.')
+        elif schedule_message_retention(interval_seconds=interval_seconds):
+            self.stdout.write(f'Scheduled message retention every {interval_seconds} seconds.')
+        else:
+            self.stdout.write('Message retention is already scheduled.')
+
+    def handle(self, *args, **options):
+        if options['schedule_interval']:
+            self.schedule(interval_seconds=options['schedule_interval'])
+            return
+        days = options['days']
+        if days is None:
+            days = messageframework_settings.get_retention_days()
+        if days is None:
+            raise CommandError('Use --days or set the ATELIER_MESSAGES_RETENTION_DAYS setting.')
+        result = MessageRetention(
+            older_than=timezone.now() - timedelta(days=days),
+            action=options['action'] or messageframework_settings.get_retention_action(),
+            batch_size=options['batch_size'],
+            export_path=options['export_path'],
+            sleep_seconds=options['sleep'],
+            progress_callback=self.write_progress).run()
+        self.stdout.write(f'Done. Processed {result["message_receivers"]} message receivers '
+                          f'and {result["messages"]} messages.')
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from atelier.atelier_messages.models import MessageReceiver, SystemMessage
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the per receiver cost of BaseMessage.prepare_email() and rendering the email, ' \
+           'with and without render_email_once. Everything is rolled back when the benchmark is complete.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--receivers', type=int, default=1000,
+                            help='Number of receivers to render the email for. Defaults to 1000.')
+        parser.add_argument('--html-paragraphs', type=int, default=20,
+                            help='Number of paragraphs in the HTML message. Defaults to 20.')
+
+    def render_emails(self, message, message_receivers):
+        start = time.perf_counter()
+        for message_receiver in message_receivers:
+            message.prepare_email(message_receiver=message_receiver).get_send_mail_kwargs()
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        receiver_count = options['receivers']
+        message_content_html = ''.join(
+            f'<p>Paragraph {index} with <strong>some</strong> <a href="https://example.com/{index}">content</a>.</p>'
+            for index in range(options['html_paragraphs']))
+        with override_settings(DEBUG=False), transaction.atomic():
+            message = SystemMessage.objects.create_message(
+                message_types=['email'],
+                subject='Benchmark',
+                message_content_html=message_content_html,
+                virtual_message_receivers={'to_email': 'benchmark@example.com'})
+            message_receivers = [
+                MessageReceiver(message=message, message_type='email', send_to=f'benchmark{index}@example.com')
+                for index in range(receiver_count)]
+
+            results = []
+            for render_email_once in (False, True):
+                message.render_email_once = render_email_once
+                message._prerendered_email = None
+                message._email_attachment_links = None
+                elapsed = self.render_emails(message=message, message_receivers=message_receivers)
+                results.append((render_email_once, elapsed))
+            transaction.set_rollback(True)
+
+        for render_email_once, elapsed in results:
+            self.stdout.write(
+                f'render_email_once={render_email_once}: {elapsed:.2f}s '
+                f'({elapsed / receiver_count * 1000:.3f} ms per receiver)')
+        self.stdout.write(f'Speedup: {results[0][1] / results[1][1]:.1f}x')
@@ -0,0 +1,67 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from atelier.atelier_messages.models import MessageReceiver, SystemMessage
+
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = 'Benchmark BaseMessage.create_message_receivers() with a generator of receivers. ' \
+           'Reports duration and peak RSS. Everything is rolled back when the benchmark is complete.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--receivers', type=int, default=1000000,
+                            help='Number of receivers to prepare. Defaults to 1000000.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Receivers per bulk_create. Defaults to the '
+                                 'ATELIER_MESSAGES_RECEIVER_BATCH_SIZE setting.')
+        parser.add_argument('--yield-size', type=int, default=5000,
+                            help='Size of the receiver lists yielded by prepare_message_receivers(). '
+                                 'Use 1 to yield single receivers. Defaults to 5000.')
+
+    def prepare_message_receivers(self, message, receiver_count, yield_size):
+        message_receiver_list = []
+        for index in range(receiver_count):
+            message_receiver_list.append(MessageReceiver(
+                message=message, message_type='email', send_to=f'benchmark{index}@example.com'))
+            if len(message_receiver_list) >= yield_size:
+                yield message_receiver_list
+                message_receiver_list = []
+        if message_receiver_list:
+            yield message_receiver_list
+
+    def handle(self, *args, **options):
+        receiver_count = options['receivers']
+        # DEBUG=True makes Django keep every query in memory, which would ruin the measurement.
+        with override_settings(DEBUG=False), transaction.atomic():
+            message = SystemMessage.objects.create_message(
+                message_types=['email'],
+                subject='Benchmark',
+                message_content_plain='Benchmark',
+                virtual_message_receivers={'to_email': 'benchmark@example.com'})
+            message.message_receiver_batch_size = options['batch_size']
+            message.prepare_message_receivers = lambda: self.prepare_message_receivers(
+                message=message, receiver_count=receiver_count, yield_size=options['yield_size'])
+
+            peak_rss_before = get_peak_rss_mb()
+            start = time.perf_counter()
+            message.create_message_receivers()
+            elapsed = time.perf_counter() - start
+            peak_rss_after = get_peak_rss_mb()
+            created_count = message.messagereceiver_set.count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'Receivers created: {created_count}')
+        self.stdout.write(f'Batch size: {message.get_message_receiver_batch_size()}')
+        self.stdout.write(f'Duration: {elapsed:.2f}s ({created_count / elapsed:.0f} receivers/s)')
+        self.stdout.write(f'Peak RSS before: {peak_rss_before:.1f} MB')
+        self.stdout.write(f'Peak RSS after: {peak_rss_after:.1f} MB')
+        self.stdout.write(f'Peak RSS increase: {peak_rss_after - peak_rss_before:.1f} MB')
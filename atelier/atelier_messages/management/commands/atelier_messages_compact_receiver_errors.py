@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from atelier.atelier_messages.models import MessageReceiver, MessageReceiverError
+
+
+class Command(BaseCommand):
+    help = 'Move the exception tracebacks stored in MessageReceiver.status_data by older versions ' \
+           'of the message senders to deduplicated MessageReceiverError objects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of receivers to update per transaction. Defaults to 1000.')
+
+    def compact_batch(self, message_receivers):
+        errors = {}
+        fingerprints = []
+        for message_receiver in message_receivers:
+            # Fingerprinted like the errors the message senders create now, so they are deduplicated together.
+            fingerprint, exception_type, exception_traceback = MessageReceiverError.objects \
+                .describe_formatted_exception(message_receiver.status_data.pop('exception_traceback'))
+            errors[fingerprint] = (exception_type, exception_traceback)
+            fingerprints.append(fingerprint)
+        error_ids = MessageReceiverError.objects.get_or_create_many(errors)
+        for message_receiver, fingerprint in zip(message_receivers, fingerprints):
+            message_receiver.error_id = error_ids[fingerprint]
+        MessageReceiver.objects.bulk_update(message_receivers, fields=['status_data', 'error'])
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = MessageReceiver.objects \
+            .filter(status_data__has_key='exception_traceback') \
+            .only('id', 'status_data', 'error') \
+            .order_by('id')
+        compacted_count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                message_receivers = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not message_receivers:
+                    break
+                self.compact_batch(message_receivers)
+            last_id = message_receivers[-1].id
+            compacted_count += len(message_receivers)
+            self.stdout.write(f'Compacted {compacted_count} receivers.')
+        self.stdout.write(f'Done. {MessageReceiverError.objects.count()} distinct errors.')
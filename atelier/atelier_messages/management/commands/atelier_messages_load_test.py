@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+
+from atelier.atelier_messages.loadtest import MessagePipelineLoadTest
+
+
+class Command(BaseCommand):
+    help = 'Load test the message pipeline (prepare_message and send_message) with stub email ' \
+           'and SMS backends. Reports messages/s, time-to-sent percentiles and queries per message. ' \
+           'Requires Redis. The messages are deleted when the load test is complete.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100,
+                            help='Number of single receiver SystemMessages. Defaults to 100.')
+        parser.add_argument('--broadcasts', type=int, default=1,
+                            help='Number of broadcast messages. Defaults to 1.')
+        parser.add_argument('--receivers', type=int, default=1000,
+                            help='Number of receivers per broadcast message. Defaults to 1000.')
+        parser.add_argument('--message-types', nargs='+', default=['email'], choices=['email', 'sms'],
+                            help='Message types to send. Defaults to email.')
+        parser.add_argument('--latency-ms', type=float, default=20,
+                            help='Milliseconds the stub backends use per receiver. Defaults to 20.')
+        parser.add_argument('--mode', choices=['sync', 'workers'], default='sync',
+                            help='"sync" runs the RQ tasks in this process (is_async=False). '
+                                 '"workers" sends with RQ workers in separate processes. Defaults to sync.')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of RQ worker processes in the workers mode. Defaults to 4.')
+        parser.add_argument('--keep', action='store_true', default=False,
+                            help='Do not delete the messages when done.')
+
+    def format_seconds(self, seconds):
+        return '-' if seconds is None else f'{seconds * 1000:.1f}ms'
+
+    def handle(self, *args, **options):
+        load_test = MessagePipelineLoadTest(
+            message_count=options['messages'],
+            broadcast_count=options['broadcasts'],
+            receivers_per_broadcast=options['receivers'],
+            message_types=options['message_types'],
+            latency=options['latency_ms'] / 1000,
+            mode=options['mode'],
+            worker_count=options['workers'],
+            keep_messages=options['keep'])
+        for result in load_test.run():
+            self.stdout.write(f'{result["name"]} ({options["mode"]}):')
+            self.stdout.write(f'  Messages: {result["messages"]} ({result["receivers"]} receivers)')
+            self.stdout.write(f'  Duration: {result["elapsed_seconds"]:.2f}s')
+            self.stdout.write(f'  Throughput: {result["messages_per_second"]:.1f} messages/s, '
+                              f'{result["receivers_per_second"]:.1f} receivers/s')
+            self.stdout.write('  Time to sent: p50={} p95={} p99={}'.format(
+                self.format_seconds(result['time_to_sent_p50']),
+                self.format_seconds(result['time_to_sent_p95']),
+                self.format_seconds(result['time_to_sent_p99'])))
+            self.stdout.write(f'  Queries per message: {result["queries_per_message"]:.1f}')
+            self.stdout.write(f'  Final statuses: {result["status_counts"]}')
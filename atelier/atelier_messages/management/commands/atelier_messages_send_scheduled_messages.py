@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from atelier.atelier_messages.tasks import send_scheduled_messages
+
+
+class Command(BaseCommand):
+    help = 'Enqueue sending of messages with a requested send datetime that has passed. ' \
+           'Safe to run in multiple processes at the same time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', default=False,
+                            help='Keep running, and check for due messages every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=30,
+                            help='Seconds between each check when using --loop. Defaults to 30.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Max number of messages to claim per transaction. Defaults to the '
+                                 'ATELIER_MESSAGES_SCHEDULED_SEND_BATCH_SIZE setting.')
+
+    def send_scheduled_messages(self, batch_size):
+        enqueued_count = send_scheduled_messages(batch_size=batch_size)
+        if enqueued_count:
+            self.stdout.write(f'Enqueued {enqueued_count} scheduled messages for sending.')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.send_scheduled_messages(batch_size=options['batch_size'])
+            return
+        while True:
+            self.send_scheduled_messages(batch_size=options['batch_size'])
+            time.sleep(options['interval'])
@@ -1,5 +1,115 @@
+from datetime import timedelta
+
 from django.conf import settings
 
 
 def get_rq_queue_name():
     return getattr(settings, 'ATELIER_MESSAGES_RQ_QUEUE_NAME', None) or 'default'
+
+
+def get_message_receiver_batch_size():
+    """
+    Default number of :class:`~atelier.atelier_messages.models.MessageReceiver` objects
+    created per ``bulk_create`` when preparing a message.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_RECEIVER_BATCH_SIZE', None) or 1000
+
+
+def get_send_chunk_size():
+    """
+    Default number of :class:`~atelier.atelier_messages.models.MessageReceiver` objects
+    a message sender loads, sends and writes back per chunk.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_SEND_CHUNK_SIZE', None) or 500
+
+
+def get_send_max_workers():
+    """
+    Default number of concurrent sends per message sender. ``1`` means that
+    receivers are sent one by one in the calling thread.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_SEND_MAX_WORKERS', None) or 1
+
+
+def get_send_fan_out_chunk_size():
+    """
+    Messages with more receivers than this are sent by one RQ job per chunk
+    of this many receivers, so that sending can be spread across workers.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_SEND_FAN_OUT_CHUNK_SIZE', None) or 5000
+
+
+def get_scheduled_send_batch_size():
+    """
+    Max number of scheduled messages claimed per transaction by
+    :func:`~atelier.atelier_messages.tasks.send_scheduled_messages`.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_SCHEDULED_SEND_BATCH_SIZE', None) or 500
+
+
+def get_scheduled_send_requeue_after():
+    """
+    Scheduled messages still queued for sending this long after they were
+    enqueued are enqueued again (E.g.: if the RQ job was lost).
+    """
+    seconds = getattr(settings, 'ATELIER_MESSAGES_SCHEDULED_SEND_REQUEUE_AFTER_SECONDS', None) or 3600
+    return timedelta(seconds=seconds)
+
+
+def get_retention_days():
+    """
+    Messages older than this many days are anonymized or deleted by
+    :func:`~atelier.atelier_messages.tasks.apply_message_retention`.
+    ``None`` (the default) means that messages are kept forever.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_RETENTION_DAYS', None)
+
+
+def get_retention_action():
+    """
+    What :func:`~atelier.atelier_messages.tasks.apply_message_retention` does
+    with old messages. ``"anonymize"`` (the default) or ``"delete"``.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_RETENTION_ACTION', None) or 'anonymize'
+
+
+def get_retention_export_directory():
+    """
+    If set, :func:`~atelier.atelier_messages.tasks.apply_message_retention` exports
+    messages and receivers to gzipped JSON lines files in this directory
+    before anonymizing or deleting them.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_RETENTION_EXPORT_DIRECTORY', None)
+
+
+def get_esp_events_batch_size():
+    """
+    Max number of buffered ESP events handled per bulk update by
+    :func:`~atelier.atelier_messages.tasks.process_esp_events`.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_ESP_EVENTS_BATCH_SIZE', None) or 1000
+
+
+def get_esp_events_process_delay():
+    """
+    Number of seconds to wait after an ESP event is buffered before
+    :func:`~atelier.atelier_messages.tasks.process_esp_events` runs. All the events
+    received while waiting are handled by the same job.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_ESP_EVENTS_PROCESS_DELAY_SECONDS', None) or 5
+
+
+def get_esp_events_max_attempts():
+    """
+    Number of times :func:`~atelier.atelier_messages.tasks.process_esp_events` tries to
+    find the receiver for an ESP event before it gives up. Events can arrive before
+    the receiver has been updated with its ESP message id.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_ESP_EVENTS_MAX_ATTEMPTS', None) or 5
+
+
+def get_esp_events_retry_delay():
+    """
+    Number of seconds to wait before ESP events with no matching receiver are retried.
+    """
+    return getattr(settings, 'ATELIER_MESSAGES_ESP_EVENTS_RETRY_DELAY_SECONDS', None) or 60
@@ -0,0 +1,386 @@
+"""
+Metrics for the message framework.
+
+Metrics are recorded through a pluggable sink configured with the
+``ATELIER_MESSAGES_METRICS_SINK`` setting (a dotted path to a :class:`.BaseMetricsSink`
+subclass). Metrics are disabled (:class:`.NullMetricsSink`) if the setting is not set,
+and recording a metric is then just a function call and an attribute lookup.
+
+Available sinks:
+
+- :class:`.LocalMemoryMetricsSink`: Keeps the metrics in the memory of the process.
+  Only useful when everything runs in a single process, like in tests.
+- :class:`.RedisMetricsSink`: Keeps the metrics in Redis, so that the metrics from
+  all RQ workers and web processes are aggregated.
+
+The metrics are exposed in the Prometheus text format by
+:class:`atelier.atelier_messages.views.metrics.MetricsView`.
+
+Recording a metric never raises. If the sink fails (E.g.: Redis is unavailable),
+the error is logged, and the metric is lost.
+"""
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+
+import django_rq
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from atelier.atelier_messages import messageframework_settings
+
+logger = logging.getLogger(__name__)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+#: Default histogram buckets (in seconds).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+QUEUE_WAIT_SECONDS = 'atelier_messages_queue_wait_seconds'
+PREPARE_SECONDS = 'atelier_messages_prepare_seconds'
+RECEIVERS_CREATED_TOTAL = 'atelier_messages_receivers_created_total'
+SEND_SECONDS = 'atelier_messages_send_seconds'
+SENDS_TOTAL = 'atelier_messages_sends_total'
+MESSAGES_FINALIZED_TOTAL = 'atelier_messages_messages_finalized_total'
+
+#: The metrics we record, as ``name -> (type, help)``.
+METRICS = {
+    QUEUE_WAIT_SECONDS: (HISTOGRAM, 'Time from a message framework RQ job is enqueued until it starts.'),
+    PREPARE_SECONDS: (HISTOGRAM, 'Time used to create the receivers of a message.'),
+    RECEIVERS_CREATED_TOTAL: (COUNTER, 'Number of message receivers created.'),
+    SEND_SECONDS: (HISTOGRAM, 'Time used to send to a single message receiver.'),
+    SENDS_TOTAL: (COUNTER, 'Number of sends to message receivers.'),
+    MESSAGES_FINALIZED_TOTAL: (COUNTER, 'Number of messages with a final status.'),
+}
+
+
+def _make_label_key(labels):
+    return tuple(sorted((str(key), str(value)) for key, value in labels.items()))
+
+
+class BaseMetricsSink(object):
+    """
+    Base class for metrics sinks.
+
+    Labels are passed as ``((name, value), ...)`` tuples sorted by name.
+    """
+    #: Set to ``False`` to make recording metrics a no-op.
+    enabled = True
+
+    #: Histogram bucket upper bounds.
+    buckets = DEFAULT_BUCKETS
+
+    def get_bucket_index(self, value):
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                return index
+        return len(self.buckets)
+
+    def increment(self, name, label_key, value=1):
+        raise NotImplementedError()
+
+    def observe_many(self, name, label_key, values):
+        """
+        Add the given ``values`` to a histogram.
+        """
+        raise NotImplementedError()
+
+    def collect(self):
+        """
+        Get all the recorded metrics.
+
+        Returns:
+            tuple: ``(counters, histograms)`` where ``counters`` is a
+            ``{(name, label_key): value}`` dict, and ``histograms`` is a
+            ``{(name, label_key): {'buckets': [count, ...], 'sum': value, 'count': value}}`` dict
+            with one (non-cumulative) count per bucket, and one for values above the last bucket.
+        """
+        raise NotImplementedError()
+
+    def reset(self):
+        raise NotImplementedError()
+
+
+class NullMetricsSink(BaseMetricsSink):
+    """
+    Does not record anything. Used when metrics are disabled.
+    """
+    enabled = False
+
+    def increment(self, name, label_key, value=1):
+        pass
+
+    def observe_many(self, name, label_key, values):
+        pass
+
+    def collect(self):
+        return {}, {}
+
+    def reset(self):
+        pass
+
+
+class LocalMemoryMetricsSink(BaseMetricsSink):
+    """
+    Keeps the metrics in the memory of the current process. Thread safe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, label_key, value=1):
+        with self._lock:
+            self._counters[(name, label_key)] = self._counters.get((name, label_key), 0) + value
+
+    def observe_many(self, name, label_key, values):
+        with self._lock:
+            histogram = self._histograms.get((name, label_key))
+            if histogram is None:
+                histogram = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0}
+                self._histograms[(name, label_key)] = histogram
+            for value in values:
+                histogram['buckets'][self.get_bucket_index(value)] += 1
+                histogram['sum'] += value
+                histogram['count'] += 1
+
+    def collect(self):
+        with self._lock:
+            return dict(self._counters), {
+                key: {'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']}
+                for key, histogram in self._histograms.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+class RedisMetricsSink(BaseMetricsSink):
+    """
+    Keeps the metrics in two Redis hashes, so that metrics from all processes are aggregated.
+    Uses the Redis connection of the message framework RQ queue.
+
+    Each :meth:`.increment` and :meth:`.observe_many` is a single round trip to Redis.
+    """
+    counters_key = 'atelier_messages:metrics:counters'
+    histograms_key = 'atelier_messages:metrics:histograms'
+
+    def __init__(self, connection=None):
+        self._connection = connection
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = django_rq.get_connection(messageframework_settings.get_rq_queue_name())
+        return self._connection
+
+    def increment(self, name, label_key, value=1):
+        self.connection.hincrbyfloat(self.counters_key, json.dumps([name, label_key]), value)
+
+    def observe_many(self, name, label_key, values):
+        bucket_counts = {}
+        for value in values:
+            bucket_index = self.get_bucket_index(value)
+            bucket_counts[bucket_index] = bucket_counts.get(bucket_index, 0) + 1
+        if not bucket_counts:
+            return
+        pipeline = self.connection.pipeline(transaction=False)
+        for bucket_index, count in bucket_counts.items():
+            pipeline.hincrby(self.histograms_key, json.dumps([name, label_key, bucket_index]), count)
+        pipeline.hincrbyfloat(self.histograms_key, json.dumps([name, label_key, 'sum']), sum(values))
+        pipeline.hincrby(self.histograms_key, json.dumps([name, label_key, 'count']), len(values))
+        pipeline.execute()
+
+    def collect(self):
+        counters = {}
+        for field, value in self.connection.hgetall(self.counters_key).items():
+            name, label_key = json.loads(field)
+            counters[(name, _make_label_key(dict(label_key)))] = float(value)
+        histograms = {}
+        for field, value in self.connection.hgetall(self.histograms_key).items():
+            name, label_key, part = json.loads(field)
+            histogram = histograms.setdefault(
+                (name, _make_label_key(dict(label_key))),
+                {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0})
+            if part == 'sum':
+                histogram['sum'] = float(value)
+            elif part == 'count':
+                histogram['count'] = int(value)
+            elif part < len(histogram['buckets']):
+                histogram['buckets'][part] = int(value)
+        return counters, histograms
+
+    def reset(self):
+        self.connection.delete(self.counters_key, self.histograms_key)
+
+
+_sink = None
+
+
+def get_sink():
+    """
+    Get the :class:`.BaseMetricsSink` configured with the ``ATELIER_MESSAGES_METRICS_SINK`` setting.
+    """
+    global _sink
+    if _sink is None:
+        sink_class_path = getattr(settings, 'ATELIER_MESSAGES_METRICS_SINK', None)
+        _sink = import_string(sink_class_path)() if sink_class_path else NullMetricsSink()
+    return _sink
+
+
+@receiver(setting_changed)
+def _reset_sink_on_setting_changed(setting, **kwargs):
+    global _sink
+    if setting == 'ATELIER_MESSAGES_METRICS_SINK':
+        _sink = None
+
+
+def is_enabled():
+    return get_sink().enabled
+
+
+def _record(sink_method, name, label_key, value):
+    # Metrics must never make the code they measure fail (E.g.: abort a chunk after the
+    # messages are sent, but before their status is saved).
+    try:
+        sink_method(name, label_key, value)
+    except Exception:
+        logger.exception('Recording the %s metric failed.', name)
+
+
+def increment(name, value=1, **labels):
+    """
+    Increment the ``name`` counter with the given ``labels`` by ``value``.
+    """
+    sink = get_sink()
+    if sink.enabled:
+        _record(sink.increment, name, _make_label_key(labels), value)
+
+
+def observe(name, value, **labels):
+    """
+    Add ``value`` to the ``name`` histogram with the given ``labels``.
+    """
+    sink = get_sink()
+    if sink.enabled:
+        _record(sink.observe_many, name, _make_label_key(labels), [value])
+
+
+def observe_many(name, values, **labels):
+    """
+    Add all the ``values`` to the ``name`` histogram with the given ``labels``.
+    Use this instead of calling :func:`.observe` in a loop.
+    """
+    sink = get_sink()
+    if sink.enabled and values:
+        _record(sink.observe_many, name, _make_label_key(labels), values)
+
+
+class _Timer(object):
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name, **labels):
+    """
+    Context manager that adds the time used by the ``with`` block to the ``name`` histogram.
+    """
+    if not get_sink().enabled:
+        return _null_timer
+    return _Timer(name, labels)
+
+
+def observe_queue_wait(task_name):
+    """
+    Record the time from the current RQ job was enqueued until now.
+    Call this at the start of RQ tasks. Does nothing if we are not in an RQ job.
+    """
+    if not get_sink().enabled:
+        return
+    from rq import get_current_job
+    job = get_current_job()
+    if job is None or job.enqueued_at is None:
+        return
+    # RQ stores enqueued_at as a naive UTC datetime.
+    queue_wait = (datetime.utcnow() - job.enqueued_at).total_seconds()
+    observe(QUEUE_WAIT_SECONDS, max(queue_wait, 0), task=task_name)
+
+
+def _format_labels(label_key, extra_labels=()):
+    labels = list(label_key) + list(extra_labels)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_prometheus_text(sink=None, gauges=None):
+    """
+    Render the metrics in the Prometheus text exposition format.
+
+    Args:
+        sink: A :class:`.BaseMetricsSink`. Defaults to :func:`.get_sink`.
+        gauges: Optional extra gauges as a ``{name: (help, {label_key: value})}`` dict.
+
+    Returns:
+        str: The metrics.
+    """
+    sink = sink or get_sink()
+    counters, histograms = sink.collect()
+    lines = []
+    for name, (metric_type, help_text) in sorted(METRICS.items()):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == COUNTER:
+            for (counter_name, label_key), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f'{name}{_format_labels(label_key)} {_format_value(value)}')
+        else:
+            for (histogram_name, label_key), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative_count = 0
+                for upper_bound, count in zip(list(sink.buckets) + ['+Inf'], histogram['buckets']):
+                    cumulative_count += count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _format_labels(label_key, [('le', upper_bound)]), cumulative_count))
+                lines.append(f'{name}_sum{_format_labels(label_key)} {_format_value(histogram["sum"])}')
+                lines.append(f'{name}_count{_format_labels(label_key)} {histogram["count"]}')
+    for name, (help_text, values) in sorted((gauges or {}).items()):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for label_key, value in sorted(values.items()):
+            lines.append(f'{name}{_format_labels(label_key)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
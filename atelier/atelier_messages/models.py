@@ -1,3 +1,7 @@
+import copy
+import hashlib
+import logging
+import traceback
 import uuid
 import warnings
 
@@ -6,16 +10,18 @@ from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.core.exceptions import ValidationError
 from django.core.validators import EmailValidator
-from django.db import models
-from django.db.models import TextField, PositiveIntegerField
+from django.db import models, transaction
+from django.db.models import Count, Q, TextField, PositiveIntegerField
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy
 from atelier.atelier_email import emailutils
 from ievv_opensource.utils import choices_with_meta
 
-from . import basemessage_email, messageframework_settings
+from . import basemessage_email, messageframework_settings, metrics
 from .tasks import prepare_message, send_message
 
+logger = logging.getLogger(__name__)
+
 
 class BaseMessageQuerySet(models.QuerySet):
     """
@@ -59,6 +65,45 @@ class BaseMessageQuerySet(models.QuerySet):
         message.save()
         return message
 
+    def create_and_queue_for_sending(self, sent_by=None, **kwargs):
+        """
+        Latency optimized alternative to :meth:`.create_message` followed by
+        :meth:`.BaseMessage.queue_for_sending`.
+
+        Creates the message with status ``queued_for_sending``, creates its
+        :class:`.MessageReceiver` objects and enqueues the
+        :func:`~atelier.atelier_messages.tasks.send_message` RQ task, all in one
+        database transaction. This skips the :func:`~atelier.atelier_messages.tasks.prepare_message`
+        task and its extra queue hop.
+
+        The message receivers are created in the calling process, so this is
+        only suitable for messages with few receivers, like a login code sent to
+        a single user.
+
+        If ``requested_send_datetime`` is in the future, the message is just left queued for
+        sending, just like with :meth:`.BaseMessage.queue_for_sending`.
+
+        Args:
+            sent_by: The User who is sending the message. Optional.
+            **kwargs: Kwargs for :meth:`.create_message`.
+
+        Returns:
+            The created message.
+        """
+        with transaction.atomic():
+            message = self.create_message(
+                sent_by=sent_by,
+                status=BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value,
+                **kwargs)
+            appspecific_metadata = copy.deepcopy(message.appspecific_metadata)
+            prepared_message_receivers = message.create_message_receivers()
+            message.set_message_recipients_metadata(prepared_message_receivers=prepared_message_receivers)
+            if message.appspecific_metadata != appspecific_metadata:
+                message.save(update_fields=['appspecific_metadata'])
+            if not message.is_scheduled_for_later():
+                message.enqueue_task_on_commit(send_message)
+        return message
+
     def filter_open_for_edit_status_values(self):
         """
         Filter only to include messages that has :obj:`~.BaseMessage.status` status set to one
@@ -124,6 +169,29 @@ class BaseMessageQuerySet(models.QuerySet):
             BaseMessage.STATUS_CHOICES.READY_FOR_SENDING.value,
         ])
 
+    def filter_due_for_scheduled_sending(self, now=None, requeue_after=None):
+        """
+        Filter messages queued for sending with a :obj:`~.BaseMessage.requested_send_datetime`
+        that has passed, and that has not already been enqueued for sending by
+        :func:`~atelier.atelier_messages.tasks.send_scheduled_messages`.
+
+        Uses the ``(status, requested_send_datetime)`` index on :class:`.BaseMessage`.
+
+        Args:
+            now: The current datetime. Defaults to ``timezone.now()``.
+            requeue_after (datetime.timedelta): If provided, messages that was enqueued more than this
+                long ago, but is still queued for sending, are included. This recovers messages
+                where the enqueued RQ job was lost.
+        """
+        now = now or timezone.now()
+        not_enqueued = models.Q(scheduled_send_enqueued_datetime__isnull=True)
+        if requeue_after is not None:
+            not_enqueued |= models.Q(scheduled_send_enqueued_datetime__lt=now - requeue_after)
+        return self.filter(
+            not_enqueued,
+            status=BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value,
+            requested_send_datetime__lte=now)
+
     def filter_can_set_status_to_draft(self):
         """
         Filter to only include message that has :obj:`~.BaseMessage.status` set
@@ -329,6 +397,8 @@ class BaseMessage(models.Model):
 
     #: ESP (Email Service Provider) specific message id. Set when using API to send message and when
     #: webhooks can be used for getting sending status also from the ESP.
+    #: Messages with more than one receiver get one ESP message id per receiver, so senders
+    #: for those should use :obj:`.MessageReceiver.esp_message_id` instead.
     esp_message_id = models.CharField(
         max_length=255,
         blank=True, null=True, default=None,
@@ -383,8 +453,15 @@ class BaseMessage(models.Model):
 
     #: Requested datetime to send the message. If this is ``None``, the message
     #: is scheduled for sending as soon as .
+    #:
+    #: Messages queued for sending with this in the future are sent by the
+    #: :func:`~atelier.atelier_messages.tasks.send_scheduled_messages` task when the time is right.
     requested_send_datetime = models.DateTimeField(blank=True, null=True)
 
+    #: The datetime when :func:`~atelier.atelier_messages.tasks.send_scheduled_messages`
+    #: enqueued the message for sending. Used to avoid enqueuing scheduled messages more than once.
+    scheduled_send_enqueued_datetime = models.DateTimeField(blank=True, null=True, default=None)
+
     #: The user that sent the message.
     #: Not required, but some subclasses may require it. In any case,
     #: you normally want to save the user who sent a message as long as
@@ -418,6 +495,31 @@ class BaseMessage(models.Model):
     #: The datetime when this object was anonymized
     anonymized_datetime = models.DateTimeField(null=True, blank=True, default=None)
 
+    #: Number of :class:`.MessageReceiver` objects to create per ``bulk_create``.
+    #: See :meth:`.get_message_receiver_batch_size`.
+    message_receiver_batch_size = None
+
+    #: If ``True``, :meth:`.prepare_email` renders the email (subject, HTML and plaintext)
+    #: once per message instead of once per receiver. The only receiver specific value
+    #: in the rendered email is :obj:`.MessageReceiver.send_to`, which is rendered as a placeholder
+    #: and replaced for each receiver (see :class:`atelier.atelier_messages.basemessage_email.PrerenderedEmail`).
+    #:
+    #: Defaults to ``False``. Only set this to ``True`` in subclasses where the email templates
+    #: do not use any receiver data other than ``message_receiver.send_to`` (names, unsubscribe links, ...),
+    #: and do not transform ``send_to`` (E.g.: with filters like ``|truncatechars``, or by building a URL from it).
+    #: Case changes, like ``|lower``, are detected, and the email is rendered per receiver instead.
+    #:
+    #: Ignored (the email is rendered per receiver) unless the class returned by :meth:`.get_email_class`
+    #: has ``supports_prerendered_email = True``, like
+    #: :class:`atelier.atelier_messages.basemessage_email.BaseMessageEmail`.
+    render_email_once = False
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'requested_send_datetime']),
+            models.Index(fields=['created_datetime']),
+        ]
+
     @classmethod
     def get_message_class_string(cls):
         """
@@ -425,6 +527,37 @@ class BaseMessage(models.Model):
         """
         return '{}.{}'.format(cls.__module__, cls.__name__)
 
+    def enqueue_task_on_commit(self, task, **kwargs):
+        """
+        Enqueue the given RQ ``task`` for this message in the message framework
+        RQ queue when the current database transaction is committed (or right
+        away if we are not in a transaction).
+
+        Enqueuing on commit ensures that the task always sees the status we
+        saved before enqueuing it.
+
+        Does nothing if the ``ATELIER_MESSAGES_QUEUE_IN_REALTIME`` setting is ``False``.
+
+        Args:
+            task: The RQ task function. Called with ``message_id``, ``message_class_string``
+                and the provided ``kwargs``.
+            **kwargs: Extra kwargs for the task.
+        """
+        if not getattr(settings, 'ATELIER_MESSAGES_QUEUE_IN_REALTIME', True):
+            return
+        task_kwargs = dict(
+            message_id=self.id,
+            message_class_string=self.__class__.get_message_class_string(),
+            **kwargs)
+        transaction.on_commit(
+            lambda: django_rq.get_queue(messageframework_settings.get_rq_queue_name()).enqueue(task, **task_kwargs))
+
+    def is_scheduled_for_later(self):
+        """
+        Returns ``True`` if :obj:`~.BaseMessage.requested_send_datetime` is in the future.
+        """
+        return self.requested_send_datetime is not None and self.requested_send_datetime > timezone.now()
+
     def queue_for_prepare(self, send_when_prepared=False, sent_by=None):
         if self.status != self.STATUS_CHOICES.DRAFT.value:
             raise ValueError(f'Can only call queue_for_prepare on messages with '
@@ -435,12 +568,7 @@ class BaseMessage(models.Model):
         self.save()
 
         # Prepare sending with RQ task.
-        if getattr(settings, 'ATELIER_MESSAGES_QUEUE_IN_REALTIME', True):
-            django_rq.get_queue(messageframework_settings.get_rq_queue_name())\
-                .enqueue(prepare_message,
-                         message_id=self.id,
-                         message_class_string=self.__class__.get_message_class_string(),
-                         send_when_prepared=send_when_prepared)
+        self.enqueue_task_on_commit(prepare_message, send_when_prepared=send_when_prepared)
 
     def queue_for_sending(self, sent_by=None):
         """
@@ -451,10 +579,10 @@ class BaseMessage(models.Model):
 
         If :obj:`~.BaseMessage.requested_send_datetime` is ``None``, the RQ
         task that prepares the message for sending will start another RQ
-        task that actually sends the message. If it is not ``None``,
-        the message will end up with :obj:`~.BaseMessage.status` set to ``"queued"``,
-        and some background task, cronjob, etc. will have to pick it up
-        and send it when the time is right.
+        task that actually sends the message. If it is in the future,
+        the message will end up with :obj:`~.BaseMessage.status` set to ``"queued_for_sending"``,
+        and the :func:`~atelier.atelier_messages.tasks.send_scheduled_messages` task
+        sends it when the time is right.
 
         Args:
             sent_by: The User who is sending the message - optional,
@@ -467,11 +595,8 @@ class BaseMessage(models.Model):
             self.status = self.STATUS_CHOICES.QUEUED_FOR_SENDING.value
             self.clean()
             self.save()
-            if getattr(settings, 'ATELIER_MESSAGES_QUEUE_IN_REALTIME', True):
-                django_rq.get_queue(messageframework_settings.get_rq_queue_name())\
-                    .enqueue(send_message,
-                             message_id=self.id,
-                             message_class_string=self.__class__.get_message_class_string())
+            if not self.is_scheduled_for_later():
+                self.enqueue_task_on_commit(send_message)
         else:
             raise ValueError(f'Can only call queue_for_sending if status is one of: '
                              f'{self.STATUS_CHOICES.READY_FOR_SENDING.value!r} or '
@@ -482,16 +607,29 @@ class BaseMessage(models.Model):
         Prepare :class:`.MessageReceiver` objects for :meth:`.create_message_receivers`.
 
         By _prepare_, we mean to make the MessageReceiver objects, but not save
-        them to the database. Saving is handled with a bulk create in
+        them to the database. Saving is handled with bulk creates in
         :meth:`.create_message_receivers`.
 
         Must return a list of :class:`.MessageReceiver` objects, or a
-        generator that yields lists of :class:`.MessageReceiver` objects.
+        generator that yields :class:`.MessageReceiver` objects or lists of
+        :class:`.MessageReceiver` objects. Use a generator if the message can
+        have many receivers - :meth:`.create_message_receivers` only keeps
+        :meth:`.get_message_receiver_batch_size` receivers in memory at a time.
 
         Must be overridden in subclasses.
         """
         raise NotImplementedError()
 
+    def get_message_receiver_batch_size(self):
+        """
+        Get the number of :class:`.MessageReceiver` objects to create per
+        ``bulk_create`` in :meth:`.create_message_receivers`.
+
+        Defaults to :obj:`.message_receiver_batch_size`, falling back to the
+        ``ATELIER_MESSAGES_RECEIVER_BATCH_SIZE`` setting.
+        """
+        return self.message_receiver_batch_size or messageframework_settings.get_message_receiver_batch_size()
+
     def _create_message_receivers_from_list(self, message_receiver_list):
         MessageReceiver.objects.bulk_create(message_receiver_list)
 
@@ -507,15 +645,70 @@ class BaseMessage(models.Model):
 
         Do NOT save in this method, just set things - typically in `appspecific_metadata`.
 
+        If :meth:`.prepare_message_receivers` returns a generator, the generator
+        is exhausted when this is called. Use :meth:`.reduce_message_recipients_metadata`
+        and :meth:`.set_reduced_message_recipients_metadata` to collect metadata about the
+        receivers while they are created instead.
+
         Args:
             prepared_message_receivers: The response from :meth:`.prepare_message_receivers`
         """
 
+    def reduce_message_recipients_metadata(self, recipients_metadata, message_receiver_list):
+        """
+        Reducer for metadata about the recipients.
+
+        Called by :meth:`.create_message_receivers` after each batch of
+        :class:`.MessageReceiver` objects is created. Must return the
+        new ``recipients_metadata``. The return value from the last batch is sent to
+        :meth:`.set_reduced_message_recipients_metadata`.
+
+        Returns the ``recipients_metadata`` unchanged by default.
+
+        Example::
+
+            def reduce_message_recipients_metadata(self, recipients_metadata, message_receiver_list):
+                receiver_count = recipients_metadata.get('receiver_count', 0)
+                recipients_metadata['receiver_count'] = receiver_count + len(message_receiver_list)
+                return recipients_metadata
+
+        Args:
+            recipients_metadata (dict): The metadata reduced from the previous batches.
+                An empty dict for the first batch.
+            message_receiver_list (list): The :class:`.MessageReceiver` objects in the batch.
+        """
+        return recipients_metadata
+
+    def set_reduced_message_recipients_metadata(self, recipients_metadata):
+        """
+        Set the metadata reduced with :meth:`.reduce_message_recipients_metadata`.
+
+        Called at the end of :meth:`.create_message_receivers`, and before
+        :meth:`.set_message_recipients_metadata`. Does nothing by default.
+
+        Do NOT save in this method, just set things - typically in `appspecific_metadata`.
+
+        Args:
+            recipients_metadata (dict): The reduced metadata.
+        """
+
+    def _iter_prepared_message_receivers(self, prepared_message_receivers):
+        for item in prepared_message_receivers:
+            if isinstance(item, MessageReceiver):
+                yield item
+            else:
+                yield from item
+
     def create_message_receivers(self):
         """
         Create :obj:`.MessageReceiver` objects for this message
         from :obj:`~.BaseMessage.virtual_message_receivers`.
 
+        Receivers from :meth:`.prepare_message_receivers` are created in batches of
+        :meth:`.get_message_receiver_batch_size`, so memory usage does not depend on
+        the number of receivers as long as :meth:`.prepare_message_receivers` returns
+        a generator.
+
         You never call this directly unless you are making background
         task for preparing a message for sending.
 
@@ -523,12 +716,24 @@ class BaseMessage(models.Model):
             What was returned from :meth:`.prepare_message_receivers`.
         """
         message_receivers = self.prepare_message_receivers()
-        if isinstance(message_receivers, list):
-            self._create_message_receivers_from_list(message_receivers)
-        else:
-            for message_receiver_list in message_receivers:
-                self._create_message_receivers_from_list(message_receiver_list)
-
+        batch_size = self.get_message_receiver_batch_size()
+        recipients_metadata = {}
+        created_count = 0
+        batch = []
+        for message_receiver in self._iter_prepared_message_receivers(message_receivers):
+            batch.append(message_receiver)
+            if len(batch) >= batch_size:
+                self._create_message_receivers_from_list(batch)
+                recipients_metadata = self.reduce_message_recipients_metadata(recipients_metadata, batch)
+                created_count += len(batch)
+                batch = []
+        if batch:
+            self._create_message_receivers_from_list(batch)
+            recipients_metadata = self.reduce_message_recipients_metadata(recipients_metadata, batch)
+            created_count += len(batch)
+        self.set_reduced_message_recipients_metadata(recipients_metadata)
+        metrics.increment(metrics.RECEIVERS_CREATED_TOTAL, created_count,
+                          message_class=self.__class__.get_message_class_string())
         return message_receivers
 
     def validate_virtual_message_receivers(self):
@@ -592,21 +797,67 @@ class BaseMessage(models.Model):
                 'title': att.title,
                 'link': att.attachment_file_url
             }
+        if self.get_render_email_once():
+            # Only look up the attachments once when the email is the same for all receivers
+            if getattr(self, '_email_attachment_links', None) is None:
+                self._email_attachment_links = [
+                    get_url_obj(attachment) for attachment in BaseMessageAttachment.objects.filter(message=self)]
+            return self._email_attachment_links
         return [get_url_obj(attachment) for attachment in BaseMessageAttachment.objects.filter(message=self)]
 
     def get_email_attachment_ids(self):
         return [attachment.id for attachment in BaseMessageAttachment.objects.filter(message=self)]
 
+    def get_render_email_once(self):
+        """
+        Get :obj:`.render_email_once`. Override this if you need to decide dynamically.
+        """
+        return self.render_email_once
+
+    def get_prerendered_email(self):
+        """
+        Render the email once for all receivers. Used by :meth:`.prepare_email`
+        when :meth:`.get_render_email_once` returns ``True``.
+
+        The result is cached on the message object.
+
+        Returns:
+            atelier.atelier_messages.basemessage_email.PrerenderedEmail: The rendered email, or ``None``
+            if the templates transform ``send_to`` so the email must be rendered per receiver.
+        """
+        if not hasattr(self, '_prerendered_email'):
+            message_receiver = MessageReceiver(
+                message=self, message_type='email',
+                send_to=basemessage_email.PrerenderedEmail.SEND_TO_PLACEHOLDER)
+            email = self.get_email_class(message_receiver=message_receiver)(
+                **self.get_email_kwargs(message_receiver=message_receiver))
+            prerendered_email = basemessage_email.PrerenderedEmail.from_email(email)
+            if prerendered_email.has_transformed_send_to():
+                logger.warning('%s: The email templates of BaseMessage#%s transform send_to, so the email '
+                               'is rendered per receiver. Set render_email_once = False on the message class.',
+                               self.get_message_class_string(), self.id)
+                prerendered_email = None
+            self._prerendered_email = prerendered_email
+        return self._prerendered_email
+
     def prepare_email(self, message_receiver):
         """
         Prepare a :class:`django_cradmin.apps.cradmin_email.emailutils.AbstractEmail`
         object that can be used to send this message as an email.
 
+        If :meth:`.get_render_email_once` returns ``True``, and the email class
+        supports it (see :obj:`.render_email_once`), the email is rendered once for all receivers.
+
         Can be overridden in subclasses, but you normally just want
         to override :meth:`.get_email_class`, and perhaps :meth:`.get_email_kwargs`.
         """
-        return self.get_email_class(message_receiver=message_receiver)(
-            **self.get_email_kwargs(message_receiver=message_receiver))
+        email_class = self.get_email_class(message_receiver=message_receiver)
+        email_kwargs = self.get_email_kwargs(message_receiver=message_receiver)
+        if self.get_render_email_once() and getattr(email_class, 'supports_prerendered_email', False):
+            prerendered_email = self.get_prerendered_email()
+            if prerendered_email is not None:
+                email_kwargs['prerendered_email'] = prerendered_email
+        return email_class(**email_kwargs)
 
     def validate_not_blank(self, fieldname, value):
         if not value:
@@ -723,6 +974,136 @@ class BaseMessage(models.Model):
         return f'#{self.id} {label} ({self.status_label})'
 
 
+class MessageReceiverErrorQuerySet(models.QuerySet):
+    """
+    QuerySet for :class:`.MessageReceiverError`.
+    """
+    def make_fingerprint(self, exception_type, exception_traceback):
+        """
+        Make a fingerprint for the given exception type and traceback.
+        """
+        return hashlib.sha1(f'{exception_type}\n{exception_traceback}'.encode('utf-8')).hexdigest()
+
+    def describe_exception(self, exception):
+        """
+        Describe a caught exception as a :class:`.MessageReceiverError`.
+
+        The traceback does not include the exception message, so errors that
+        only differ by message (E.g.: the address of the receiver) get the same fingerprint.
+
+        Returns:
+            tuple: ``(fingerprint, exception_type, exception_traceback)``, where ``exception_type``
+            is the module qualified name of the exception class (E.g.: ``builtins.ValueError``).
+        """
+        exception_type = f'{exception.__class__.__module__}.{exception.__class__.__qualname__}'
+        exception_traceback = ''.join(traceback.format_tb(exception.__traceback__))
+        fingerprint = self.make_fingerprint(exception_type=exception_type, exception_traceback=exception_traceback)
+        return fingerprint, exception_type, exception_traceback
+
+    def describe_formatted_exception(self, formatted_exception):
+        """
+        Same as :meth:`.describe_exception`, but for an exception formatted with
+        ``traceback.format_exc()``, like the ``exception_traceback`` older versions
+        of the message senders stored in :obj:`.MessageReceiver.status_data`.
+
+        The ``Traceback (most recent call last):`` header and the final ``<type>: <message>``
+        line are stripped, and the type is module qualified, so the fingerprint matches the
+        fingerprint :meth:`.describe_exception` makes for the same error. For chained
+        exceptions, only the traceback of the last exception is used, like ``traceback.format_tb()`` does.
+        """
+        header = 'Traceback (most recent call last):\n'
+        if header in formatted_exception:
+            formatted_exception = formatted_exception.rsplit(header, 1)[1]
+        lines = formatted_exception.splitlines(keepends=True)
+        # format_tb() lines are all indented. The first unindented line is "<type>: <message>".
+        traceback_line_count = 0
+        for line in lines:
+            if not line.startswith(' '):
+                break
+            traceback_line_count += 1
+        exception_traceback = ''.join(lines[:traceback_line_count])
+        exception_line = lines[traceback_line_count] if traceback_line_count < len(lines) else ''
+        exception_type = exception_line.split(':', 1)[0].strip()
+        if exception_type and '.' not in exception_type:
+            # traceback only leaves out the module of builtin exceptions
+            exception_type = f'builtins.{exception_type}'
+        exception_type = exception_type[:255]
+        fingerprint = self.make_fingerprint(exception_type=exception_type, exception_traceback=exception_traceback)
+        return fingerprint, exception_type, exception_traceback
+
+    def get_or_create_many(self, errors):
+        """
+        Get or create :class:`.MessageReceiverError` objects for many errors with
+        two queries, no matter how many errors there are.
+
+        Args:
+            errors (dict): Maps fingerprints to ``(exception_type, exception_traceback)`` tuples.
+
+        Returns:
+            dict: Maps fingerprints to :class:`.MessageReceiverError` ids.
+        """
+        if not errors:
+            return {}
+        self.bulk_create([
+            MessageReceiverError(fingerprint=fingerprint,
+                                 exception_type=exception_type,
+                                 exception_traceback=exception_traceback)
+            for fingerprint, (exception_type, exception_traceback) in errors.items()
+        ], ignore_conflicts=True)
+        return dict(self.filter(fingerprint__in=list(errors)).values_list('fingerprint', 'id'))
+
+
+class MessageReceiverError(models.Model):
+    """
+    An error that happened when sending to one or more :class:`.MessageReceiver` objects.
+
+    Many receivers often fail with the same error (E.g.: when the SMTP server
+    is down), so we store each distinct traceback once, and let the receivers
+    point to it via :obj:`.MessageReceiver.error`. The error message, which may contain
+    receiver specific details, is still stored in :obj:`.MessageReceiver.status_data`.
+    """
+    objects = MessageReceiverErrorQuerySet.as_manager()
+
+    #: SHA-1 of the exception type and traceback. See :meth:`.MessageReceiverErrorQuerySet.make_fingerprint`.
+    fingerprint = models.CharField(max_length=40, unique=True)
+
+    #: The full name of the exception class.
+    exception_type = models.CharField(max_length=255)
+
+    #: The traceback, without the exception message.
+    exception_traceback = models.TextField()
+
+    created_datetime = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.exception_type} ({self.fingerprint[:8]})'
+
+
+class MessageReceiverQuerySet(models.QuerySet):
+    """
+    QuerySet for :class:`.MessageReceiver`.
+    """
+    def get_status_counts(self):
+        """
+        Count the receivers in the queryset by status in a single aggregate query.
+
+        Typically used on ``message.messagereceiver_set`` to find the final
+        status of a message. The ``(message, status)`` index on
+        :class:`.MessageReceiver` makes this an index scan for a single message.
+
+        Returns:
+            dict: A dict with ``total``, ``not_sent``, ``error``, ``sent`` and ``received`` counts.
+        """
+        status_choices = MessageReceiver.STATUS_CHOICES
+        return self.order_by().aggregate(
+            total=Count('id'),
+            not_sent=Count('id', filter=Q(status=status_choices.NOT_SENT.value)),
+            error=Count('id', filter=Q(status=status_choices.ERROR.value)),
+            sent=Count('id', filter=Q(status=status_choices.SENT.value)),
+            received=Count('id', filter=Q(status=status_choices.RECEIVED.value)),
+        )
+
+
 class MessageReceiver(models.Model):
     #: Choices for the :obj:`.MessageReceiver.status` field.
     #:
@@ -749,6 +1130,8 @@ class MessageReceiver(models.Model):
                                  label=ugettext_lazy('Received')),
     )
 
+    objects = MessageReceiverQuerySet.as_manager()
+
     #: The datetime when this object was anonymized
     anonymized_datetime = models.DateTimeField(null=True, blank=True, default=None)
 
@@ -793,6 +1176,26 @@ class MessageReceiver(models.Model):
     #: error responses.
     status_data = JSONField(null=False, blank=True, default=dict)
 
+    #: The error (with traceback) if sending failed with an exception. Shared by
+    #: all the receivers that failed with the same traceback.
+    error = models.ForeignKey(to=MessageReceiverError, null=True, blank=True, default=None,
+                              on_delete=models.SET_NULL)
+
+    #: ESP (Email Service Provider) specific message id for this receiver. Used to
+    #: update the status from ESP delivery webhooks (see :mod:`atelier.atelier_messages.esp_events`).
+    esp_message_id = models.CharField(
+        max_length=255,
+        blank=True, null=True, default=None,
+        db_index=True,
+        help_text='Email service provider message id'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['message', 'status']),
+            models.Index(fields=['message', 'message_type']),
+        ]
+
     @property
     def status_label(self):
         return self.STATUS_CHOICES[self.status].label
@@ -828,7 +1231,7 @@ class SystemMessageQuerySet(BaseMessageQuerySet):
 
     def send(self, subject, message_content_html, to_email=None, to_phone_number=None,
              message_content_plain=None, send_both=False, ignore_no_recipient=False,
-             email_heading=None):
+             email_heading=None, transactional=False):
         """
         Convenience method / shortcut for creating a :class:`.SystemMessage`, and
         queuing it for sending.
@@ -855,6 +1258,10 @@ class SystemMessageQuerySet(BaseMessageQuerySet):
                 just return ``None`` if both ``to_email`` and ``to_sms`` is
                 blank/None.
             email_heading (str): The heading of the email.
+            transactional (boolean): If this is ``True``, we create the message and its
+                receivers, and enqueue the sending, in a single transaction using
+                :meth:`.BaseMessageQuerySet.create_and_queue_for_sending`. Use this for latency
+                sensitive messages, like login codes.
 
         Returns:
             .SystemMessage: The system message that was created and queued for sending.
@@ -874,7 +1281,7 @@ class SystemMessageQuerySet(BaseMessageQuerySet):
             message_types.append('sms')
         if not send_both and len(message_types) == 2:
             message_types = ['email']
-        message = self.create_message(
+        message_kwargs = dict(
             subject=subject,
             email_heading=email_heading or '',
             message_types=message_types,
@@ -885,6 +1292,9 @@ class SystemMessageQuerySet(BaseMessageQuerySet):
                 'to_phone_number': to_phone_number
             }
         )
+        if transactional:
+            return self.create_and_queue_for_sending(**message_kwargs)
+        message = self.create_message(**message_kwargs)
         message.queue_for_sending()
         return message
 
@@ -897,7 +1307,9 @@ class SystemMessage(BaseMessage):
     via :meth:`.SystemMessageQuerySet.send`.
 
     You can create a proxy subclass of this to adjust the
-    email templates etc.
+    email templates etc. The email is rendered once for all receivers
+    (see :obj:`.BaseMessage.render_email_once`), so set ``render_email_once = False``
+    in the proxy if your templates use receiver data other than ``send_to``, or transform ``send_to``.
 
     The permissions for this message type is to only allow
     superusers to view, create and update it.
@@ -905,6 +1317,9 @@ class SystemMessage(BaseMessage):
     objects = SystemMessageQuerySet.as_manager()
     email_heading = models.TextField(null=False, blank=True, default='')
 
+    #: The system email templates only use ``send_to`` from the receiver.
+    render_email_once = True
+
     @classmethod
     def get_message_class_string(cls):
         """
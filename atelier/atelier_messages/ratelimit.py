@@ -0,0 +1,55 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket rate limiter.
+
+    Example::
+
+        bucket = TokenBucket(rate=10, capacity=20)
+        for request in requests:
+            bucket.acquire()  # Blocks as long as needed to stay below 10 requests per second
+            send(request)
+
+    Args:
+        rate (float): Number of tokens added to the bucket per second.
+        capacity (float): Max number of tokens in the bucket (the max burst size).
+            Defaults to ``rate``.
+        clock: A function returning the current time in seconds. For tests.
+        sleep: A function that sleeps for the given number of seconds. For tests.
+    """
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('rate must be a positive number.')
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, tokens=1):
+        """
+        Take ``tokens`` tokens from the bucket, sleeping until they are available.
+
+        Tokens are reserved before sleeping, so concurrent callers are served
+        in the order they call this method.
+
+        Returns:
+            float: The number of seconds we slept.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait_seconds = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_seconds > 0:
+            self._sleep(wait_seconds)
+        return wait_seconds
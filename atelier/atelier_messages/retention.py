@@ -0,0 +1,129 @@
+import gzip
+import json
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from atelier.atelier_messages.models import BaseMessage, MessageReceiver
+
+
+class MessageRetention(object):
+    """
+    Anonymize or delete messages (and their receivers) created before ``older_than``.
+
+    Works in small batches, each in its own short transaction, so that locks are
+    only held briefly. Only messages that are done sending (``sent``, ``partly_sent``
+    or ``error``) are processed.
+
+    The job is resumable. Anonymized objects get ``anonymized_datetime`` set
+    and deleted objects are gone, so if the job is interrupted, running it
+    again continues where it stopped.
+
+    Example::
+
+        MessageRetention(older_than=timezone.now() - timedelta(days=365),
+                         export_path='/tmp/messages.jsonl.gz').run()
+
+    Args:
+        older_than (datetime.datetime): Process messages created before this.
+        action (str): ``"anonymize"`` or ``"delete"``.
+        batch_size (int): Number of objects per transaction.
+        export_path (str): If provided, each batch is appended to this gzipped
+            JSON lines file before it is anonymized or deleted.
+        sleep_seconds (float): Seconds to sleep between batches to reduce database load.
+        progress_callback: Optional function called with ``(model_name, processed_count)`` after each batch.
+    """
+    ACTION_ANONYMIZE = 'anonymize'
+    ACTION_DELETE = 'delete'
+    ACTIONS = (ACTION_ANONYMIZE, ACTION_DELETE)
+
+    DONE_STATUSES = (
+        BaseMessage.STATUS_CHOICES.SENT.value,
+        BaseMessage.STATUS_CHOICES.PARTLY_SENT.value,
+        BaseMessage.STATUS_CHOICES.ERROR.value,
+    )
+
+    def __init__(self, older_than, action=ACTION_ANONYMIZE, batch_size=1000, export_path=None,
+                 sleep_seconds=0, progress_callback=None):
+        if action not in self.ACTIONS:
+            raise ValueError(f'action must be one of {self.ACTIONS!r}, not {action!r}.')
+        self.older_than = older_than
+        self.action = action
+        self.batch_size = batch_size
+        self.export_path = export_path
+        self.sleep_seconds = sleep_seconds
+        self.progress_callback = progress_callback
+
+    def get_message_queryset(self):
+        queryset = BaseMessage.objects.filter(
+            created_datetime__lt=self.older_than,
+            status__in=self.DONE_STATUSES)
+        if self.action == self.ACTION_ANONYMIZE:
+            queryset = queryset.filter(anonymized_datetime__isnull=True)
+        return queryset
+
+    def get_message_receiver_queryset(self):
+        queryset = MessageReceiver.objects.filter(
+            message__created_datetime__lt=self.older_than,
+            message__status__in=self.DONE_STATUSES)
+        if self.action == self.ACTION_ANONYMIZE:
+            queryset = queryset.filter(anonymized_datetime__isnull=True)
+        return queryset
+
+    def export(self, model_name, rows):
+        if not self.export_path:
+            return
+        # Gzip files can be appended to, so each batch (and each run of the job) adds to the same file.
+        with gzip.open(self.export_path, 'at', encoding='utf-8') as export_file:
+            for row in rows:
+                export_file.write(json.dumps({'model': model_name, 'fields': row}, cls=DjangoJSONEncoder))
+                export_file.write('\n')
+
+    def anonymize_message_receivers(self, queryset):
+        queryset.update(send_to='', send_to_metadata={}, user=None, status_data={},
+                        anonymized_datetime=timezone.now())
+
+    def anonymize_messages(self, queryset):
+        queryset.update(virtual_message_receivers={}, anonymized_datetime=timezone.now())
+
+    def _process_in_batches(self, model_name, queryset, anonymize):
+        processed_count = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)
+                           [:self.batch_size])
+                if not ids:
+                    return processed_count
+                batch_queryset = queryset.model.objects.filter(id__in=ids)
+                self.export(model_name=model_name, rows=batch_queryset.values())
+                if self.action == self.ACTION_DELETE:
+                    batch_queryset.delete()
+                else:
+                    anonymize(batch_queryset)
+            last_id = ids[-1]
+            processed_count += len(ids)
+            if self.progress_callback:
+                self.progress_callback(model_name, processed_count)
+            if self.sleep_seconds:
+                time.sleep(self.sleep_seconds)
+
+    def run(self):
+        """
+        Process the receivers, and then the messages.
+
+        Returns:
+            dict: The number of processed ``message_receivers`` and ``messages``.
+        """
+        return {
+            'message_receivers': self._process_in_batches(
+                model_name='atelier_messages.messagereceiver',
+                queryset=self.get_message_receiver_queryset(),
+                anonymize=self.anonymize_message_receivers),
+            'messages': self._process_in_batches(
+                model_name='atelier_messages.basemessage',
+                queryset=self.get_message_queryset(),
+                anonymize=self.anonymize_messages),
+        }
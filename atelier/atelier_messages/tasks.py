@@ -1,5 +1,6 @@
-import time
 import traceback
+from datetime import timedelta
+
 from ievv_opensource.ievv_sms import sms_registry
 
 
@@ -36,8 +37,10 @@ def prepare_message(message_id, message_class_string, send_when_prepared=False):
     from django.conf import settings
     from atelier.atelier_messages.models import BaseMessage
     from atelier.atelier_messages import messageclass_registry
+    from atelier.atelier_messages import metrics
     import logging
     logger = logging.getLogger(__name__)
+    metrics.observe_queue_wait('prepare_message')
 
     message_class = messageclass_registry.Registry \
         .get_instance() \
@@ -76,7 +79,7 @@ def prepare_message(message_id, message_class_string, send_when_prepared=False):
             return
 
     try:
-        with transaction.atomic():
+        with transaction.atomic(), metrics.timer(metrics.PREPARE_SECONDS, message_class=message_class_string):
             # Create message receivers
             prepared_message_receivers = message.create_message_receivers()
             message.set_message_recipients_metadata(prepared_message_receivers=prepared_message_receivers)
@@ -102,18 +105,53 @@ def prepare_message(message_id, message_class_string, send_when_prepared=False):
             send_message(message_id=message_id, message_class_string=message_class_string)
 
 
+#: Max number of retries :func:`.send_message` makes at locking a message.
+SEND_MESSAGE_MAX_ATTEMPTS = 10
+
+
+def get_send_message_retry_delay(attempt_number):
+    """
+    Get the delay before retry number ``attempt_number`` of :func:`.send_message`.
+
+    Exponential backoff starting at 1 second, capped at 1 minute.
+    """
+    return timedelta(seconds=min(2 ** (attempt_number - 1), 60))
+
+
+def _retry_send_message(message_id, message_class_string, attempt_number):
+    """
+    Schedule a new attempt at :func:`.send_message` with RQ instead of
+    sleeping in the worker.
+
+    Scheduled jobs require the worker to run with the RQ scheduler
+    (``python manage.py rqworker --with-scheduler``). Synchronous queues
+    (``ASYNC=False``, typically in development) retry right away.
+    """
+    import django_rq
+    from atelier.atelier_messages import messageframework_settings
+
+    queue = django_rq.get_queue(messageframework_settings.get_rq_queue_name())
+    if queue.is_async:
+        queue.enqueue_in(get_send_message_retry_delay(attempt_number), send_message,
+                         message_id=message_id, message_class_string=message_class_string,
+                         attempt_number=attempt_number)
+    else:
+        send_message(message_id=message_id, message_class_string=message_class_string,
+                     attempt_number=attempt_number)
+
+
 def _handle_get_message_failure(logger, message_class, message_class_string, message_id,
                                 attempt_number):
     from atelier.atelier_messages.models import BaseMessage
 
     try:
-        message = message_class.objects.filter(id=message_id)
+        message = message_class.objects.get(id=message_id)
     except message_class.DoesNotExist:
         logger.error('%s: Trying to send the message with ID %s, but that message does not exist.',
                      message_class_string, message_id)
     else:
         if message.status == BaseMessage.STATUS_CHOICES.READY_FOR_SENDING.value:
-            if attempt_number > 10:
+            if attempt_number > SEND_MESSAGE_MAX_ATTEMPTS:
                 logger.error(
                     '%s: Failed to send the message with ID %s. Attempted to get a lock on it %s times, '
                     'but the status is still %s (must be queued_for_sending to aquire sending lock).',
@@ -122,8 +160,8 @@ def _handle_get_message_failure(logger, message_class, message_class_string, mes
                 logger.warning('%s: Message with ID %s has incorrect status for sending %s '
                                '(must be queued_for_sending). This is attempt %s, so we will try again.',
                                message_class_string, message_id, message.status, attempt_number)
-                send_message(message_id=message_id, message_class_string=message_class_string,
-                             attempt_number=attempt_number + 1)
+                _retry_send_message(message_id=message_id, message_class_string=message_class_string,
+                                    attempt_number=attempt_number + 1)
         else:
             logger.warning(
                 '%s: Another task has probably already started processing/sending the message with ID %s. '
@@ -131,6 +169,130 @@ def _handle_get_message_failure(logger, message_class, message_class_string, mes
                 message_class_string, message_id, message.status)
 
 
+def _get_message_receiver_id_ranges(message, chunk_size):
+    """
+    Split the receivers of ``message`` into id ranges with ``chunk_size`` receivers in each range.
+
+    Uses a single query, which numbers the receivers with ``row_number()``, and only returns
+    the id of the first receiver in each chunk.
+
+    Returns:
+        list: List of ``(first_id, next_first_id)`` tuples. The ranges are half open, so
+        ``next_first_id`` is not included in the range. ``first_id`` is ``None`` for
+        the first range, and ``next_first_id`` is ``None`` for the last range.
+    """
+    from django.db import connection
+    from atelier.atelier_messages.models import MessageReceiver
+
+    quote_name = connection.ops.quote_name
+    sql = """
+        SELECT numbered.id FROM (
+            SELECT {id} AS id, row_number() OVER (ORDER BY {id}) AS receiver_number
+            FROM {table}
+            WHERE {message_id} = %s
+        ) AS numbered
+        WHERE numbered.receiver_number %% %s = 1
+        ORDER BY numbered.id
+    """.format(
+        id=quote_name(MessageReceiver._meta.pk.column),
+        table=quote_name(MessageReceiver._meta.db_table),
+        message_id=quote_name(MessageReceiver._meta.get_field('message').column))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [message.id, chunk_size])
+        # The first id is not used, since the first range is open ended.
+        first_ids = [None] + [row[0] for row in cursor.fetchall()[1:]]
+    return list(zip(first_ids, first_ids[1:] + [None]))
+
+
+def _set_unsent_message_receivers_error(message_receivers, exception):
+    """
+    Set the status of the not yet sent receivers in the ``message_receivers`` queryset
+    to ``error``, with ``exception`` as the error.
+
+    Returns:
+        int: The number of updated receivers.
+    """
+    from atelier.atelier_messages.models import MessageReceiver, MessageReceiverError
+
+    fingerprint, exception_type, exception_traceback = MessageReceiverError.objects.describe_exception(exception)
+    error_ids = MessageReceiverError.objects.get_or_create_many({
+        fingerprint: (exception_type, exception_traceback)
+    })
+    return message_receivers \
+        .filter(status=MessageReceiver.STATUS_CHOICES.NOT_SENT.value) \
+        .update(status=MessageReceiver.STATUS_CHOICES.ERROR.value,
+                status_data={'error_message': str(exception)},
+                error_id=error_ids[fingerprint])
+
+
+def _send_to_message_receivers(message, message_receivers, logger):
+    """
+    Send ``message`` to the given ``message_receivers`` queryset using the
+    backend for each message type.
+
+    If a backend crashes (E.g.: if it can not open a connection), the receivers it
+    has not sent to get the ``error`` status, so that the message can still be finalized.
+    """
+    from atelier.atelier_messages import backend_registry
+
+    for message_type in message.message_types:
+        backend_message_receivers = message_receivers.filter(message_type=message_type)
+        try:
+            backend_class = backend_registry.Registry \
+                .get_instance() \
+                .get(message_type=message_type)
+            backend = backend_class(
+                message=message,
+                message_receivers=backend_message_receivers)
+            backend.send_messages()
+        except Exception as exception:
+            logger.exception('Sending %s to receivers of BaseMessage#%s crashed with: %s',
+                             message_type, message.id, exception)
+            _set_unsent_message_receivers_error(message_receivers=backend_message_receivers, exception=exception)
+
+
+def _finalize_message(message_class, message_class_string, message_id, logger):
+    """
+    Set the final status (``sent``, ``partly_sent`` or ``error``) of a message
+    when there are no receivers left to send to.
+
+    Safe to call from concurrent :func:`.send_message_chunk` tasks - the
+    message is locked, and only finalized once.
+    """
+    from django.db import transaction
+    from atelier.atelier_messages.models import BaseMessage
+    from atelier.atelier_messages import metrics
+
+    with transaction.atomic():
+        message = message_class.objects.select_for_update().get(id=message_id)
+        if message.status != BaseMessage.STATUS_CHOICES.SENDING_IN_PROGRESS.value:
+            return
+        status_counts = message.messagereceiver_set.get_status_counts()
+        if status_counts['not_sent']:
+            # Other chunks are still sending
+            return
+
+        # Set status sent
+        error_count = status_counts['error']
+        total_count = status_counts['total']
+        if error_count:
+            if error_count == total_count:
+                message.status = BaseMessage.STATUS_CHOICES.ERROR.value
+                logger.error('%s: Failed to send BaseMessage#%s to ALL %s recipients.',
+                             message_class_string, message.id, total_count)
+            else:
+                message.status = BaseMessage.STATUS_CHOICES.PARTLY_SENT.value
+                logger.warning('%s: Failed to send BaseMessage#%s to %s/%s recipients.',
+                               message_class_string, message.id, error_count, total_count)
+            message.status_data = {
+                'details': f'Failed to send to {error_count}/{total_count} recipients.'
+            }
+        else:
+            message.status = BaseMessage.STATUS_CHOICES.SENT.value
+        message.save()
+    metrics.increment(metrics.MESSAGES_FINALIZED_TOTAL, message_class=message_class_string, status=message.status)
+
+
 def send_message(message_id, message_class_string, attempt_number=0):
     """
     Sends a message with the appropriate backend.
@@ -140,26 +302,32 @@ def send_message(message_id, message_class_string, attempt_number=0):
         2. Status is set to ``sending_in_progress``
         3. Call backends for each message_type in ``message.message_types``, and sent to `MessageReceiver`s.
            MessageReceiver
+
+    If the message has more receivers than
+    :func:`~atelier.atelier_messages.messageframework_settings.get_send_fan_out_chunk_size`,
+    step 3 is split into id ranges, and each range is sent by a :func:`.send_message_chunk`
+    RQ task. The last chunk to complete sets the final status of the message.
     """
-    from atelier.atelier_messages import backend_registry
+    import django_rq
     from django.db import transaction
     from atelier.atelier_messages.models import BaseMessage
     from atelier.atelier_messages import messageclass_registry
-    from atelier.atelier_messages.models import MessageReceiver
+    from atelier.atelier_messages import messageframework_settings
+    from atelier.atelier_messages import metrics
     import logging
     logger = logging.getLogger(__name__)
+    metrics.observe_queue_wait('send_message')
 
-    # The attempt_number and sleep() is here to auto-heal in cases where the database transaction
-    # that sets the message status to QUEUED_FOR_SENDING is not committed before the task is
-    # started.
+    # The task is enqueued when the transaction that sets the status to QUEUED_FOR_SENDING
+    # is committed (see BaseMessage.enqueue_task_on_commit()), so we do not have to wait for
+    # that here. If we still can not lock the message, _handle_get_message_failure() schedules
+    # a retry with backoff.
     if attempt_number == 0:
         logger.debug('%s: Starting attempt %s for sending message with ID %s.',
                      message_class_string, attempt_number, message_id)
-        time.sleep(1)
     else:
         logger.warning('%s: Starting attempt %s for sending message with ID %s.',
                        message_class_string, attempt_number, message_id)
-        time.sleep(3)
 
     message_class = messageclass_registry.Registry \
         .get_instance() \
@@ -189,30 +357,280 @@ def send_message(message_id, message_class_string, attempt_number=0):
             message.sms_part_count = sms_backend.get_part_count(message.message_content_plain)
         message.save()
 
-    for message_type in message.message_types:
-        backend_class = backend_registry.Registry \
-            .get_instance() \
-            .get(message_type=message_type)
-        backend = backend_class(
-            message=message,
-            message_receivers=message.messagereceiver_set.filter(message_type=message_type))
-        backend.send_messages()
-
-    # Set status sent
-    if message.messagereceiver_set.filter(status=MessageReceiver.STATUS_CHOICES.ERROR.value).exists():
-        error_count = message.messagereceiver_set.filter(status=MessageReceiver.STATUS_CHOICES.ERROR.value).count()
-        total_count = message.messagereceiver_set.count()
-        if error_count == total_count:
-            message.status = BaseMessage.STATUS_CHOICES.ERROR.value
-            logger.error('%s: Failed to send BaseMessage#%s to ALL %s recipients.',
-                         message_class_string, message.id, total_count)
-        else:
-            message.status = BaseMessage.STATUS_CHOICES.PARTLY_SENT.value
-            logger.warning('%s: Failed to send BaseMessage#%s to %s/%s recipients.',
-                           message_class_string, message.id, error_count, total_count)
-        message.status_data = {
-            'details': f'Failed to send to {error_count}/{total_count} recipients.'
-        }
-    else:
-        message.status = BaseMessage.STATUS_CHOICES.SENT.value
-    message.save()
+    id_ranges = _get_message_receiver_id_ranges(
+        message=message, chunk_size=messageframework_settings.get_send_fan_out_chunk_size())
+    if len(id_ranges) > 1:
+        queue = django_rq.get_queue(messageframework_settings.get_rq_queue_name())
+        for first_id, next_first_id in id_ranges:
+            queue.enqueue(send_message_chunk,
+                          message_id=message_id,
+                          message_class_string=message_class_string,
+                          first_id=first_id,
+                          next_first_id=next_first_id)
+        logger.info('%s: Split sending of BaseMessage#%s into %s chunks.',
+                    message_class_string, message_id, len(id_ranges))
+        return
+
+    _send_to_message_receivers(message=message, message_receivers=message.messagereceiver_set.all(), logger=logger)
+    _finalize_message(message_class=message_class, message_class_string=message_class_string,
+                      message_id=message_id, logger=logger)
+
+
+def send_message_chunk(message_id, message_class_string, first_id=None, next_first_id=None):
+    """
+    Send a message to the not yet sent receivers with id in the ``[first_id, next_first_id)``
+    range. Enqueued by :func:`.send_message` for messages with many receivers.
+
+    When the chunk is sent, the final status of the message is set
+    if there are no unsent receivers left. If sending the chunk crashes, the receivers
+    in the chunk that were not sent get the ``error`` status, so the message is still finalized.
+
+    Args:
+        message_id: A ``BaseMessage`` instance id.
+        message_class_string: The message class string.
+        first_id: The first MessageReceiver id in the chunk. ``None`` for the first chunk.
+        next_first_id: The first MessageReceiver id in the next chunk. ``None`` for the last chunk.
+    """
+    from atelier.atelier_messages.models import BaseMessage
+    from atelier.atelier_messages import messageclass_registry
+    from atelier.atelier_messages.models import MessageReceiver
+    from atelier.atelier_messages import metrics
+    import logging
+    logger = logging.getLogger(__name__)
+    metrics.observe_queue_wait('send_message_chunk')
+
+    message_class = messageclass_registry.Registry \
+        .get_instance() \
+        .get(message_class_string=message_class_string)
+    message = message_class.objects.get(id=message_id)
+    if message.status != BaseMessage.STATUS_CHOICES.SENDING_IN_PROGRESS.value:
+        logger.warning('%s: Skipping chunk %s-%s of BaseMessage#%s with status %s '
+                       '(must be sending_in_progress).',
+                       message_class_string, first_id, next_first_id, message_id, message.status)
+        return
+
+    message_receivers = message.messagereceiver_set.filter(status=MessageReceiver.STATUS_CHOICES.NOT_SENT.value)
+    if first_id is not None:
+        message_receivers = message_receivers.filter(id__gte=first_id)
+    if next_first_id is not None:
+        message_receivers = message_receivers.filter(id__lt=next_first_id)
+    _send_to_message_receivers(message=message, message_receivers=message_receivers, logger=logger)
+    _finalize_message(message_class=message_class, message_class_string=message_class_string,
+                      message_id=message_id, logger=logger)
+
+
+def _enqueue_scheduled_messages(message_class, batch_size, requeue_after):
+    """
+    Claim up to ``batch_size`` due messages of ``message_class``, and enqueue
+    :func:`.send_message` for each of them when the claim is committed.
+
+    Returns:
+        int: The number of messages enqueued.
+    """
+    from django.db import transaction
+    from django.utils import timezone
+
+    with transaction.atomic():
+        now = timezone.now()
+        # skip_locked makes concurrent schedulers claim disjoint batches instead
+        # of blocking on (and then enqueuing) the same messages.
+        message_ids = list(
+            message_class.objects
+            .filter_due_for_scheduled_sending(now=now, requeue_after=requeue_after)
+            .select_for_update(skip_locked=True)
+            .order_by('requested_send_datetime', 'id')
+            .values_list('id', flat=True)[:batch_size])
+        if not message_ids:
+            return 0
+        message_class.objects.filter(id__in=message_ids).update(scheduled_send_enqueued_datetime=now)
+        for message in message_class.objects.filter(id__in=message_ids).only('id'):
+            message.enqueue_task_on_commit(send_message)
+    return len(message_ids)
+
+
+def send_scheduled_messages(batch_size=None):
+    """
+    Enqueue :func:`.send_message` for all messages that are queued for sending with
+    a :obj:`~.atelier.atelier_messages.models.BaseMessage.requested_send_datetime` that has passed.
+
+    Messages are claimed in batches of ``batch_size`` messages with
+    ``SELECT ... FOR UPDATE SKIP LOCKED``, so it is safe to run this from
+    multiple processes at the same time. A claimed message is not enqueued again
+    unless it is still queued for sending after
+    :func:`~atelier.atelier_messages.messageframework_settings.get_scheduled_send_requeue_after`.
+    Even then, :func:`.send_message` only sends messages that are queued for sending,
+    so a message is never sent twice.
+
+    Run this periodically, E.g.: with the ``atelier_messages_send_scheduled_messages``
+    management command.
+
+    Args:
+        batch_size: Max number of messages to claim per transaction. Defaults to
+            :func:`~atelier.atelier_messages.messageframework_settings.get_scheduled_send_batch_size`.
+
+    Returns:
+        int: The number of messages enqueued for sending.
+    """
+    from atelier.atelier_messages import messageclass_registry
+    from atelier.atelier_messages import messageframework_settings
+    import logging
+    logger = logging.getLogger(__name__)
+
+    batch_size = batch_size or messageframework_settings.get_scheduled_send_batch_size()
+    requeue_after = messageframework_settings.get_scheduled_send_requeue_after()
+    enqueued_count = 0
+    for message_class in messageclass_registry.Registry.get_instance():
+        while True:
+            batch_count = _enqueue_scheduled_messages(
+                message_class=message_class, batch_size=batch_size, requeue_after=requeue_after)
+            if batch_count:
+                logger.info('%s: Enqueued %s scheduled messages for sending.',
+                            message_class.get_message_class_string(), batch_count)
+            enqueued_count += batch_count
+            if batch_count < batch_size:
+                break
+    return enqueued_count
+
+
+#: Redis key with the id of the scheduled :func:`.apply_message_retention` job.
+#: See :func:`.schedule_message_retention`.
+MESSAGE_RETENTION_SCHEDULED_JOB_KEY = 'atelier_messages:retention:scheduled_job_id'
+
+
+def apply_message_retention(reschedule_seconds=None):
+    """
+    Anonymize or delete old messages as configured with the ``ATELIER_MESSAGES_RETENTION_DAYS``,
+    ``ATELIER_MESSAGES_RETENTION_ACTION`` and ``ATELIER_MESSAGES_RETENTION_EXPORT_DIRECTORY``
+    settings. Does nothing if ``ATELIER_MESSAGES_RETENTION_DAYS`` is not set.
+
+    See :class:`atelier.atelier_messages.retention.MessageRetention`.
+
+    If ``reschedule_seconds`` is given, the task schedules itself to run again after
+    ``reschedule_seconds`` seconds, even if it fails (see :func:`.schedule_message_retention`).
+
+    Returns:
+        dict: The number of processed objects, or ``None`` if retention is not configured.
+    """
+    import os
+    import logging
+    from django.utils import timezone
+    from atelier.atelier_messages import messageframework_settings
+    from atelier.atelier_messages.retention import MessageRetention
+    logger = logging.getLogger(__name__)
+
+    try:
+        retention_days = messageframework_settings.get_retention_days()
+        if retention_days is None:
+            return None
+        now = timezone.now()
+        export_directory = messageframework_settings.get_retention_export_directory()
+        export_path = None
+        if export_directory:
+            export_path = os.path.join(export_directory, f'atelier_messages_retention_{now:%Y-%m-%d}.jsonl.gz')
+        result = MessageRetention(
+            older_than=now - timedelta(days=retention_days),
+            action=messageframework_settings.get_retention_action(),
+            export_path=export_path).run()
+        logger.info('Message retention: Processed %(message_receivers)s receivers and %(messages)s messages.',
+                    result)
+        return result
+    finally:
+        if reschedule_seconds:
+            _reschedule_message_retention(interval_seconds=reschedule_seconds)
+
+
+def schedule_message_retention(interval_seconds):
+    """
+    Schedule :func:`.apply_message_retention` to run after ``interval_seconds`` seconds, and
+    then every ``interval_seconds`` seconds. Requires an RQ worker running with ``--with-scheduler``.
+
+    Does nothing if the job is already scheduled (or running), so this is safe to
+    call every time the server starts.
+
+    Returns:
+        bool: ``True`` if the job was scheduled.
+    """
+    import django_rq
+    from rq.job import Job
+    from atelier.atelier_messages import messageframework_settings
+
+    queue = django_rq.get_queue(messageframework_settings.get_rq_queue_name())
+    scheduled_job_id = queue.connection.get(MESSAGE_RETENTION_SCHEDULED_JOB_KEY)
+    if scheduled_job_id and Job.exists(scheduled_job_id.decode('utf-8'), connection=queue.connection):
+        return False
+    job = queue.enqueue_in(timedelta(seconds=interval_seconds), apply_message_retention,
+                           reschedule_seconds=interval_seconds)
+    queue.connection.set(MESSAGE_RETENTION_SCHEDULED_JOB_KEY, job.id)
+    return True
+
+
+def _reschedule_message_retention(interval_seconds):
+    """
+    Schedule the next :func:`.apply_message_retention` job from the currently running job,
+    unless another job has been scheduled in its place.
+    """
+    import django_rq
+    from rq import get_current_job
+    from atelier.atelier_messages import messageframework_settings
+
+    connection = django_rq.get_connection(messageframework_settings.get_rq_queue_name())
+    current_job = get_current_job()
+    scheduled_job_id = connection.get(MESSAGE_RETENTION_SCHEDULED_JOB_KEY)
+    if scheduled_job_id is not None and (current_job is None or scheduled_job_id.decode('utf-8') != current_job.id):
+        return
+    connection.delete(MESSAGE_RETENTION_SCHEDULED_JOB_KEY)
+    schedule_message_retention(interval_seconds=interval_seconds)
+
+
+def process_esp_events(batch_size=None, buffer=None):
+    """
+    Apply the ESP delivery events buffered by the ESP webhook views
+    (see :mod:`atelier.atelier_messages.esp_events`) to the receivers
+    of the messages, in batches of ``batch_size`` events.
+
+    Events for receivers that we can not find yet (E.g.: if the webhook request
+    arrived before the receiver was saved with its ESP message id) are
+    pushed back to the buffer and retried by the next job, up to
+    :func:`~atelier.atelier_messages.messageframework_settings.get_esp_events_max_attempts` times.
+
+    Returns:
+        int: The number of updated receivers.
+    """
+    import logging
+    from atelier.atelier_messages import esp_events
+    from atelier.atelier_messages import messageframework_settings
+    logger = logging.getLogger(__name__)
+
+    batch_size = batch_size or messageframework_settings.get_esp_events_batch_size()
+    max_attempts = messageframework_settings.get_esp_events_max_attempts()
+    buffer = buffer or esp_events.EspEventBuffer()
+    # Cleared before we pop events, so that events pushed while we run schedule a new job.
+    buffer.clear_scheduled()
+    updated_count = 0
+    retry_events = []
+    while True:
+        events = buffer.pop_batch(batch_size)
+        if not events:
+            break
+        try:
+            batch_updated_count, unmatched_events = esp_events.apply_esp_events(events)
+        except Exception:
+            buffer.push(*events)
+            # The scheduled flag is already cleared, so nothing would process the events
+            # until the next webhook request.
+            buffer.schedule_processing(delay=messageframework_settings.get_esp_events_retry_delay())
+            raise
+        updated_count += batch_updated_count
+        for event in unmatched_events:
+            event['attempts'] = event.get('attempts', 0) + 1
+            if event['attempts'] < max_attempts:
+                retry_events.append(event)
+            else:
+                logger.warning('Giving up ESP event with no matching receiver: %r', event)
+        if len(events) < batch_size:
+            break
+    if retry_events:
+        buffer.push(*retry_events)
+        buffer.schedule_processing(delay=messageframework_settings.get_esp_events_retry_delay())
+    logger.info('Applied ESP events to %s message receivers.', updated_count)
+    return updated_count
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django import test
+from model_mommy import mommy
+
+from atelier.atelier_messages.backends.atelier_sms import AtelierSmsMessageSender
+
+
+class StrictSmsBackend(object):
+    """
+    An ievv_sms backend that does not accept a ``requests_session``.
+    """
+    sent_to = []
+
+    def __init__(self, phone_number, message, send_as=None):
+        self.phone_number = phone_number
+
+    def send(self):
+        self.sent_to.append(self.phone_number)
+
+
+class SessionSmsBackend(StrictSmsBackend):
+    supports_requests_session = True
+
+    def __init__(self, phone_number, message, send_as=None, requests_session=None):
+        super().__init__(phone_number=phone_number, message=message, send_as=send_as)
+        self.requests_session = requests_session
+
+
+class TestAtelierSmsMessageSender(test.TestCase):
+    def _send(self, sms_backend_class):
+        message = mommy.make('atelier_messages.SystemMessage', message_types=['sms'],
+                             message_content_plain='Test')
+        mommy.make('atelier_messages.MessageReceiver', message=message, message_type='sms', send_to='+4712345678')
+        sender = AtelierSmsMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        with mock.patch('atelier.atelier_messages.backends.atelier_sms.sms_registry.Registry.get_instance') \
+                as mock_get_instance:
+            mock_get_instance.return_value.get_backend_class_by_id.return_value = sms_backend_class
+            sender.open_connection()
+            try:
+                sender.send_message_receiver_chunk(list(message.messagereceiver_set.all()))
+            finally:
+                sender.close_connection()
+        return sender, message
+
+    def test_backend_without_requests_session_support(self):
+        StrictSmsBackend.sent_to = []
+        sender, message = self._send(sms_backend_class=StrictSmsBackend)
+        self.assertNotIn('requests_session', sender.sms_kwargs)
+        self.assertEqual(StrictSmsBackend.sent_to, ['+4712345678'])
+        self.assertEqual(message.messagereceiver_set.get().status, 'sent')
+
+    def test_backend_with_requests_session_support(self):
+        SessionSmsBackend.sent_to = []
+        sender, message = self._send(sms_backend_class=SessionSmsBackend)
+        self.assertIn('requests_session', sender.sms_kwargs)
+        self.assertEqual(SessionSmsBackend.sent_to, ['+4712345678'])
+        self.assertEqual(message.messagereceiver_set.get().status, 'sent')
@@ -0,0 +1,157 @@
+import threading
+import time
+import traceback
+from io import StringIO
+from unittest import mock
+
+from django import test
+from django.core.management import call_command
+from model_mommy import mommy
+
+from atelier.atelier_messages.backends.base import AbstractMessageSender, DatabaseConnectionClosingThreadPoolExecutor
+from atelier.atelier_messages.models import MessageReceiver, MessageReceiverError
+
+
+class MockMessageSender(AbstractMessageSender):
+    message_type = 'mock'
+    chunk_size = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent_to = []
+
+    def send_message(self, message_receiver):
+        if message_receiver.send_to == 'fail':
+            raise ValueError('Failed')
+        self.sent_to.append(message_receiver.send_to)
+
+
+class TestAbstractMessageSender(test.TestCase):
+    def test_iter_message_receiver_chunks_queryset(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, _quantity=5)
+        sender = MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        self.assertEqual([len(chunk) for chunk in sender.iter_message_receiver_chunks()], [2, 2, 1])
+
+    def test_iter_message_receiver_chunks_list(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        message_receivers = mommy.make('atelier_messages.MessageReceiver', message=message, _quantity=4)
+        sender = MockMessageSender(message=message, message_receivers=message_receivers)
+        self.assertEqual([len(chunk) for chunk in sender.iter_message_receiver_chunks()], [2, 2])
+
+    def test_send_messages(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='a')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='b')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='c')
+        sender = MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        sender.send_messages()
+        self.assertEqual(sorted(sender.sent_to), ['a', 'b', 'c'])
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.SENT.value,
+                                           sent_datetime__isnull=False).count(),
+            3)
+
+    def test_send_messages_error(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        message_receiver = mommy.make('atelier_messages.MessageReceiver', message=message, send_to='fail')
+        sender = MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        sender.send_messages()
+        message_receiver.refresh_from_db()
+        self.assertEqual(message_receiver.status, MessageReceiver.STATUS_CHOICES.ERROR.value)
+        self.assertEqual(message_receiver.status_data['error_message'], 'Failed')
+        self.assertIsNone(message_receiver.sent_datetime)
+
+    def test_send_messages_errors_are_deduplicated(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='fail', _quantity=5)
+        sender = MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        sender.send_messages()
+        self.assertEqual(MessageReceiverError.objects.count(), 1)
+        error = MessageReceiverError.objects.get()
+        self.assertEqual(error.exception_type, 'builtins.ValueError')
+        self.assertIn("raise ValueError('Failed')", error.exception_traceback)
+        self.assertEqual(MessageReceiver.objects.filter(error=error).count(), 5)
+
+    def test_send_messages_one_update_query_per_chunk(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, _quantity=4)
+        sender = MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        # 2 chunks: one SELECT and one UPDATE each. The second chunk is full, so we need
+        # one more SELECT to detect that there are no more receivers.
+        with self.assertNumQueries(5):
+            sender.send_messages()
+
+
+class TestDatabaseConnectionClosingThreadPoolExecutor(test.SimpleTestCase):
+    def _make_mock_connections(self):
+        connections_by_thread = {}
+        mock_connections = mock.Mock()
+
+        def get_thread_connections():
+            return connections_by_thread.setdefault(threading.get_ident(), [mock.Mock()])
+
+        mock_connections.all.side_effect = get_thread_connections
+        return mock_connections, connections_by_thread
+
+    def test_closes_connections_once_per_worker_thread(self):
+        mock_connections, connections_by_thread = self._make_mock_connections()
+
+        def task(index):
+            time.sleep(0.01)
+            return threading.get_ident()
+
+        with mock.patch('atelier.atelier_messages.backends.base.connections', mock_connections):
+            with DatabaseConnectionClosingThreadPoolExecutor(max_workers=3) as executor:
+                task_threads = set(executor.map(task, range(12)))
+                self.assertFalse(any(thread_connections[0].close.called
+                                     for thread_connections in connections_by_thread.values()))
+        self.assertEqual(set(connections_by_thread.keys()), task_threads)
+        for thread_connections in connections_by_thread.values():
+            thread_connections[0].close.assert_called_once_with()
+
+    def test_fewer_threads_than_max_workers_does_not_block(self):
+        mock_connections, connections_by_thread = self._make_mock_connections()
+        start = time.perf_counter()
+        with mock.patch('atelier.atelier_messages.backends.base.connections', mock_connections):
+            with DatabaseConnectionClosingThreadPoolExecutor(max_workers=8) as executor:
+                executor.submit(lambda: None).result()
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(len(connections_by_thread), 1)
+        list(connections_by_thread.values())[0][0].close.assert_called_once_with()
+
+
+class TestCompactReceiverErrors(test.TestCase):
+    def test_legacy_traceback_is_deduplicated_with_new_errors(self):
+        raised_exceptions = []
+
+        class RecordingMessageSender(MockMessageSender):
+            def send_message(self, message_receiver):
+                exception = ValueError(f'Failed for {message_receiver.send_to}')
+                raised_exceptions.append(exception)
+                raise exception
+
+        message = mommy.make('atelier_messages.BaseMessage')
+        message_receivers = [
+            mommy.make('atelier_messages.MessageReceiver', message=message, send_to='a'),
+            mommy.make('atelier_messages.MessageReceiver', message=message, send_to='b'),
+        ]
+        RecordingMessageSender(message=message, message_receivers=[]).send_message_receiver_chunk(message_receivers)
+        error = MessageReceiverError.objects.get()
+
+        # Older versions of the senders stored traceback.format_exc() in status_data
+        exception = raised_exceptions[1]
+        legacy_message_receiver = mommy.make(
+            'atelier_messages.MessageReceiver', message=message, send_to='legacy',
+            status=MessageReceiver.STATUS_CHOICES.ERROR.value,
+            status_data={
+                'error_message': str(exception),
+                'exception_traceback': ''.join(traceback.format_exception(
+                    type(exception), exception, exception.__traceback__)),
+            })
+        call_command('atelier_messages_compact_receiver_errors', stdout=StringIO())
+        legacy_message_receiver.refresh_from_db()
+        self.assertEqual(legacy_message_receiver.error_id, error.id)
+        self.assertEqual(legacy_message_receiver.status_data, {'error_message': 'Failed for b'})
+        self.assertEqual(MessageReceiverError.objects.count(), 1)
+        self.assertEqual(error.exception_type, 'builtins.ValueError')
@@ -0,0 +1,55 @@
+import smtplib
+from unittest import mock
+
+from django import test
+from django.core import mail
+from model_mommy import mommy
+
+from atelier.atelier_messages.backends.django_email import DjangoEmailMessageSender
+from atelier.atelier_messages.models import MessageReceiver
+
+
+class TestDjangoEmailMessageSender(test.TestCase):
+    def _make_message(self, receiver_count):
+        message = mommy.make('atelier_messages.SystemMessage',
+                             message_types=['email'],
+                             subject='Test',
+                             message_content_html='<p>Test</p>',
+                             message_content_plain='Test')
+        for index in range(receiver_count):
+            mommy.make('atelier_messages.MessageReceiver', message=message, message_type='email',
+                       send_to=f'test{index}@example.com')
+        return message
+
+    def test_reuses_one_connection(self):
+        message = self._make_message(receiver_count=3)
+        sender = DjangoEmailMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        with mock.patch('atelier.atelier_messages.backends.django_email.mail.get_connection',
+                        wraps=mail.get_connection) as mock_get_connection:
+            sender.send_messages()
+        self.assertEqual(mock_get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.SENT.value).count(), 3)
+
+    def test_reconnects_when_disconnected(self):
+        message = self._make_message(receiver_count=1)
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [smtplib.SMTPServerDisconnected('Gone'), 1]
+        sender = DjangoEmailMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        with mock.patch('atelier.atelier_messages.backends.django_email.mail.get_connection',
+                        return_value=connection):
+            sender.send_messages()
+        self.assertEqual(connection.send_messages.call_count, 2)
+        self.assertEqual(connection.open.call_count, 2)
+        self.assertEqual(MessageReceiver.objects.get().status, MessageReceiver.STATUS_CHOICES.SENT.value)
+
+    def test_not_sent_is_error(self):
+        message = self._make_message(receiver_count=1)
+        connection = mock.Mock()
+        connection.send_messages.return_value = 0
+        sender = DjangoEmailMessageSender(message=message, message_receivers=message.messagereceiver_set.all())
+        with mock.patch('atelier.atelier_messages.backends.django_email.mail.get_connection',
+                        return_value=connection):
+            sender.send_messages()
+        self.assertEqual(MessageReceiver.objects.get().status, MessageReceiver.STATUS_CHOICES.ERROR.value)
@@ -0,0 +1,131 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+
+from django import test
+from model_mommy import mommy
+
+from atelier.atelier_messages.backends.mailgun_api_email import MailgunApiEmailMessageSender
+from atelier.atelier_messages.models import MessageReceiver, SystemMessage
+
+
+class StubMailgunRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.server.received_requests.append({
+            'path': self.path,
+            'client_address': self.client_address,
+            'authorization': self.headers.get('Authorization'),
+            'data': parse_qs(body),
+        })
+        if parse_qs(body)['to'][0].startswith('proxy-error'):
+            response = b'<html><body>502 Bad Gateway</body></html>'
+            self.send_response(502)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+            return
+        response = json.dumps({
+            'id': '<{}@stub.mailgun>'.format(len(self.server.received_requests)),
+            'message': 'Queued. Thank you.'
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMailgunApiEmailMessageSender(test.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubMailgunRequestHandler)
+        self.server.received_requests = []
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __make_message(self, receiver_count, send_to_prefix='test'):
+        message = mommy.make('atelier_messages.SystemMessage',
+                             subject='Test',
+                             message_types=['email'],
+                             message_content_html='<p>Hello</p>',
+                             message_content_plain='Hello')
+        for index in range(receiver_count):
+            mommy.make('atelier_messages.MessageReceiver', message=message,
+                       message_type='email', send_to=f'{send_to_prefix}{index}@example.com')
+        return message
+
+    def __send(self, message, message_receivers=None, **settings):
+        with self.settings(MAILGUN_API_BASE_URL='http://127.0.0.1:{}/v3/example.com'.format(self.server.server_port),
+                           MAILGUN_API_KEY='test-key', **settings):
+            MailgunApiEmailMessageSender(
+                message=message,
+                message_receivers=message_receivers or message.messagereceiver_set.all()).send_messages()
+
+    def test_send_messages(self):
+        message = self.__make_message(receiver_count=3)
+        self.__send(message)
+        self.assertEqual(len(self.server.received_requests), 3)
+        self.assertEqual(
+            sorted(request['data']['to'][0] for request in self.server.received_requests),
+            ['test0@example.com', 'test1@example.com', 'test2@example.com'])
+        self.assertEqual(self.server.received_requests[0]['path'], '/v3/example.com/messages')
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.SENT.value).count(), 3)
+        message.refresh_from_db()
+        self.assertTrue(message.esp_ok_status)
+
+    def test_send_messages_stores_esp_message_id_on_receiver(self):
+        message = self.__make_message(receiver_count=1)
+        self.__send(message)
+        message_receiver = message.messagereceiver_set.get()
+        self.assertEqual(message_receiver.status_data['esp_message_id'], '1@stub.mailgun')
+        self.assertEqual(message_receiver.esp_message_id, '1@stub.mailgun')
+        self.assertTrue(message_receiver.status_data['esp_ok_status'])
+
+    def test_send_messages_reuses_connection(self):
+        message = self.__make_message(receiver_count=3)
+        self.__send(message)
+        client_addresses = {request['client_address'] for request in self.server.received_requests}
+        self.assertEqual(len(client_addresses), 1)
+
+    def test_send_messages_uses_session_auth(self):
+        message = self.__make_message(receiver_count=2)
+        self.__send(message)
+        self.assertEqual({request['authorization'] for request in self.server.received_requests},
+                         {'Basic YXBpOnRlc3Qta2V5'})
+
+    def test_send_messages_non_json_error_response(self):
+        message = self.__make_message(receiver_count=1, send_to_prefix='proxy-error')
+        self.__send(message)
+        message_receiver = message.messagereceiver_set.get()
+        self.assertIsNone(message_receiver.esp_message_id)
+        self.assertEqual(message_receiver.status_data['esp_status_code'], 502)
+        self.assertFalse(message_receiver.status_data['esp_ok_status'])
+        message.refresh_from_db()
+        self.assertFalse(message.esp_ok_status)
+        self.assertEqual(message.appspecific_metadata['mailgun_sending_error']['status_code'], 502)
+        self.assertIn('502 Bad Gateway', message.appspecific_metadata['mailgun_sending_error']['data'])
+
+    def test_concurrent_chunks_do_not_overwrite_message_esp_status(self):
+        message = self.__make_message(receiver_count=1)
+        mommy.make('atelier_messages.MessageReceiver', message=message,
+                   message_type='email', send_to='proxy-error@example.com')
+        # Chunk jobs each load their own copy of the message when they start
+        stale_message = SystemMessage.objects.get(id=message.id)
+        self.__send(message, message_receivers=message.messagereceiver_set.filter(send_to__startswith='proxy-error'))
+        self.__send(stale_message, message_receivers=message.messagereceiver_set.exclude(
+            send_to__startswith='proxy-error'))
+        message.refresh_from_db()
+        self.assertFalse(message.esp_ok_status)
+        self.assertEqual(message.appspecific_metadata['mailgun_sending_error']['status_code'], 502)
@@ -0,0 +1,112 @@
+from unittest import mock
+
+from django import test
+from django.core import mail
+from model_mommy import mommy
+
+from atelier.atelier_email import template_cache
+from atelier.atelier_messages import basemessage_email
+from atelier.atelier_messages.backends.django_email import DjangoEmailMessageSender
+from atelier.atelier_messages.models import BaseMessage, MessageReceiver
+
+
+class LowercaseSendToEmail(basemessage_email.BaseMessageEmail):
+    def render_html_message(self):
+        if self.prerendered_email:
+            return super().render_html_message()
+        return f'<p>Sent to {self.message_receiver.send_to.lower()}</p>'
+
+
+class NoPrerenderedEmailSupportEmail(basemessage_email.BaseMessageEmail):
+    supports_prerendered_email = False
+
+    def __init__(self, message, message_receiver, **kwargs):
+        super().__init__(message=message, message_receiver=message_receiver, **kwargs)
+
+
+class TestPrerenderedEmail(test.TestCase):
+    def test_substitutes_send_to(self):
+        placeholder = basemessage_email.PrerenderedEmail.SEND_TO_PLACEHOLDER
+        prerendered_email = basemessage_email.PrerenderedEmail(
+            subject=f'Hi {placeholder}',
+            html_message=f'<p>Sent to {placeholder}</p>',
+            plaintext_message=f'Sent to {placeholder}')
+        self.assertEqual(prerendered_email.render_subject(send_to='a&b@example.com'), 'Hi a&b@example.com')
+        self.assertEqual(prerendered_email.render_html_message(send_to='a&b@example.com'),
+                         '<p>Sent to a&amp;b@example.com</p>')
+        self.assertEqual(prerendered_email.render_plaintext_message(send_to='a&b@example.com'),
+                         'Sent to a&b@example.com')
+
+    def test_has_transformed_send_to(self):
+        placeholder = basemessage_email.PrerenderedEmail.SEND_TO_PLACEHOLDER
+        self.assertFalse(basemessage_email.PrerenderedEmail(
+            subject='Hi', html_message=f'<p>{placeholder}</p>', plaintext_message='Hi').has_transformed_send_to())
+        self.assertTrue(basemessage_email.PrerenderedEmail(
+            subject='Hi', html_message=f'<p>{placeholder.lower()}</p>',
+            plaintext_message=placeholder).has_transformed_send_to())
+
+
+class TestRenderEmailOnce(test.TestCase):
+    def _make_message(self):
+        return mommy.make('atelier_messages.SystemMessage',
+                          subject='Test',
+                          message_content_html='<p>Hello <strong>world</strong></p>',
+                          message_content_plain='Hello world')
+
+    def _get_send_mail_kwargs(self, message, send_to):
+        message_receiver = MessageReceiver(message=message, message_type='email', send_to=send_to)
+        return message.prepare_email(message_receiver=message_receiver).get_send_mail_kwargs()
+
+    def test_same_result_as_rendering_per_receiver(self):
+        message = self._make_message()
+        message.render_email_once = False
+        expected = self._get_send_mail_kwargs(message=message, send_to='test@example.com')
+        message.render_email_once = True
+        self.assertEqual(self._get_send_mail_kwargs(message=message, send_to='test@example.com'), expected)
+
+    def test_renders_templates_once(self):
+        message = self._make_message()
+        message.render_email_once = True
+        with mock.patch('atelier.atelier_email.template_cache.render_email_template',
+                        wraps=template_cache.render_email_template) as mock_render_email_template:
+            first = self._get_send_mail_kwargs(message=message, send_to='first@example.com')
+            second = self._get_send_mail_kwargs(message=message, send_to='second@example.com')
+        self.assertEqual(mock_render_email_template.call_count, 1)
+        self.assertEqual(first['recipient_list'], ['first@example.com'])
+        self.assertEqual(second['recipient_list'], ['second@example.com'])
+        self.assertEqual(first['html_message'], second['html_message'])
+
+    def test_disabled_by_default(self):
+        self.assertFalse(BaseMessage.render_email_once)
+
+    def test_enabled_for_system_messages(self):
+        self.assertTrue(self._make_message().get_render_email_once())
+
+    def test_email_class_without_prerendered_email_support(self):
+        message = self._make_message()
+        with mock.patch.object(message, 'get_email_class', lambda message_receiver: NoPrerenderedEmailSupportEmail):
+            email = message.prepare_email(
+                message_receiver=MessageReceiver(message=message, message_type='email', send_to='test@example.com'))
+        self.assertIsNone(email.prerendered_email)
+        self.assertFalse(hasattr(message, '_prerendered_email'))
+
+    def test_send_to_many_receivers(self):
+        message = self._make_message()
+        for send_to in ['first@example.com', 'second@example.com', 'third@example.com']:
+            mommy.make('atelier_messages.MessageReceiver', message=message, message_type='email', send_to=send_to)
+        with mock.patch('atelier.atelier_email.template_cache.render_email_template',
+                        wraps=template_cache.render_email_template) as mock_render_email_template:
+            DjangoEmailMessageSender(message=message, message_receivers=message.messagereceiver_set.all()) \
+                .send_messages()
+        self.assertEqual(mock_render_email_template.call_count, 1)
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox),
+                         ['first@example.com', 'second@example.com', 'third@example.com'])
+
+    def test_transformed_send_to_is_rendered_per_receiver(self):
+        message = self._make_message()
+        with mock.patch.object(message, 'get_email_class', lambda message_receiver: LowercaseSendToEmail):
+            first = self._get_send_mail_kwargs(message=message, send_to='First@Example.com')
+            second = self._get_send_mail_kwargs(message=message, send_to='Second@Example.com')
+        self.assertIsNone(message.get_prerendered_email())
+        self.assertEqual(first['html_message'], '<p>Sent to first@example.com</p>')
+        self.assertEqual(second['html_message'], '<p>Sent to second@example.com</p>')
@@ -0,0 +1,228 @@
+import hashlib
+import hmac
+import json
+import time
+from unittest import mock
+
+from django import test
+from django.urls import reverse
+from model_mommy import mommy
+
+from atelier.atelier_messages import esp_events, tasks
+from atelier.atelier_messages.models import MessageReceiver
+from atelier.atelier_messages.views.mailgun_webhook import MailgunWebhookView
+
+
+def make_mailgun_signature(signing_key, timestamp, token):
+    return hmac.new(key=signing_key.encode('utf-8'), msg=f'{timestamp}{token}'.encode('utf-8'),
+                    digestmod=hashlib.sha256).hexdigest()
+
+
+def make_event(esp_message_id, status='received', timestamp=1):
+    return {
+        'esp_message_id': esp_message_id,
+        'status': status,
+        'event': 'delivered' if status == 'received' else 'failed',
+        'timestamp': timestamp,
+    }
+
+
+class ListEventBuffer(object):
+    def __init__(self, events=None):
+        self.events = list(events or [])
+        self.scheduled_count = 0
+
+    def push(self, *events):
+        self.events.extend(events)
+
+    def pop_batch(self, batch_size):
+        batch, self.events = self.events[:batch_size], self.events[batch_size:]
+        return batch
+
+    def schedule_processing(self, delay=None):
+        self.scheduled_count += 1
+
+    def clear_scheduled(self):
+        pass
+
+
+class TestVerifyMailgunSignature(test.SimpleTestCase):
+    def test_valid(self):
+        timestamp = str(int(time.time()))
+        self.assertTrue(esp_events.verify_mailgun_signature(
+            signing_key='key', timestamp=timestamp, token='token',
+            signature=make_mailgun_signature('key', timestamp, 'token')))
+
+    def test_invalid_signature(self):
+        timestamp = str(int(time.time()))
+        self.assertFalse(esp_events.verify_mailgun_signature(
+            signing_key='key', timestamp=timestamp, token='token',
+            signature=make_mailgun_signature('otherkey', timestamp, 'token')))
+
+    def test_old_timestamp(self):
+        timestamp = str(int(time.time()) - esp_events.MAILGUN_SIGNATURE_MAX_AGE_SECONDS - 10)
+        self.assertFalse(esp_events.verify_mailgun_signature(
+            signing_key='key', timestamp=timestamp, token='token',
+            signature=make_mailgun_signature('key', timestamp, 'token')))
+
+    def test_no_signing_key(self):
+        timestamp = str(int(time.time()))
+        self.assertFalse(esp_events.verify_mailgun_signature(
+            signing_key=None, timestamp=timestamp, token='token',
+            signature=make_mailgun_signature('', timestamp, 'token')))
+
+
+class TestParseMailgunEvent(test.SimpleTestCase):
+    def test_delivered(self):
+        event = esp_events.parse_mailgun_event({
+            'event': 'delivered', 'timestamp': 10.5,
+            'message': {'headers': {'message-id': '<1@stub.mailgun>'}},
+        })
+        self.assertEqual(event['esp_message_id'], '1@stub.mailgun')
+        self.assertEqual(event['status'], 'received')
+        self.assertEqual(event['timestamp'], 10.5)
+
+    def test_permanent_failure(self):
+        event = esp_events.parse_mailgun_event({
+            'event': 'failed', 'severity': 'permanent', 'reason': 'bounce',
+            'delivery-status': {'code': 550, 'message': 'No such user'},
+            'message': {'headers': {'message-id': '1@stub.mailgun'}},
+        })
+        self.assertEqual(event['status'], 'error')
+        self.assertEqual(event['delivery_status_code'], 550)
+        self.assertEqual(event['delivery_status_message'], 'No such user')
+
+    def test_temporary_failure_is_ignored(self):
+        self.assertIsNone(esp_events.parse_mailgun_event({
+            'event': 'failed', 'severity': 'temporary',
+            'message': {'headers': {'message-id': '1@stub.mailgun'}},
+        }))
+
+    def test_other_events_are_ignored(self):
+        self.assertIsNone(esp_events.parse_mailgun_event({
+            'event': 'opened', 'message': {'headers': {'message-id': '1@stub.mailgun'}},
+        }))
+
+
+class TestApplyEspEvents(test.TestCase):
+    def test_updates_receivers_in_bulk(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        for index in range(3):
+            mommy.make('atelier_messages.MessageReceiver', message=message,
+                       status=MessageReceiver.STATUS_CHOICES.SENT.value,
+                       esp_message_id=f'{index}@stub.mailgun', status_data={'esp_ok_status': True})
+        with self.assertNumQueries(2):
+            updated_count, unmatched_events = esp_events.apply_esp_events([
+                make_event('0@stub.mailgun'),
+                make_event('1@stub.mailgun'),
+                make_event('2@stub.mailgun', status='error'),
+            ])
+        self.assertEqual(updated_count, 3)
+        self.assertEqual(unmatched_events, [])
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.RECEIVED.value).count(), 2)
+        message_receiver = MessageReceiver.objects.get(esp_message_id='2@stub.mailgun')
+        self.assertEqual(message_receiver.status, MessageReceiver.STATUS_CHOICES.ERROR.value)
+        self.assertTrue(message_receiver.status_data['esp_ok_status'])
+        self.assertEqual(message_receiver.status_data['esp_event'], 'failed')
+
+    def test_latest_event_wins(self):
+        mommy.make('atelier_messages.MessageReceiver', esp_message_id='1@stub.mailgun')
+        esp_events.apply_esp_events([
+            make_event('1@stub.mailgun', status='received', timestamp=2),
+            make_event('1@stub.mailgun', status='error', timestamp=1),
+        ])
+        self.assertEqual(MessageReceiver.objects.get().status, MessageReceiver.STATUS_CHOICES.RECEIVED.value)
+
+    def test_unmatched_events(self):
+        updated_count, unmatched_events = esp_events.apply_esp_events([make_event('unknown@stub.mailgun')])
+        self.assertEqual(updated_count, 0)
+        self.assertEqual([event['esp_message_id'] for event in unmatched_events], ['unknown@stub.mailgun'])
+
+
+class TestProcessEspEvents(test.TestCase):
+    def test_processes_all_batches(self):
+        for index in range(5):
+            mommy.make('atelier_messages.MessageReceiver', esp_message_id=f'{index}@stub.mailgun')
+        buffer = ListEventBuffer([make_event(f'{index}@stub.mailgun') for index in range(5)])
+        self.assertEqual(tasks.process_esp_events(batch_size=2, buffer=buffer), 5)
+        self.assertEqual(buffer.events, [])
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.RECEIVED.value).count(), 5)
+
+    def test_unmatched_events_are_retried(self):
+        buffer = ListEventBuffer([make_event('unknown@stub.mailgun')])
+        with self.settings(ATELIER_MESSAGES_ESP_EVENTS_MAX_ATTEMPTS=2):
+            tasks.process_esp_events(buffer=buffer)
+            self.assertEqual(len(buffer.events), 1)
+            self.assertEqual(buffer.scheduled_count, 1)
+            tasks.process_esp_events(buffer=buffer)
+            self.assertEqual(buffer.events, [])
+
+
+    def test_crash_reschedules(self):
+        buffer = ListEventBuffer([make_event('1@stub.mailgun')])
+        with mock.patch('atelier.atelier_messages.esp_events.apply_esp_events', side_effect=RuntimeError()), \
+                self.assertRaises(RuntimeError):
+            tasks.process_esp_events(buffer=buffer)
+        self.assertEqual([event['esp_message_id'] for event in buffer.events], ['1@stub.mailgun'])
+        self.assertEqual(buffer.scheduled_count, 1)
+
+class TestMailgunWebhookView(test.TestCase):
+    def __post(self, payload):
+        return self.client.post(reverse('atelier_messages_mailgun_webhook'),
+                                data=json.dumps(payload), content_type='application/json')
+
+    def __make_payload(self, signing_key='key', event='delivered'):
+        timestamp = str(int(time.time()))
+        return {
+            'signature': {
+                'timestamp': timestamp,
+                'token': 'token',
+                'signature': make_mailgun_signature(signing_key, timestamp, 'token'),
+            },
+            'event-data': {
+                'event': event,
+                'timestamp': float(timestamp),
+                'message': {'headers': {'message-id': '1@stub.mailgun'}},
+            },
+        }
+
+    def test_buffers_event(self):
+        buffer = ListEventBuffer()
+        with mock.patch.object(MailgunWebhookView, 'get_event_buffer', return_value=buffer), \
+                self.settings(MAILGUN_WEBHOOK_SIGNING_KEY='key'), \
+                self.assertNumQueries(0):
+            response = self.__post(self.__make_payload())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event['esp_message_id'] for event in buffer.events], ['1@stub.mailgun'])
+        self.assertEqual(buffer.scheduled_count, 1)
+
+    def test_invalid_signature(self):
+        buffer = ListEventBuffer()
+        with mock.patch.object(MailgunWebhookView, 'get_event_buffer', return_value=buffer), \
+                self.settings(MAILGUN_WEBHOOK_SIGNING_KEY='key'):
+            response = self.__post(self.__make_payload(signing_key='otherkey'))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(buffer.events, [])
+
+    def test_ignored_event(self):
+        buffer = ListEventBuffer()
+        with mock.patch.object(MailgunWebhookView, 'get_event_buffer', return_value=buffer), \
+                self.settings(MAILGUN_WEBHOOK_SIGNING_KEY='key'):
+            response = self.__post(self.__make_payload(event='opened'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(buffer.events, [])
+
+    def test_invalid_payload(self):
+        response = self.client.post(reverse('atelier_messages_mailgun_webhook'),
+                                    data='not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_signature_not_a_dict(self):
+        payload = self.__make_payload()
+        for signature in ['signature', ['signature']]:
+            payload['signature'] = signature
+            with self.settings(MAILGUN_WEBHOOK_SIGNING_KEY='key'):
+                response = self.__post(payload)
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django import test
+
+from atelier.atelier_messages.ievv_sms_backends import linkmobility
+
+
+class TestLinkmobilityBackend(test.TestCase):
+    def _make_backend(self, requests_session, message='Test – message ø'):
+        return linkmobility.Backend(
+            phone_number='12345678',
+            message=message,
+            linkmobility_sender='Tester',
+            linkmobility_username='user',
+            linkmobility_password='password',
+            linkmobility_default_country_code='47',
+            requests_session=requests_session)
+
+    def test_clean_message(self):
+        backend = self._make_backend(requests_session=mock.Mock(), message='Test – message ø ☃')
+        self.assertEqual(backend.cleaned_message, 'Test - message ø ')
+
+    def test_send_uses_session_and_returns_result(self):
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(
+            ok=True, status_code=200,
+            json=lambda: {'messageId': 'abc', 'resultCode': 1005, 'description': 'Queued'})
+        result = self._make_backend(requests_session=session).send()
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(session.post.call_args[1]['json']['destination'], '+4712345678')
+        self.assertEqual(result, {
+            'linkmobility_message_id': 'abc',
+            'linkmobility_result_code': 1005,
+            'linkmobility_description': 'Queued',
+        })
+
+    def test_send_raises_on_error_response(self):
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(
+            ok=False, status_code=400, text='Bad request',
+            json=lambda: {'resultCode': 106, 'description': 'Invalid destination'})
+        with self.assertRaisesMessage(linkmobility.LinkMobilityError, 'Invalid destination'):
+            self._make_backend(requests_session=session).send()
+
+    def test_send_raises_on_invalid_json_response(self):
+        def invalid_json():
+            raise ValueError('No JSON object could be decoded')
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(ok=False, status_code=502, text='<html>Bad gateway</html>',
+                                              json=invalid_json)
+        with self.assertRaisesMessage(linkmobility.LinkMobilityError, 'Bad gateway'):
+            self._make_backend(requests_session=session).send()
+
+    def test_send_raises_on_non_dict_json_response(self):
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(ok=True, status_code=200, text='["ok"]', json=lambda: ['ok'])
+        with self.assertRaises(linkmobility.LinkMobilityError):
+            self._make_backend(requests_session=session).send()
@@ -0,0 +1,54 @@
+from unittest import mock
+
+import django_rq.settings
+from django import test
+
+from atelier.atelier_messages import loadtest, messageframework_settings
+from atelier.atelier_messages.models import MessageReceiver
+
+
+class TestPercentile(test.SimpleTestCase):
+    def test_empty(self):
+        self.assertIsNone(loadtest.percentile([], 50))
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 95), 95)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([3, 1, 2], 99), 3)
+
+
+class TestMessagePipelineLoadTest(test.TestCase):
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            loadtest.MessagePipelineLoadTest(mode='invalid')
+
+    def test_broadcast_message_receivers(self):
+        load_test = loadtest.MessagePipelineLoadTest(message_types=['email', 'sms'])
+        message = load_test.create_messages(count=1, receiver_count=1500)[0]
+        chunks = list(load_test._iter_broadcast_message_receivers(message=message, receiver_count=1500))
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 1000])
+        self.assertEqual({receiver.message_type for receiver in chunks[0]}, {'email', 'sms'})
+
+
+class TestMessagePipelineLoadTestRun(test.TransactionTestCase):
+    # A TransactionTestCase, since the RQ tasks are enqueued when the transactions are committed.
+
+    def test_run_sync(self):
+        load_test = loadtest.MessagePipelineLoadTest(
+            message_count=2, broadcast_count=1, receivers_per_broadcast=3, keep_messages=True)
+        # Configure the queue as async, like in production. The sync mode must still send the messages.
+        with mock.patch.dict(django_rq.settings.QUEUES[messageframework_settings.get_rq_queue_name()],
+                             {'ASYNC': True}):
+            single_receiver_result, broadcast_result = load_test.run()
+        self.assertEqual(single_receiver_result['messages'], 2)
+        self.assertEqual(single_receiver_result['receivers'], 2)
+        self.assertEqual(single_receiver_result['status_counts'], {'sent': 2})
+        self.assertEqual(broadcast_result['messages'], 1)
+        self.assertEqual(broadcast_result['receivers'], 3)
+        self.assertEqual(broadcast_result['status_counts'], {'sent': 1})
+        self.assertEqual(
+            set(MessageReceiver.objects.filter(
+                message__appspecific_metadata__load_test_run_id=load_test.run_id).values_list('status', flat=True)),
+            {'sent'})
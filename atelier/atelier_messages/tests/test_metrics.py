@@ -0,0 +1,119 @@
+from django import test
+from django.urls import reverse
+from model_mommy import mommy
+
+from atelier.atelier_messages import metrics
+from atelier.atelier_messages.tests.test_backends_base import MockMessageSender
+
+LOCAL_MEMORY_SINK = 'atelier.atelier_messages.metrics.LocalMemoryMetricsSink'
+FAILING_SINK = 'atelier.atelier_messages.tests.test_metrics.FailingMetricsSink'
+
+
+class FailingMetricsSink(metrics.BaseMetricsSink):
+    """
+    Sink that fails like :class:`atelier.atelier_messages.metrics.RedisMetricsSink` does when Redis is down.
+    """
+    def increment(self, name, label_key, value=1):
+        raise ConnectionError('Redis is down')
+
+    def observe_many(self, name, label_key, values):
+        raise ConnectionError('Redis is down')
+
+
+class TestMetricsDisabled(test.SimpleTestCase):
+    def test_null_sink_by_default(self):
+        self.assertIsInstance(metrics.get_sink(), metrics.NullMetricsSink)
+        self.assertFalse(metrics.is_enabled())
+
+    def test_recording_is_noop(self):
+        metrics.increment(metrics.SENDS_TOTAL, status='sent')
+        metrics.observe(metrics.SEND_SECONDS, 0.1)
+        with metrics.timer(metrics.PREPARE_SECONDS):
+            pass
+        self.assertEqual(metrics.get_sink().collect(), ({}, {}))
+
+
+@test.override_settings(ATELIER_MESSAGES_METRICS_SINK=LOCAL_MEMORY_SINK)
+class TestLocalMemoryMetricsSink(test.SimpleTestCase):
+    def test_increment(self):
+        metrics.increment(metrics.SENDS_TOTAL, status='sent')
+        metrics.increment(metrics.SENDS_TOTAL, 2, status='sent')
+        counters, histograms = metrics.get_sink().collect()
+        self.assertEqual(counters, {(metrics.SENDS_TOTAL, (('status', 'sent'),)): 3})
+
+    def test_observe(self):
+        metrics.observe_many(metrics.SEND_SECONDS, [0.001, 0.2, 1000], backend='x')
+        counters, histograms = metrics.get_sink().collect()
+        histogram = histograms[(metrics.SEND_SECONDS, (('backend', 'x'),))]
+        self.assertEqual(histogram['count'], 3)
+        self.assertEqual(histogram['buckets'][0], 1)
+        self.assertEqual(histogram['buckets'][-1], 1)
+        self.assertEqual(sum(histogram['buckets']), 3)
+
+    def test_render_prometheus_text(self):
+        metrics.increment(metrics.SENDS_TOTAL, status='error')
+        metrics.observe(metrics.PREPARE_SECONDS, 0.2, message_class='SystemMessage')
+        text = metrics.render_prometheus_text(gauges={
+            'atelier_messages_in_flight_messages': ('Help.', {(('status', 'preparing'),): 2}),
+        })
+        self.assertIn('# TYPE atelier_messages_sends_total counter\n'
+                      'atelier_messages_sends_total{status="error"} 1\n', text)
+        self.assertIn('atelier_messages_prepare_seconds_bucket{message_class="SystemMessage",le="0.1"} 0\n', text)
+        self.assertIn('atelier_messages_prepare_seconds_bucket{message_class="SystemMessage",le="0.25"} 1\n', text)
+        self.assertIn('atelier_messages_prepare_seconds_bucket{message_class="SystemMessage",le="+Inf"} 1\n', text)
+        self.assertIn('atelier_messages_prepare_seconds_count{message_class="SystemMessage"} 1\n', text)
+        self.assertIn('# TYPE atelier_messages_in_flight_messages gauge\n'
+                      'atelier_messages_in_flight_messages{status="preparing"} 2\n', text)
+
+
+@test.override_settings(ATELIER_MESSAGES_METRICS_SINK=LOCAL_MEMORY_SINK)
+class TestSenderMetrics(test.TestCase):
+    def test_send_messages_records_metrics(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='a')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='fail')
+        MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all()).send_messages()
+        counters, histograms = metrics.get_sink().collect()
+        labels = (('backend', 'MockMessageSender'), ('message_class', message.get_message_class_string()))
+        self.assertEqual(counters[(metrics.SENDS_TOTAL, labels + (('status', 'sent'),))], 1)
+        self.assertEqual(counters[(metrics.SENDS_TOTAL, labels + (('status', 'error'),))], 1)
+        histogram = histograms[(metrics.SEND_SECONDS, (('backend', 'MockMessageSender'), ('message_type', 'mock')))]
+        self.assertEqual(histogram['count'], 2)
+
+
+@test.override_settings(ATELIER_MESSAGES_METRICS_SINK=FAILING_SINK)
+class TestFailingMetricsSink(test.TestCase):
+    def test_recording_does_not_raise(self):
+        with self.assertLogs('atelier.atelier_messages.metrics', level='ERROR'):
+            metrics.increment(metrics.SENDS_TOTAL, status='sent')
+            with metrics.timer(metrics.PREPARE_SECONDS):
+                pass
+
+    def test_send_messages_saves_receivers(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='a', _quantity=2)
+        MockMessageSender(message=message, message_receivers=message.messagereceiver_set.all()).send_messages()
+        self.assertEqual(
+            set(message.messagereceiver_set.values_list('status', flat=True)),
+            {'sent'})
+
+
+class TestMetricsView(test.TestCase):
+    def test_disabled(self):
+        response = self.client.get(reverse('atelier_messages_metrics'))
+        self.assertEqual(response.status_code, 404)
+
+    @test.override_settings(ATELIER_MESSAGES_METRICS_SINK=LOCAL_MEMORY_SINK, ATELIER_MESSAGES_METRICS_TOKEN='secret')
+    def test_invalid_token(self):
+        response = self.client.get(reverse('atelier_messages_metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+    @test.override_settings(ATELIER_MESSAGES_METRICS_SINK=LOCAL_MEMORY_SINK, ATELIER_MESSAGES_METRICS_TOKEN='secret')
+    def test_in_flight_messages(self):
+        mommy.make('atelier_messages.BaseMessage', status='sending_in_progress', _quantity=2)
+        mommy.make('atelier_messages.BaseMessage', status='sent')
+        response = self.client.get(reverse('atelier_messages_metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode('utf-8')
+        self.assertIn('atelier_messages_in_flight_messages{status="sending_in_progress"} 2\n', text)
+        self.assertIn('atelier_messages_in_flight_messages{status="preparing"} 0\n', text)
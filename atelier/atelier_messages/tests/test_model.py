@@ -1,9 +1,14 @@
+from datetime import timedelta
+from unittest import mock
+
 from django import test
 from django.core.exceptions import ValidationError
 from django.test import override_settings
+from django.utils import timezone
 from model_mommy import mommy
 
-from atelier.atelier_messages.models import BaseMessage, BaseMessageAttachment
+from atelier.atelier_messages.models import BaseMessage, BaseMessageAttachment, SystemMessage
+from atelier.atelier_messages.tasks import send_message
 
 
 class TestBaseMessage(test.TestCase):
@@ -79,6 +84,49 @@ class TestBaseMessage(test.TestCase):
             message.get_email_attachment_links()[0]['link']
         )
 
+    def test_enqueue_task_on_commit(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        on_commit_callbacks = []
+        with mock.patch('atelier.atelier_messages.models.transaction.on_commit', on_commit_callbacks.append), \
+                mock.patch('atelier.atelier_messages.models.django_rq.get_queue') as mock_get_queue:
+            message.enqueue_task_on_commit(send_message)
+            mock_get_queue.return_value.enqueue.assert_not_called()
+            self.assertEqual(len(on_commit_callbacks), 1)
+            on_commit_callbacks[0]()
+        mock_get_queue.return_value.enqueue.assert_called_once_with(
+            send_message, message_id=message.id,
+            message_class_string='atelier.atelier_messages.models.BaseMessage')
+
+    @override_settings(ATELIER_MESSAGES_QUEUE_IN_REALTIME=False)
+    def test_enqueue_task_on_commit_not_in_realtime(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        with mock.patch('atelier.atelier_messages.models.transaction.on_commit') as mock_on_commit:
+            message.enqueue_task_on_commit(send_message)
+        mock_on_commit.assert_not_called()
+
+
+
+class TestCreateAndQueueForSending(test.TestCase):
+    def _create_and_queue_for_sending(self, requested_send_datetime):
+        with mock.patch.object(SystemMessage, 'enqueue_task_on_commit') as mock_enqueue_task_on_commit:
+            message = SystemMessage.objects.create_and_queue_for_sending(
+                message_types=['email'], subject='Test', message_content_plain='Test',
+                message_content_html='<p>Test</p>', virtual_message_receivers={'to_email': 'test@example.com'},
+                requested_send_datetime=requested_send_datetime)
+        self.assertEqual(message.status, BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value)
+        return mock_enqueue_task_on_commit
+
+    def test_enqueues_when_requested_send_datetime_is_none(self):
+        self._create_and_queue_for_sending(requested_send_datetime=None).assert_called_once_with(send_message)
+
+    def test_enqueues_when_requested_send_datetime_has_passed(self):
+        self._create_and_queue_for_sending(requested_send_datetime=timezone.now() - timedelta(minutes=1)) \
+            .assert_called_once_with(send_message)
+
+    def test_does_not_enqueue_when_scheduled_for_later(self):
+        self._create_and_queue_for_sending(requested_send_datetime=timezone.now() + timedelta(days=1)) \
+            .assert_not_called()
+
 
 class TestBaseMessageQuerysets(test.TestCase):
     def test_filter_locked_for_edit_status_values(self):
@@ -137,3 +185,114 @@ class TestBaseMessageAttachmentModel(test.TestCase):
         self.assertEqual(BaseMessageAttachment.objects.count(), 1)
         attachment.delete()
         self.assertEqual(BaseMessageAttachment.objects.count(), 0)
+
+
+class TestSystemMessageSend(test.TestCase):
+    def test_send_transactional(self):
+        from atelier.atelier_messages.models import SystemMessage, MessageReceiver
+        on_commit_callbacks = []
+        with mock.patch('atelier.atelier_messages.models.transaction.on_commit', on_commit_callbacks.append):
+            message = SystemMessage.objects.send(
+                subject='Test', message_content_html='<p>Code: 1234</p>',
+                to_email='test@example.com', transactional=True)
+        message.refresh_from_db()
+        self.assertEqual(message.status, BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value)
+        self.assertEqual(message.message_content_plain, 'Code: 1234')
+        message_receiver = MessageReceiver.objects.get(message=message)
+        self.assertEqual(message_receiver.send_to, 'test@example.com')
+        self.assertEqual(message_receiver.message_type, 'email')
+        self.assertEqual(message_receiver.status, MessageReceiver.STATUS_CHOICES.NOT_SENT.value)
+        self.assertEqual(len(on_commit_callbacks), 1)
+
+    def test_send_transactional_invalid(self):
+        from atelier.atelier_messages.models import SystemMessage
+        with self.assertRaises(ValidationError):
+            SystemMessage.objects.send(
+                subject='', message_content_html='<p>Code: 1234</p>',
+                to_email='test@example.com', transactional=True)
+        self.assertFalse(SystemMessage.objects.exists())
+
+
+class TestCreateMessageReceivers(test.TestCase):
+    def __make_message(self, prepared_message_receivers, **kwargs):
+        message = mommy.make('atelier_messages.BaseMessage', **kwargs)
+        message.prepare_message_receivers = lambda: prepared_message_receivers(message)
+        return message
+
+    def test_list(self):
+        from atelier.atelier_messages.models import MessageReceiver
+        message = self.__make_message(lambda message: [
+            MessageReceiver(message=message, message_type='email', send_to='a@example.com'),
+            MessageReceiver(message=message, message_type='email', send_to='b@example.com'),
+        ])
+        message.create_message_receivers()
+        self.assertEqual(message.messagereceiver_set.count(), 2)
+
+    def test_generator_of_receivers_in_batches(self):
+        from atelier.atelier_messages.models import MessageReceiver
+
+        def prepare_message_receivers(message):
+            for index in range(5):
+                yield MessageReceiver(message=message, message_type='email', send_to=f'{index}@example.com')
+
+        message = self.__make_message(prepare_message_receivers)
+        message.message_receiver_batch_size = 2
+        with self.assertNumQueries(3):
+            message.create_message_receivers()
+        self.assertEqual(message.messagereceiver_set.count(), 5)
+
+    def test_generator_of_lists(self):
+        from atelier.atelier_messages.models import MessageReceiver
+
+        def prepare_message_receivers(message):
+            for index in range(3):
+                yield [MessageReceiver(message=message, message_type='email', send_to=f'{index}@example.com'),
+                       MessageReceiver(message=message, message_type='sms', send_to=f'{index}')]
+
+        message = self.__make_message(prepare_message_receivers)
+        message.create_message_receivers()
+        self.assertEqual(message.messagereceiver_set.count(), 6)
+
+    def test_reduce_message_recipients_metadata(self):
+        from atelier.atelier_messages.models import MessageReceiver
+
+        def prepare_message_receivers(message):
+            for index in range(5):
+                yield MessageReceiver(message=message, message_type='email', send_to=f'{index}@example.com')
+
+        def reduce_message_recipients_metadata(recipients_metadata, message_receiver_list):
+            recipients_metadata['batch_sizes'] = recipients_metadata.get('batch_sizes', []) + [
+                len(message_receiver_list)]
+            return recipients_metadata
+
+        def set_reduced_message_recipients_metadata(recipients_metadata):
+            message.appspecific_metadata['recipients'] = recipients_metadata
+
+        message = self.__make_message(prepare_message_receivers)
+        message.message_receiver_batch_size = 2
+        message.reduce_message_recipients_metadata = reduce_message_recipients_metadata
+        message.set_reduced_message_recipients_metadata = set_reduced_message_recipients_metadata
+        message.create_message_receivers()
+        self.assertEqual(message.appspecific_metadata['recipients'], {'batch_sizes': [2, 2, 1]})
+
+
+class TestMessageReceiverQuerySet(test.TestCase):
+    def test_get_status_counts_is_single_query(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, status='not_sent', _quantity=3)
+        mommy.make('atelier_messages.MessageReceiver', message=message, status='error', _quantity=2)
+        mommy.make('atelier_messages.MessageReceiver', message=message, status='sent')
+        mommy.make('atelier_messages.MessageReceiver', status='error')
+        with self.assertNumQueries(1):
+            status_counts = message.messagereceiver_set.get_status_counts()
+        self.assertEqual(status_counts, {
+            'total': 6,
+            'not_sent': 3,
+            'error': 2,
+            'sent': 1,
+            'received': 0,
+        })
+
+    def test_get_status_counts_empty(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        self.assertEqual(message.messagereceiver_set.get_status_counts()['total'], 0)
@@ -0,0 +1,39 @@
+from django import test
+
+from atelier.atelier_messages.ratelimit import TokenBucket
+
+
+class MockClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(test.SimpleTestCase):
+    def test_invalid_rate(self):
+        with self.assertRaisesMessage(ValueError, 'rate must be a positive number.'):
+            TokenBucket(rate=0)
+
+    def test_burst_does_not_sleep(self):
+        clock = MockClock()
+        bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+        self.assertEqual([bucket.acquire() for _ in range(3)], [0, 0, 0])
+
+    def test_sleeps_when_empty(self):
+        clock = MockClock()
+        bucket = TokenBucket(rate=2, capacity=1, clock=clock, sleep=clock.sleep)
+        bucket.acquire()
+        self.assertEqual(bucket.acquire(), 0.5)
+        self.assertEqual(clock.now, 0.5)
+
+    def test_refills_over_time(self):
+        clock = MockClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock, sleep=clock.sleep)
+        bucket.acquire(2)
+        clock.now = 10
+        self.assertEqual(bucket.acquire(2), 0)
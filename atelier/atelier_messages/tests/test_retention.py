@@ -0,0 +1,97 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django import test
+from django.utils import timezone
+from model_mommy import mommy
+
+from atelier.atelier_messages import tasks
+from atelier.atelier_messages.models import BaseMessage, MessageReceiver
+from atelier.atelier_messages.retention import MessageRetention
+
+
+class TestMessageRetention(test.TestCase):
+    def _make_message(self, days_old, status=BaseMessage.STATUS_CHOICES.SENT.value, receiver_count=2):
+        message = mommy.make('atelier_messages.BaseMessage',
+                             status=status,
+                             created_datetime=timezone.now() - timedelta(days=days_old),
+                             virtual_message_receivers={'to_email': 'test@example.com'})
+        mommy.make('atelier_messages.MessageReceiver', message=message, send_to='test@example.com',
+                   send_to_metadata={'name': 'Test'}, _quantity=receiver_count)
+        return message
+
+    def test_anonymize(self):
+        old_message = self._make_message(days_old=400)
+        new_message = self._make_message(days_old=10)
+        result = MessageRetention(older_than=timezone.now() - timedelta(days=365), batch_size=1).run()
+        self.assertEqual(result, {'message_receivers': 2, 'messages': 1})
+        old_message.refresh_from_db()
+        self.assertIsNotNone(old_message.anonymized_datetime)
+        self.assertEqual(old_message.virtual_message_receivers, {})
+        for message_receiver in old_message.messagereceiver_set.all():
+            self.assertEqual(message_receiver.send_to, '')
+            self.assertEqual(message_receiver.send_to_metadata, {})
+            self.assertIsNotNone(message_receiver.anonymized_datetime)
+        self.assertFalse(new_message.messagereceiver_set.filter(send_to='').exists())
+
+    def test_anonymize_is_resumable(self):
+        self._make_message(days_old=400)
+        older_than = timezone.now() - timedelta(days=365)
+        MessageRetention(older_than=older_than).run()
+        self.assertEqual(MessageRetention(older_than=older_than).run(), {'message_receivers': 0, 'messages': 0})
+
+    def test_skips_messages_not_done_sending(self):
+        self._make_message(days_old=400, status=BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value)
+        result = MessageRetention(older_than=timezone.now() - timedelta(days=365)).run()
+        self.assertEqual(result, {'message_receivers': 0, 'messages': 0})
+
+    def test_delete_with_export(self):
+        self._make_message(days_old=400)
+        self._make_message(days_old=10)
+        with tempfile.TemporaryDirectory() as directory:
+            export_path = os.path.join(directory, 'export.jsonl.gz')
+            MessageRetention(older_than=timezone.now() - timedelta(days=365),
+                             action=MessageRetention.ACTION_DELETE,
+                             export_path=export_path).run()
+            with gzip.open(export_path, 'rt', encoding='utf-8') as export_file:
+                rows = [json.loads(line) for line in export_file]
+        self.assertEqual([row['model'] for row in rows], ['atelier_messages.messagereceiver'] * 2 +
+                         ['atelier_messages.basemessage'])
+        self.assertEqual(rows[0]['fields']['send_to'], 'test@example.com')
+        self.assertEqual(BaseMessage.objects.count(), 1)
+        self.assertEqual(MessageReceiver.objects.count(), 2)
+
+    def test_invalid_action(self):
+        with self.assertRaises(ValueError):
+            MessageRetention(older_than=timezone.now(), action='invalid')
+
+
+class TestScheduledMessageRetention(test.TestCase):
+    @test.override_settings(ATELIER_MESSAGES_RETENTION_DAYS=None)
+    def test_reschedules_itself(self):
+        with mock.patch.object(tasks, '_reschedule_message_retention') as mock_reschedule:
+            self.assertIsNone(tasks.apply_message_retention(reschedule_seconds=60))
+        mock_reschedule.assert_called_once_with(interval_seconds=60)
+
+    def test_does_not_reschedule_when_replaced_by_another_job(self):
+        connection = mock.Mock()
+        connection.get.return_value = b'other-job-id'
+        with mock.patch('django_rq.get_connection', return_value=connection), \
+                mock.patch('rq.get_current_job', return_value=mock.Mock(id='this-job-id')), \
+                mock.patch.object(tasks, 'schedule_message_retention') as mock_schedule:
+            tasks._reschedule_message_retention(interval_seconds=60)
+        mock_schedule.assert_not_called()
+
+    def test_reschedules_when_it_is_the_scheduled_job(self):
+        connection = mock.Mock()
+        connection.get.return_value = b'this-job-id'
+        with mock.patch('django_rq.get_connection', return_value=connection), \
+                mock.patch('rq.get_current_job', return_value=mock.Mock(id='this-job-id')), \
+                mock.patch.object(tasks, 'schedule_message_retention') as mock_schedule:
+            tasks._reschedule_message_retention(interval_seconds=60)
+        connection.delete.assert_called_once_with(tasks.MESSAGE_RETENTION_SCHEDULED_JOB_KEY)
+        mock_schedule.assert_called_once_with(interval_seconds=60)
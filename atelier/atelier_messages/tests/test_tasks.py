@@ -0,0 +1,145 @@
+from datetime import timedelta
+from unittest import mock
+
+from django import test
+from django.utils import timezone
+from model_mommy import mommy
+
+from atelier.atelier_messages import backend_registry, tasks
+from atelier.atelier_messages.backends.base import AbstractMessageSender
+from atelier.atelier_messages.models import BaseMessage, MessageReceiver, SystemMessage
+
+
+class MockMessageSender(AbstractMessageSender):
+    message_type = 'mock'
+
+    def send_message(self, message_receiver):
+        pass
+
+
+class TestSendMessageRetryDelay(test.SimpleTestCase):
+    def test_backoff(self):
+        self.assertEqual(tasks.get_send_message_retry_delay(1), timedelta(seconds=1))
+        self.assertEqual(tasks.get_send_message_retry_delay(2), timedelta(seconds=2))
+        self.assertEqual(tasks.get_send_message_retry_delay(4), timedelta(seconds=8))
+
+    def test_backoff_capped(self):
+        self.assertEqual(tasks.get_send_message_retry_delay(10), timedelta(seconds=60))
+
+
+class TestGetMessageReceiverIdRanges(test.TestCase):
+    def test_no_receivers(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        self.assertEqual(tasks._get_message_receiver_id_ranges(message=message, chunk_size=2), [(None, None)])
+
+    def test_single_chunk(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        mommy.make('atelier_messages.MessageReceiver', message=message, _quantity=2)
+        with self.assertNumQueries(1):
+            self.assertEqual(tasks._get_message_receiver_id_ranges(message=message, chunk_size=2),
+                             [(None, None)])
+
+    def test_multiple_chunks(self):
+        message = mommy.make('atelier_messages.BaseMessage')
+        receivers = mommy.make('atelier_messages.MessageReceiver', message=message, _quantity=5)
+        mommy.make('atelier_messages.MessageReceiver', _quantity=3)  # Receivers of other messages are ignored
+        receiver_ids = sorted(receiver.id for receiver in receivers)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                tasks._get_message_receiver_id_ranges(message=message, chunk_size=2),
+                [(None, receiver_ids[2]), (receiver_ids[2], receiver_ids[4]), (receiver_ids[4], None)])
+
+
+class TestSendMessageChunk(test.TestCase):
+    def test_finalizes_when_last_chunk_is_sent(self):
+        message = mommy.make('atelier_messages.SystemMessage',
+                             message_types=['mock'],
+                             status=BaseMessage.STATUS_CHOICES.SENDING_IN_PROGRESS.value)
+        receivers = mommy.make('atelier_messages.MessageReceiver', message=message,
+                               message_type='mock', _quantity=4)
+        receiver_ids = sorted(receiver.id for receiver in receivers)
+        message_class_string = SystemMessage.get_message_class_string()
+        mockregistry = backend_registry.MockableRegistry.make_mockregistry(MockMessageSender)
+        with mock.patch('atelier.atelier_messages.backend_registry.Registry.get_instance', lambda: mockregistry):
+            tasks.send_message_chunk(message_id=message.id, message_class_string=message_class_string,
+                                     first_id=None, next_first_id=receiver_ids[2])
+            message.refresh_from_db()
+            self.assertEqual(message.status, BaseMessage.STATUS_CHOICES.SENDING_IN_PROGRESS.value)
+            tasks.send_message_chunk(message_id=message.id, message_class_string=message_class_string,
+                                     first_id=receiver_ids[2], next_first_id=None)
+        message.refresh_from_db()
+        self.assertEqual(message.status, BaseMessage.STATUS_CHOICES.SENT.value)
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.SENT.value).count(), 4)
+
+
+class CrashingMockMessageSender(MockMessageSender):
+    def open_connection(self):
+        raise ConnectionError('Could not connect')
+
+
+class TestSendMessageChunkCrash(test.TestCase):
+    def test_crashed_chunk_receivers_get_error_status_and_message_is_finalized(self):
+        message = mommy.make('atelier_messages.SystemMessage',
+                             message_types=['mock'],
+                             status=BaseMessage.STATUS_CHOICES.SENDING_IN_PROGRESS.value)
+        receivers = mommy.make('atelier_messages.MessageReceiver', message=message,
+                               message_type='mock', _quantity=4)
+        receiver_ids = sorted(receiver.id for receiver in receivers)
+        message_class_string = SystemMessage.get_message_class_string()
+        with mock.patch('atelier.atelier_messages.backend_registry.Registry.get_instance',
+                        lambda: backend_registry.MockableRegistry.make_mockregistry(MockMessageSender)):
+            tasks.send_message_chunk(message_id=message.id, message_class_string=message_class_string,
+                                     first_id=None, next_first_id=receiver_ids[2])
+        with mock.patch('atelier.atelier_messages.backend_registry.Registry.get_instance',
+                        lambda: backend_registry.MockableRegistry.make_mockregistry(CrashingMockMessageSender)):
+            tasks.send_message_chunk(message_id=message.id, message_class_string=message_class_string,
+                                     first_id=receiver_ids[2], next_first_id=None)
+        message.refresh_from_db()
+        self.assertEqual(message.status, BaseMessage.STATUS_CHOICES.PARTLY_SENT.value)
+        crashed_receivers = MessageReceiver.objects.filter(id__in=receiver_ids[2:])
+        self.assertEqual({receiver.status for receiver in crashed_receivers},
+                         {MessageReceiver.STATUS_CHOICES.ERROR.value})
+        self.assertEqual({receiver.status_data['error_message'] for receiver in crashed_receivers},
+                         {'Could not connect'})
+        self.assertEqual({receiver.error.exception_type for receiver in crashed_receivers},
+                         {'builtins.ConnectionError'})
+        self.assertEqual(
+            MessageReceiver.objects.filter(status=MessageReceiver.STATUS_CHOICES.SENT.value).count(), 2)
+
+
+class TestSendScheduledMessages(test.TestCase):
+    def _make_message(self, requested_send_datetime, **kwargs):
+        return mommy.make('atelier_messages.SystemMessage',
+                          status=BaseMessage.STATUS_CHOICES.QUEUED_FOR_SENDING.value,
+                          requested_send_datetime=requested_send_datetime,
+                          **kwargs)
+
+    def test_enqueues_due_messages_only(self):
+        due_message = self._make_message(requested_send_datetime=timezone.now() - timedelta(minutes=1))
+        self._make_message(requested_send_datetime=timezone.now() + timedelta(minutes=1))
+        self._make_message(requested_send_datetime=None)
+        with mock.patch.object(SystemMessage, 'enqueue_task_on_commit') as mock_enqueue:
+            self.assertEqual(tasks.send_scheduled_messages(), 1)
+        mock_enqueue.assert_called_once_with(tasks.send_message)
+        due_message.refresh_from_db()
+        self.assertIsNotNone(due_message.scheduled_send_enqueued_datetime)
+
+    def test_does_not_enqueue_twice(self):
+        self._make_message(requested_send_datetime=timezone.now() - timedelta(minutes=1))
+        with mock.patch.object(SystemMessage, 'enqueue_task_on_commit'):
+            self.assertEqual(tasks.send_scheduled_messages(), 1)
+            self.assertEqual(tasks.send_scheduled_messages(), 0)
+
+    def test_requeues_stale_claims(self):
+        self._make_message(requested_send_datetime=timezone.now() - timedelta(days=1),
+                            scheduled_send_enqueued_datetime=timezone.now() - timedelta(days=1))
+        with mock.patch.object(SystemMessage, 'enqueue_task_on_commit'):
+            self.assertEqual(tasks.send_scheduled_messages(), 1)
+
+    def test_batches(self):
+        for index in range(5):
+            self._make_message(requested_send_datetime=timezone.now() - timedelta(minutes=index + 1))
+        with mock.patch.object(SystemMessage, 'enqueue_task_on_commit') as mock_enqueue:
+            self.assertEqual(tasks.send_scheduled_messages(batch_size=2), 5)
+        self.assertEqual(mock_enqueue.call_count, 5)
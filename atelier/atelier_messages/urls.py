@@ -0,0 +1,9 @@
+from django.urls import path
+
+from atelier.atelier_messages.views.mailgun_webhook import MailgunWebhookView
+from atelier.atelier_messages.views.metrics import MetricsView
+
+urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='atelier_messages_metrics'),
+    path('webhooks/mailgun/', MailgunWebhookView.as_view(), name='atelier_messages_mailgun_webhook'),
+]
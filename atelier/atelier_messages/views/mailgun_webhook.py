@@ -0,0 +1,51 @@
+import json
+import logging
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from atelier.atelier_messages import esp_events
+
+logger = logging.getLogger(__name__)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class MailgunWebhookView(View):
+    """
+    Receives Mailgun ``delivered`` and ``failed`` webhooks.
+
+    Verifies the signature with the ``MAILGUN_WEBHOOK_SIGNING_KEY`` setting, and
+    pushes the event to the :class:`~atelier.atelier_messages.esp_events.EspEventBuffer`.
+    The receivers are updated in batches by
+    :func:`~atelier.atelier_messages.tasks.process_esp_events`.
+    """
+    http_method_names = ['post']
+
+    def get_event_buffer(self):
+        return esp_events.EspEventBuffer()
+
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+            signature = payload['signature']
+            event_data = payload['event-data']
+        except (ValueError, KeyError, TypeError):
+            return HttpResponseBadRequest()
+        if not isinstance(signature, dict) or not isinstance(event_data, dict):
+            return HttpResponseBadRequest()
+        if not esp_events.verify_mailgun_signature(
+                signing_key=getattr(settings, 'MAILGUN_WEBHOOK_SIGNING_KEY', None),
+                timestamp=signature.get('timestamp'),
+                token=signature.get('token'),
+                signature=signature.get('signature')):
+            logger.warning('Mailgun webhook request with invalid signature.')
+            return HttpResponseForbidden()
+        event = esp_events.parse_mailgun_event(event_data)
+        if event is not None:
+            event_buffer = self.get_event_buffer()
+            event_buffer.push(event)
+            event_buffer.schedule_processing()
+        return HttpResponse()
@@ -0,0 +1,59 @@
+import hmac
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views import View
+
+from atelier.atelier_messages import metrics
+
+
+class MetricsView(View):
+    """
+    Exposes the message framework metrics (see :mod:`atelier.atelier_messages.metrics`)
+    in the Prometheus text format, along with the number of in-flight messages per status.
+
+    Returns ``404`` if metrics are disabled. If the ``ATELIER_MESSAGES_METRICS_TOKEN`` setting
+    is set, requests must have a ``Authorization: Bearer <token>`` header. If not, only
+    staff users have access.
+    """
+    http_method_names = ['get']
+
+    #: The message statuses included in the ``atelier_messages_in_flight_messages`` gauge.
+    in_flight_statuses = [
+        'queued_for_prepare',
+        'preparing',
+        'ready_for_sending',
+        'queued_for_sending',
+        'sending_in_progress',
+    ]
+
+    def has_access(self, request):
+        token = getattr(settings, 'ATELIER_MESSAGES_METRICS_TOKEN', None)
+        if token:
+            return hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+        return request.user.is_authenticated and request.user.is_staff
+
+    def get_in_flight_message_counts(self):
+        from atelier.atelier_messages.models import BaseMessage
+        counts = {status: 0 for status in self.in_flight_statuses}
+        queryset = BaseMessage.objects \
+            .filter(status__in=self.in_flight_statuses) \
+            .values('status') \
+            .annotate(count=Count('id')) \
+            .order_by()
+        for row in queryset:
+            counts[row['status']] = row['count']
+        return {(('status', status),): count for status, count in counts.items()}
+
+    def get(self, request, *args, **kwargs):
+        if not metrics.is_enabled():
+            raise Http404()
+        if not self.has_access(request):
+            return HttpResponseForbidden()
+        text = metrics.render_prometheus_text(gauges={
+            'atelier_messages_in_flight_messages': (
+                'Number of messages that are being prepared or sent, per status.',
+                self.get_in_flight_message_counts()),
+        })
+        return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -9,6 +9,7 @@ class GenericTokenWithMetadataAdmin(admin.ModelAdmin):
         'token',
         'content_object',
         'app',
+        'type',
         'created_datetime',
         'expiration_datetime',
         'expiration_naturaltime',
@@ -20,6 +21,7 @@ class GenericTokenWithMetadataAdmin(admin.ModelAdmin):
     )
     list_filter = (
         'app',
+        'type',
         'created_datetime',
         'expiration_datetime',
     )
@@ -28,6 +30,8 @@ class GenericTokenWithMetadataAdmin(admin.ModelAdmin):
         'content_type',
         'single_use',
         'metadata',
+        'type',
+        'attempts',
         'object_id',
         'app',
         'created_datetime',
@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the usable token and code lookups with many GenericTokenWithMetadata rows. ' \
+           'The rows are inserted in a transaction that is rolled back when the benchmark is complete.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000000,
+                            help='Number of token rows to insert. Defaults to 10000000.')
+        parser.add_argument('--objects', type=int, default=1000000,
+                            help='Number of distinct object ids the tokens are spread across. Defaults to 1000000.')
+        parser.add_argument('--lookups', type=int, default=1000,
+                            help='Number of lookups per benchmarked query. Defaults to 1000.')
+
+    def insert_rows(self, row_count, object_count, content_type):
+        # INSERT ... SELECT is much faster than bulk_create for this many rows.
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO {table} (app, token, created_datetime, expiration_datetime, single_use, metadata,
+                                     type, attempts, content_type_id, object_id)
+                SELECT
+                    (ARRAY['atelier', 'otherapp'])[1 + series.id % 2],
+                    'benchmark-' || series.id,
+                    NOW(),
+                    NOW() + ((series.id % 7) - 3) * INTERVAL '1 day',
+                    TRUE,
+                    '{{}}'::jsonb,
+                    (ARRAY['', 'email', 'mobile'])[1 + series.id % 3],
+                    series.id % 4,
+                    %s,
+                    1 + series.id % %s
+                FROM generate_series(1, %s) AS series(id)
+            """.format(table=connection.ops.quote_name(GenericTokenWithMetadata._meta.db_table)),
+                [content_type.id, object_count, row_count])
+            cursor.execute('ANALYZE {}'.format(connection.ops.quote_name(GenericTokenWithMetadata._meta.db_table)))
+
+    def benchmark(self, name, make_queryset, object_count, lookup_count):
+        durations = []
+        for _ in range(lookup_count):
+            queryset = make_queryset(random.randint(1, object_count))
+            start = time.perf_counter()
+            queryset.exists()
+            durations.append((time.perf_counter() - start) * 1000)
+        durations.sort()
+        self.stdout.write(f'{name}:')
+        self.stdout.write(f'  mean={statistics.mean(durations):.3f}ms '
+                          f'p50={durations[len(durations) // 2]:.3f}ms '
+                          f'p99={durations[int(len(durations) * 0.99) - 1]:.3f}ms')
+        sql, params = make_queryset(1).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            for row in cursor.fetchall():
+                self.stdout.write(f'    {row[0]}')
+
+    def handle(self, *args, **options):
+        content_type = ContentType.objects.get_for_model(GenericTokenWithMetadata)
+        object_count = options['objects']
+        lookup_count = options['lookups']
+        # DEBUG=True makes Django keep every query in memory, which would ruin the measurement.
+        with override_settings(DEBUG=False), transaction.atomic():
+            start = time.perf_counter()
+            self.insert_rows(row_count=options['rows'], object_count=object_count, content_type=content_type)
+            self.stdout.write(f'Inserted {options["rows"]} rows in {time.perf_counter() - start:.1f}s')
+
+            self.benchmark(
+                'filter_usable_by_content_type_and_id_in_app',
+                lambda object_id: GenericTokenWithMetadata.objects.filter_usable_by_content_type_and_id_in_app(
+                    content_type=content_type, object_id=object_id, app='atelier'),
+                object_count=object_count, lookup_count=lookup_count)
+            self.benchmark(
+                'filter_usable_codes',
+                lambda object_id: GenericTokenWithMetadata.objects.filter_usable_codes(
+                    content_type=content_type, object_id=object_id, app='atelier', code_type='email'),
+                object_count=object_count, lookup_count=lookup_count)
+            transaction.set_rollback(True)
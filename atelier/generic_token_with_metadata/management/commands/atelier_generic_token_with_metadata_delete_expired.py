@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+from django.core.management.base import BaseCommand
+from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata
+
+
+class Command(BaseCommand):
+    help = 'Delete all expired GenericTokenWithMetadata objects from the database in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of tokens to delete per query. Defaults to the '
+                                 'GENERIC_TOKEN_WITH_METADATA_PURGE_BATCH_SIZE setting (1000).')
+        parser.add_argument('--sleep', type=float, default=None, dest='sleep_seconds',
+                            help='Seconds to sleep between each batch. Defaults to the '
+                                 'GENERIC_TOKEN_WITH_METADATA_PURGE_SLEEP_SECONDS setting (0.1).')
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help='Stop after this many batches.')
+        parser.add_argument('--schedule-interval', type=int, default=None,
+                            help='Do not delete anything now. Instead, schedule an RQ job that deletes expired '
+                                 'tokens every SCHEDULE_INTERVAL seconds. Does nothing if the job is already '
+                                 'scheduled.')
+
+    def log_progress(self, batch_deleted_count, total_deleted_count):
+        if self.verbosity > 1:
+            self.stdout.write(f'Deleted {batch_deleted_count} expired tokens ({total_deleted_count} in total).')
+
+    def handle(self, **options):
+        self.verbosity = options['verbosity']
+        if options['schedule_interval']:
+            from atelier.generic_token_with_metadata.tasks import schedule_purge_expired_tokens
+            scheduled = schedule_purge_expired_tokens(
+                interval_seconds=options['schedule_interval'],
+                batch_size=options['batch_size'], sleep_seconds=options['sleep_seconds'])
+            if self.verbosity > 0:
+                if scheduled:
+                    self.stdout.write(
+                        f'Scheduled deleting expired tokens every {options["schedule_interval"]} seconds.')
+                else:
+                    self.stdout.write('Deleting expired tokens is already scheduled.')
+            return
+        deleted_count = GenericTokenWithMetadata.objects.delete_expired(
+            batch_size=options['batch_size'], sleep_seconds=options['sleep_seconds'],
+            max_batches=options['max_batches'], progress_callback=self.log_progress)
+        if self.verbosity > 0:
+            self.stdout.write(f'Deleted {deleted_count} expired tokens.')
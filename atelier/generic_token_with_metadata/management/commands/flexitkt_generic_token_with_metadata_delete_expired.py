@@ -1,10 +1,7 @@
 from __future__ import unicode_literals
-from django.core.management.base import BaseCommand
-from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata
+from atelier.generic_token_with_metadata.management.commands.atelier_generic_token_with_metadata_delete_expired \
+    import Command as DeleteExpiredCommand
 
 
-class Command(BaseCommand):
-    help = 'Delete all expired GenericTokenWithMetadata objects from the database.'
-
-    def handle(self, **options):
-        GenericTokenWithMetadata.objects.delete_expired()
+class Command(DeleteExpiredCommand):
+    help = 'Deprecated alias for atelier_generic_token_with_metadata_delete_expired.'
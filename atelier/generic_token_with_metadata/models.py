@@ -1,4 +1,6 @@
 from __future__ import unicode_literals
+import copy
+import time
 import uuid
 import random
 from datetime import timedelta
@@ -6,8 +8,7 @@ from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.postgres.fields import JSONField
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ValidationError
-from django.db import models, IntegrityError
+from django.db import connections, models, router, transaction, IntegrityError
 from django.db.models import QuerySet, CASCADE
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -29,6 +30,25 @@ def get_time_to_live_minutes(app):
     return time_to_live_minutes.get(app, time_to_live_minutes['default'])
 
 
+def get_purge_batch_size():
+    """
+    Get the number of tokens deleted per query by
+    :meth:`.GenericTokenWithMetadataBaseManager.delete_expired`.
+    """
+    return getattr(settings, 'GENERIC_TOKEN_WITH_METADATA_PURGE_BATCH_SIZE', None) or 1000
+
+
+def get_purge_sleep_seconds():
+    """
+    Get the number of seconds :meth:`.GenericTokenWithMetadataBaseManager.delete_expired`
+    sleeps between each batch.
+    """
+    sleep_seconds = getattr(settings, 'GENERIC_TOKEN_WITH_METADATA_PURGE_SLEEP_SECONDS', None)
+    if sleep_seconds is None:
+        return 0.1
+    return sleep_seconds
+
+
 def get_expiration_datetime_for_app(app):
     """
     Get the expiration datetime of tokens for the given ``app``
@@ -75,12 +95,103 @@ class GenericTokenWithMetadataQuerySet(QuerySet):
     """
     QuerySet for :class:`.GenericTokenWithMetadata`.
     """
+    def _db_for_write(self):
+        """
+        Get the database alias the raw write queries of this queryset are sent to.
+        """
+        return self._db or router.db_for_write(self.model, **self._hints)
+
+    def _as_id_subquery_sql(self, using):
+        """
+        Get the SQL and params for selecting the ids of the objects in this queryset.
+        """
+        return self.order_by().values('pk').query.get_compiler(using).as_sql()
+
+    def delete_returning(self):
+        """
+        Delete the objects in this queryset with a single ``DELETE ... RETURNING`` query.
+
+        Unlike :meth:`~django.db.models.query.QuerySet.delete`, this does not load the objects
+        before deleting them, and does not send any signals. Since the objects are
+        selected and deleted in a single statement, concurrent calls never return the same object.
+
+        Returns:
+            list: The deleted :class:`.GenericTokenWithMetadata` objects.
+        """
+        db = self._db_for_write()
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        fields = self.model._meta.concrete_fields
+        subquery_sql, params = self._as_id_subquery_sql(db)
+        sql = 'DELETE FROM {table} WHERE {pk} IN ({subquery_sql}) RETURNING {columns}'.format(
+            table=quote_name(self.model._meta.db_table),
+            pk=quote_name(self.model._meta.pk.column),
+            subquery_sql=subquery_sql,
+            columns=', '.join(quote_name(field.column) for field in fields))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        field_names = [field.attname for field in fields]
+        return [self.model.from_db(db, field_names, row) for row in rows]
+
+    def delete_in_batches(self, batch_size, sleep_seconds=0, max_batches=None, progress_callback=None):
+        """
+        Delete the objects in this queryset in batches of ``batch_size`` objects ordered by id,
+        with one ``DELETE ... WHERE id IN (SELECT id ... LIMIT batch_size)`` query per batch.
+
+        Unlike :meth:`~django.db.models.query.QuerySet.delete`, this does not load the objects
+        before deleting them, and does not send any signals. Run this in autocommit mode
+        (not in a transaction) to only hold the row locks of a single batch at a time.
+
+        Args:
+            batch_size (int): Max number of objects to delete per query.
+            sleep_seconds (float): Seconds to sleep between each batch.
+            max_batches (int): Stop after this many batches. Defaults to ``None`` (no limit).
+            progress_callback: Called with ``(batch_deleted_count, total_deleted_count)`` after each batch.
+
+        Returns:
+            int: The number of deleted objects.
+        """
+        db = self._db_for_write()
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        subquery_sql, params = self.order_by('pk').values('pk')[:batch_size]\
+            .query.get_compiler(db).as_sql()
+        sql = 'DELETE FROM {table} WHERE {pk} IN ({subquery_sql})'.format(
+            table=quote_name(self.model._meta.db_table),
+            pk=quote_name(self.model._meta.pk.column),
+            subquery_sql=subquery_sql)
+        total_deleted_count = 0
+        batch_count = 0
+        while max_batches is None or batch_count < max_batches:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                batch_deleted_count = cursor.rowcount
+            batch_count += 1
+            total_deleted_count += batch_deleted_count
+            if progress_callback:
+                progress_callback(batch_deleted_count, total_deleted_count)
+            if batch_deleted_count < batch_size:
+                break
+            if sleep_seconds:
+                time.sleep(sleep_seconds)
+        return total_deleted_count
+
+    def _pop_one(self):
+        popped_tokens = self.delete_returning()
+        if not popped_tokens:
+            raise self.model.DoesNotExist('GenericTokenWithMetadata matching query does not exist.')
+        return popped_tokens[0]
+
     def unsafe_pop(self, app, token):
         """
         Get the :class:`.GenericTokenWithMetadata` matching the given
         `token` and `app`. Removes the GenericTokenWithMetadata from the database, and
         returns the `GenericTokenWithMetadata` object.
 
+        Uses a single ``DELETE ... RETURNING`` query, so the same token is never
+        popped twice, even by concurrent requests.
+
         You should normally use :meth:`.GenericTokenWithMetadataBaseManager.pop`
         instead of this.
 
@@ -88,16 +199,53 @@ class GenericTokenWithMetadataQuerySet(QuerySet):
             GenericTokenWithMetadata.DoesNotExist if no matching token is stored for
             the given app.
         """
-        token = self.get(token=token, app=app)
-        token.delete()
-        return token
+        return self.filter(token=token, app=app)._pop_one()
 
     def get_and_check_for_single_use(self, *args, **kwargs):
-        token = self.get(*args, **kwargs)
-        if token.single_use:
-            token.delete()
+        """
+        Get the token matching the given filters (must match a single token, E.g.: filter by ``token``),
+        and delete it if it is single use.
+
+        The token is locked (``SELECT ... FOR UPDATE``) until it is deleted, so
+        concurrent calls never return the same single use token.
+
+        Raises:
+            GenericTokenWithMetadata.DoesNotExist: If no token matches the filters.
+            GenericTokenWithMetadata.MultipleObjectsReturned: If more than one token matches
+                the filters. Nothing is deleted in this case.
+        """
+        with transaction.atomic(using=self._db_for_write()):
+            token = self.select_for_update().get(*args, **kwargs)
+            if token.single_use and not self.filter(pk=token.pk).delete_returning():
+                raise self.model.DoesNotExist('GenericTokenWithMetadata matching query does not exist.')
         return token
 
+    def decrement_code_attempts(self):
+        """
+        Decrement :obj:`~.GenericTokenWithMetadata.attempts` of the tokens in this queryset that have
+        attempts left, with a single ``UPDATE ... RETURNING`` query.
+
+        Returns:
+            list: The remaining attempts of each of the updated tokens.
+        """
+        db = self._db_for_write()
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        subquery_sql, params = self._as_id_subquery_sql(db)
+        sql = """
+            UPDATE {table}
+            SET {attempts} = {attempts} - 1
+            WHERE {pk} IN ({subquery_sql}) AND {attempts} > 0
+            RETURNING {attempts}
+        """.format(
+            table=quote_name(self.model._meta.db_table),
+            attempts=quote_name('attempts'),
+            pk=quote_name(self.model._meta.pk.column),
+            subquery_sql=subquery_sql)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
     def filter_has_expired(self):
         """
         Return a queryset containing only the expired GenericTokenWithMetadata objects in
@@ -165,6 +313,14 @@ class GenericTokenWithMetadataQuerySet(QuerySet):
             .filter(app=app)\
             .filter_by_content_type_and_id(content_type, object_id)
 
+    def filter_usable_codes(self, content_type, object_id, app, code_type):
+        """
+        Filters only non-expired tokens with the given ``content_type``, ``object_id``, ``app``
+        and :obj:`~.GenericTokenWithMetadata.type`, with :obj:`~.GenericTokenWithMetadata.attempts` left.
+        """
+        return self.filter_usable_by_content_type_and_id_in_app(content_type, object_id, app)\
+            .filter(type=code_type, attempts__gt=0)
+
 
 class GenericTokenWithMetadataBaseManager(models.Manager):
     """
@@ -172,57 +328,273 @@ class GenericTokenWithMetadataBaseManager(models.Manager):
 
     Inherits all methods from :class:`.GenericTokenWithMetadataQuerySet`.
     """
+    #: Max number of times :meth:`.generate` and :meth:`.generate_many` generate a new token
+    #: for a token that collides with an existing token.
+    generate_max_attempts = 10
+
+    #: Max number of tokens inserted per query by :meth:`.generate_many`.
+    generate_many_batch_size = 1000
+
+    def _make_token(self, app, expiration_datetime, content_object, single_use, metadata, token, code_type, attempts):
+        generic_token_with_metadata = GenericTokenWithMetadata(
+            content_object=content_object, app=app, token=token,
+            created_datetime=_get_current_datetime(), single_use=single_use,
+            expiration_datetime=expiration_datetime, type=code_type, attempts=attempts)
+        if metadata:
+            generic_token_with_metadata.metadata = copy.deepcopy(metadata)
+        return generic_token_with_metadata
+
     def generate(self, app, expiration_datetime, content_object, single_use=True, metadata=None,
-                 method=generate_token, method_params=None):
+                 method=generate_token, method_params=None, code_type='', attempts=None):
         """
         Generate and save a token for the given user and app.
 
+        ``code_type`` and ``attempts`` set :obj:`.GenericTokenWithMetadata.type` and
+        :obj:`.GenericTokenWithMetadata.attempts`.
+
+        Uniqueness is left to the unique constraint on :obj:`.GenericTokenWithMetadata.token`.
+        If the token collides with an existing token, a new token is generated, up to
+        :obj:`.generate_max_attempts` times.
+
         Returns:
             A :class:`.GenericTokenWithMetadata` object with a token
             that is guaranteed to be unique.
+
+        Raises:
+            django.db.IntegrityError: If all the generated tokens collide with existing tokens.
         """
         if method_params is None:
             method_params = dict()
-        token = method(**method_params)
-        generic_token_with_metadata = GenericTokenWithMetadata(
-            content_object=content_object, app=app, token=token,
-            created_datetime=_get_current_datetime(), single_use=single_use,
-            expiration_datetime=expiration_datetime)
-        if metadata:
-            generic_token_with_metadata.metadata = metadata
-
-        try:
-            generic_token_with_metadata.full_clean()
-        except ValidationError as e:
-            if 'token' in e.error_dict and e.error_dict['token'][0].code == 'unique':
-                return self.generate(
-                    app=app, content_object=content_object, expiration_datetime=expiration_datetime, metadata=metadata,
-                    single_use=single_use, method=method, method_params=method_params
-                )
+        db = router.db_for_write(self.model)
+        for attempt in range(1, self.generate_max_attempts + 1):
+            generic_token_with_metadata = self._make_token(
+                app=app, expiration_datetime=expiration_datetime, content_object=content_object,
+                single_use=single_use, metadata=metadata, token=method(**method_params),
+                code_type=code_type, attempts=attempts)
+            try:
+                # The savepoint keeps the surrounding transaction (if any) usable after a collision.
+                with transaction.atomic(using=db):
+                    generic_token_with_metadata.save(force_insert=True, using=db)
+            except IntegrityError:
+                # Only retry token collisions. Other errors (E.g.: foreign key or NOT NULL
+                # violations) would fail on every attempt.
+                if attempt == self.generate_max_attempts or \
+                        not self.using(db).filter(token=generic_token_with_metadata.token).exists():
+                    raise
             else:
-                raise
-
-        try:
-            generic_token_with_metadata.save()
-        except IntegrityError:
-            return self.generate(
-                app=app, content_object=content_object, expiration_datetime=expiration_datetime, metadata=metadata,
-                single_use=single_use, method=method, method_params=method_params
-            )
-        else:
-            return generic_token_with_metadata
+                return generic_token_with_metadata
+
+    def generate_many(self, app, expiration_datetime, content_objects, single_use=True, metadata=None,
+                      method=generate_token, method_params=None, code_type='', attempts=None):
+        """
+        Generate and save a token for each of the given ``content_objects`` (E.g.: for invites
+        or broadcasts).
+
+        The tokens are inserted with ``INSERT ... ON CONFLICT (token) DO NOTHING RETURNING`` queries,
+        :obj:`.generate_many_batch_size` tokens per query. Only the tokens that collide with
+        existing tokens are generated again and inserted in the next round, up to
+        :obj:`.generate_max_attempts` times.
+
+        Returns:
+            list: The :class:`.GenericTokenWithMetadata` objects, in the same order as ``content_objects``.
+
+        Raises:
+            django.db.IntegrityError: If some of the tokens still collide with existing
+                tokens after :obj:`.generate_max_attempts` attempts.
+        """
+        if method_params is None:
+            method_params = dict()
+        generic_tokens_with_metadata = [
+            self._make_token(
+                app=app, expiration_datetime=expiration_datetime, content_object=content_object,
+                single_use=single_use, metadata=metadata, token=method(**method_params),
+                code_type=code_type, attempts=attempts)
+            for content_object in content_objects]
+        db = router.db_for_write(self.model)
+        pending = generic_tokens_with_metadata
+        for attempt in range(self.generate_max_attempts):
+            if attempt > 0:
+                for generic_token_with_metadata in pending:
+                    generic_token_with_metadata.token = method(**method_params)
+            conflicts = []
+            for start in range(0, len(pending), self.generate_many_batch_size):
+                conflicts.extend(self._insert_ignoring_token_conflicts(
+                    pending[start:start + self.generate_many_batch_size], using=db))
+            pending = conflicts
+            if not pending:
+                return generic_tokens_with_metadata
+        raise IntegrityError('Could not generate unique tokens for {} objects.'.format(len(pending)))
+
+    def _insert_ignoring_token_conflicts(self, generic_tokens_with_metadata, using):
+        """
+        Insert the given unsaved tokens with a single ``INSERT ... ON CONFLICT (token) DO NOTHING RETURNING``
+        query, and set the primary key of the inserted tokens. Only token collisions are ignored, so
+        other constraint violations raise ``IntegrityError``.
+
+        Returns:
+            list: The tokens that were not inserted because their token collides with an existing
+            token (or another token in the same batch).
+        """
+        if not generic_tokens_with_metadata:
+            return []
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+
+        # Tokens colliding within the batch would all look inserted in the RETURNING result.
+        to_insert = {}
+        conflicts = []
+        for generic_token_with_metadata in generic_tokens_with_metadata:
+            if generic_token_with_metadata.token in to_insert:
+                conflicts.append(generic_token_with_metadata)
+            else:
+                to_insert[generic_token_with_metadata.token] = generic_token_with_metadata
+
+        params = []
+        for generic_token_with_metadata in to_insert.values():
+            for field in fields:
+                params.append(field.get_db_prep_save(
+                    field.pre_save(generic_token_with_metadata, add=True), connection=connection))
+        row_placeholder = '({})'.format(', '.join(['%s'] * len(fields)))
+        sql = ('INSERT INTO {table} ({columns}) VALUES {values} '
+               'ON CONFLICT ({token}) DO NOTHING RETURNING {pk}, {token}').format(
+            table=quote_name(self.model._meta.db_table),
+            columns=', '.join(quote_name(field.column) for field in fields),
+            values=', '.join([row_placeholder] * len(to_insert)),
+            pk=quote_name(self.model._meta.pk.column),
+            token=quote_name('token'))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            inserted_ids = {token: pk for pk, token in cursor.fetchall()}
+
+        for token, generic_token_with_metadata in to_insert.items():
+            if token in inserted_ids:
+                generic_token_with_metadata.pk = inserted_ids[token]
+                generic_token_with_metadata._state.adding = False
+                generic_token_with_metadata._state.db = using
+            else:
+                conflicts.append(generic_token_with_metadata)
+        return conflicts
 
-    def generate_short_living_token(self, app, content_object, minutes=10, metadata=None, single_use=True, length=8):
+    def generate_short_living_token(self, app, content_object, minutes=10, metadata=None, single_use=True, length=8,
+                                    code_type='', attempts=None):
         """
         Generate and save a short living token for the given object and app.
 
+        If a token store is configured (see :mod:`atelier.generic_token_with_metadata.token_store`),
+        the token is stored in the token store instead of the database, and replaces
+        any existing token for the same object, app and ``code_type``. Use
+        :meth:`.has_usable_code` and :meth:`.verify_and_pop_code` to check these tokens.
+
         Returns:
             A :class:`.GenericTokenWithMetadata` object with a token
-            that is guaranteed to be unique.
+            that is guaranteed to be unique. Not saved to the database
+            if a token store is configured.
+        """
+        from atelier.generic_token_with_metadata.token_store import get_token_store
+        expiration_datetime = timezone.now() + timedelta(minutes=minutes)
+        token_store = get_token_store()
+        if token_store is None:
+            return self.generate(app, expiration_datetime, content_object,
+                                 metadata=metadata, single_use=single_use,
+                                 method=generate_letter_digits_token, method_params=dict(length=length),
+                                 code_type=code_type, attempts=attempts)
+        generic_token_with_metadata = GenericTokenWithMetadata(
+            content_object=content_object, app=app, token=generate_letter_digits_token(length=length),
+            created_datetime=_get_current_datetime(), single_use=single_use,
+            expiration_datetime=expiration_datetime, metadata=metadata or {}, type=code_type, attempts=attempts)
+        token_store.add_code(
+            app=app, content_type_id=generic_token_with_metadata.content_type_id,
+            object_id=generic_token_with_metadata.object_id, code_type=code_type,
+            token=generic_token_with_metadata.token, expiration_datetime=expiration_datetime,
+            attempts=attempts, single_use=single_use)
+        return generic_token_with_metadata
+
+    def has_usable_code(self, content_type, object_id, app, code_type):
+        """
+        Returns ``True`` if there is a usable (see :meth:`.GenericTokenWithMetadataQuerySet.filter_usable_codes`)
+        token generated with :meth:`.generate_short_living_token` for the given object, app and code type.
+        """
+        from atelier.generic_token_with_metadata.token_store import get_token_store
+        token_store = get_token_store()
+        if token_store is not None:
+            return token_store.has_usable_code(
+                app=app, content_type_id=content_type.id, object_id=object_id, code_type=code_type)
+        return self.filter_usable_codes(content_type, object_id, app, code_type).exists()
+
+    def verify_and_pop_code(self, content_type, object_id, app, code_type, code):
+        """
+        Verify a ``code`` generated with :meth:`.generate_short_living_token`.
+
+        If the code is correct, the token is removed (if it is single use). If not,
+        :obj:`~.GenericTokenWithMetadata.attempts` is decremented.
+
+        Returns:
+            tuple: ``(verified, attempts_left)``. ``attempts_left`` is ``None`` if ``verified`` is ``True``.
+
+        Raises:
+            GenericTokenWithMetadata.DoesNotExist: If there is no usable code.
+        """
+        from atelier.generic_token_with_metadata.token_store import get_token_store
+        token_store = get_token_store()
+        if token_store is not None:
+            result = token_store.verify_and_pop_code(
+                app=app, content_type_id=content_type.id, object_id=object_id, code_type=code_type, code=code)
+            if result is None:
+                raise GenericTokenWithMetadata.DoesNotExist('No usable code.')
+            verified, attempts_left = result
+            return verified, None if verified else attempts_left
+
+        return self._verify_and_pop_code_in_database(content_type, object_id, app, code_type, code)
+
+    def _verify_and_pop_code_in_database(self, content_type, object_id, app, code_type, code):
         """
-        return self.generate(app, timezone.now() + timedelta(minutes=minutes), content_object,
-                             metadata=metadata, single_use=single_use,
-                             method=generate_letter_digits_token, method_params=dict(length=length))
+        Database implementation of :meth:`.verify_and_pop_code` as a single query.
+
+        The usable codes are locked (``FOR UPDATE``), and then, in the same statement, either
+        the matching code is deleted (if single use), or the attempts of all the usable
+        codes are decremented. Concurrent verifications of the same code are serialized
+        by the lock, so a code is never accepted twice, and each invalid attempt is counted.
+        """
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        candidates_sql, candidates_params = self.filter_usable_codes(content_type, object_id, app, code_type)\
+            .order_by().values('pk', 'token', 'single_use').query.get_compiler(db).as_sql()
+        sql = """
+            WITH candidates AS ({candidates_sql} FOR UPDATE),
+            matched AS (
+                SELECT {pk} FROM candidates WHERE {token} = %s
+            ),
+            popped AS (
+                DELETE FROM {table}
+                WHERE {pk} IN (SELECT {pk} FROM candidates WHERE {token} = %s AND {single_use})
+            ),
+            decremented AS (
+                UPDATE {table}
+                SET {attempts} = {attempts} - 1
+                WHERE {pk} IN (SELECT {pk} FROM candidates) AND NOT EXISTS (SELECT 1 FROM matched)
+                RETURNING {attempts}
+            )
+            SELECT
+                (SELECT COUNT(*) FROM candidates),
+                (SELECT COUNT(*) FROM matched),
+                (SELECT MAX({attempts}) FROM decremented)
+        """.format(
+            candidates_sql=candidates_sql,
+            table=quote_name(self.model._meta.db_table),
+            pk=quote_name(self.model._meta.pk.column),
+            token=quote_name('token'),
+            single_use=quote_name('single_use'),
+            attempts=quote_name('attempts'))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, list(candidates_params) + [code, code])
+            candidate_count, matched_count, attempts_left = cursor.fetchone()
+        if not candidate_count:
+            raise GenericTokenWithMetadata.DoesNotExist('No usable code.')
+        if matched_count:
+            return True, None
+        return False, attempts_left
 
     def prolong_or_generate(self, app, delta_dict, content_object, single_use=True, metadata=None,
                             method=generate_token, method_params=None):
@@ -256,11 +628,21 @@ class GenericTokenWithMetadataBaseManager(models.Manager):
         """
         return self.filter_not_expired().unsafe_pop(app=app, token=token)
 
-    def delete_expired(self):
+    def delete_expired(self, batch_size=None, sleep_seconds=None, max_batches=None, progress_callback=None):
         """
-        Delete all expired tokens.
+        Delete all expired tokens in batches (see :meth:`.GenericTokenWithMetadataQuerySet.delete_in_batches`).
+
+        ``batch_size`` and ``sleep_seconds`` default to the ``GENERIC_TOKEN_WITH_METADATA_PURGE_BATCH_SIZE``
+        (``1000``) and ``GENERIC_TOKEN_WITH_METADATA_PURGE_SLEEP_SECONDS`` (``0.1``) settings.
+
+        Returns:
+            int: The number of deleted tokens.
         """
-        self.filter_has_expired().delete()
+        return self.filter_has_expired().delete_in_batches(
+            batch_size=batch_size or get_purge_batch_size(),
+            sleep_seconds=get_purge_sleep_seconds() if sleep_seconds is None else sleep_seconds,
+            max_batches=max_batches,
+            progress_callback=progress_callback)
 
     @staticmethod
     def get_and_validate(app, token):
@@ -310,6 +692,14 @@ class GenericTokenWithMetadata(models.Model):
     #: JSON encoded metadata
     metadata = JSONField(null=False, blank=True, default=dict)
 
+    #: The type of the token. Used to tell apart tokens for the same object
+    #: and app, like login codes sent by email and by SMS.
+    type = models.CharField(max_length=50, blank=True, default='')
+
+    #: Number of attempts left at verifying the token (see
+    #: :meth:`.GenericTokenWithMetadataBaseManager.verify_and_pop_code`). ``None`` means no limit.
+    attempts = models.PositiveIntegerField(null=True, blank=True, default=None)
+
     #: The content-type of the :obj:`~.GenericTokenWithMetadata.content_object`.
     #: Together with :obj:`~.GenericTokenWithMetadata.object_id` this creates a
     #: generic foreign key to any Django model.
@@ -335,6 +725,16 @@ class GenericTokenWithMetadata(models.Model):
     #:   content object to show pending shares.
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    class Meta:
+        indexes = [
+            # Usable tokens by content object (E.g.: filter_usable_by_content_type_and_id_in_app()).
+            models.Index(fields=['app', 'content_type', 'object_id', 'expiration_datetime']),
+            # Usable codes (filter_usable_codes())
+            models.Index(fields=['app', 'content_type', 'object_id', 'type', 'attempts']),
+            # Expired tokens (delete_expired())
+            models.Index(fields=['expiration_datetime']),
+        ]
+
     def is_expired(self):
         """
         Returns `True` if :obj:`.GenericTokenWithMetadata.expiration_datetime` is in the past,
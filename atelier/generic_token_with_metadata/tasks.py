@@ -0,0 +1,81 @@
+#: Redis key with the id of the scheduled :func:`.purge_expired_tokens` job.
+#: See :func:`.schedule_purge_expired_tokens`.
+PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY = 'generic_token_with_metadata:purge_expired_tokens:scheduled_job_id'
+
+
+def purge_expired_tokens(reschedule_seconds=None, batch_size=None, sleep_seconds=None):
+    """
+    RQ task that deletes expired tokens with
+    :meth:`~atelier.generic_token_with_metadata.models.GenericTokenWithMetadataBaseManager.delete_expired`.
+
+    If ``reschedule_seconds`` is given, the task schedules itself to run again after
+    ``reschedule_seconds`` seconds, even if the purge fails, so it runs continuously once
+    started (see :func:`.schedule_purge_expired_tokens`).
+    Requires an RQ worker running with ``--with-scheduler``.
+
+    Returns:
+        int: The number of deleted tokens.
+    """
+    import logging
+    from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata
+    logger = logging.getLogger(__name__)
+
+    def log_progress(batch_deleted_count, total_deleted_count):
+        logger.debug('Deleted %s expired tokens (%s in total).', batch_deleted_count, total_deleted_count)
+
+    try:
+        deleted_count = GenericTokenWithMetadata.objects.delete_expired(
+            batch_size=batch_size, sleep_seconds=sleep_seconds, progress_callback=log_progress)
+        logger.info('Deleted %s expired tokens.', deleted_count)
+        return deleted_count
+    finally:
+        if reschedule_seconds:
+            _reschedule_purge_expired_tokens(
+                interval_seconds=reschedule_seconds, batch_size=batch_size, sleep_seconds=sleep_seconds)
+
+
+def _get_queue():
+    import django_rq
+    from django.conf import settings
+    return django_rq.get_queue(getattr(settings, 'GENERIC_TOKEN_WITH_METADATA_REDIS_QUEUE', None) or 'default')
+
+
+def schedule_purge_expired_tokens(interval_seconds, batch_size=None, sleep_seconds=None):
+    """
+    Schedule :func:`.purge_expired_tokens` to run after ``interval_seconds`` seconds, and
+    then every ``interval_seconds`` seconds.
+
+    Uses the RQ queue named by the ``GENERIC_TOKEN_WITH_METADATA_REDIS_QUEUE`` setting
+    (defaults to ``"default"``). Does nothing if the job is already scheduled (or running),
+    so this is safe to call every time the server starts.
+
+    Returns:
+        bool: ``True`` if the job was scheduled.
+    """
+    from datetime import timedelta
+    from rq.job import Job
+    queue = _get_queue()
+    scheduled_job_id = queue.connection.get(PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY)
+    if scheduled_job_id and Job.exists(scheduled_job_id.decode('utf-8'), connection=queue.connection):
+        return False
+    job = queue.enqueue_in(
+        timedelta(seconds=interval_seconds), purge_expired_tokens,
+        reschedule_seconds=interval_seconds, batch_size=batch_size, sleep_seconds=sleep_seconds)
+    queue.connection.set(PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY, job.id)
+    return True
+
+
+def _reschedule_purge_expired_tokens(interval_seconds, batch_size=None, sleep_seconds=None):
+    """
+    Schedule the next :func:`.purge_expired_tokens` job from the currently running job,
+    unless another job has been scheduled in its place.
+    """
+    from rq import get_current_job
+    connection = _get_queue().connection
+    current_job = get_current_job()
+    scheduled_job_id = connection.get(PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY)
+    if scheduled_job_id is not None and (current_job is None or scheduled_job_id.decode('utf-8') != current_job.id):
+        return
+    connection.delete(PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY)
+    schedule_purge_expired_tokens(
+        interval_seconds=interval_seconds, batch_size=batch_size, sleep_seconds=sleep_seconds)
@@ -3,7 +3,9 @@ from datetime import datetime, timedelta
 from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
 from django.utils import timezone
 from model_mommy import mommy
@@ -42,6 +44,69 @@ class TestGenericTokenWithMetadata(TestCase):
             expiration_datetime=get_expiration_datetime_for_app('testapp'), method=lambda **kwargs: next(tokens))
         self.assertEqual(unique_user_token.token, 'free')
 
+    def test_generate_gives_up_after_max_attempts(self):
+        self._create_generic_token_with_metadata(user=mommy.make(get_user_model()), app='testapp1', token='taken')
+        with self.assertRaises(IntegrityError):
+            GenericTokenWithMetadata.objects.generate(
+                content_object=mommy.make(get_user_model()), app='testapp2',
+                expiration_datetime=get_expiration_datetime_for_app('testapp'), method=lambda **kwargs: 'taken')
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 1)
+
+    def test_generate_does_not_retry_other_integrity_errors(self):
+        method = mock.Mock(side_effect=generate_token)
+        with self.assertRaises(IntegrityError):
+            GenericTokenWithMetadata.objects.generate(
+                content_object=mommy.make(get_user_model()), app=None,
+                expiration_datetime=get_expiration_datetime_for_app('testapp'), method=method)
+        self.assertEqual(method.call_count, 1)
+
+    def test_generate_many_does_not_ignore_other_integrity_errors(self):
+        with self.assertRaises(IntegrityError):
+            GenericTokenWithMetadata.objects.generate_many(
+                content_objects=[mommy.make(get_user_model())], app=None,
+                expiration_datetime=get_expiration_datetime_for_app('testapp'))
+
+    def test_generate_many(self):
+        testusers = mommy.make(get_user_model(), _quantity=3)
+        ContentType.objects.get_for_model(get_user_model())  # Cache the content type
+        with self.assertNumQueries(1):
+            generic_tokens_with_metadata = GenericTokenWithMetadata.objects.generate_many(
+                content_objects=testusers, app='testapp', metadata={'invite': True},
+                expiration_datetime=get_expiration_datetime_for_app('testapp'))
+        self.assertEqual([token.content_object for token in generic_tokens_with_metadata], testusers)
+        self.assertEqual(
+            set(GenericTokenWithMetadata.objects.values_list('id', 'token')),
+            {(token.id, token.token) for token in generic_tokens_with_metadata})
+        self.assertEqual(GenericTokenWithMetadata.objects.filter(metadata__invite=True).count(), 3)
+
+    def test_generate_many_in_batches(self):
+        testusers = mommy.make(get_user_model(), _quantity=5)
+        ContentType.objects.get_for_model(get_user_model())  # Cache the content type
+        metadata = {'invite': True}
+        with mock.patch.object(GenericTokenWithMetadata.objects, 'generate_many_batch_size', 2), \
+                self.assertNumQueries(3):
+            generic_tokens_with_metadata = GenericTokenWithMetadata.objects.generate_many(
+                content_objects=testusers, app='testapp', metadata=metadata,
+                expiration_datetime=get_expiration_datetime_for_app('testapp'))
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 5)
+        self.assertTrue(all(token.id is not None for token in generic_tokens_with_metadata))
+        generic_tokens_with_metadata[0].metadata['invite'] = False
+        self.assertEqual(metadata, {'invite': True})
+        self.assertEqual(generic_tokens_with_metadata[1].metadata, {'invite': True})
+
+    def test_generate_many_retries_conflicting_tokens(self):
+        self._create_generic_token_with_metadata(user=mommy.make(get_user_model()), app='testapp1', token='taken')
+        testusers = mommy.make(get_user_model(), _quantity=3)
+        tokens = iter(['taken', 'free1', 'free1', 'free2', 'free3'])
+        with self.assertNumQueries(2):
+            generic_tokens_with_metadata = GenericTokenWithMetadata.objects.generate_many(
+                content_objects=testusers, app='testapp2',
+                expiration_datetime=get_expiration_datetime_for_app('testapp'), method=lambda **kwargs: next(tokens))
+        self.assertEqual([token.token for token in generic_tokens_with_metadata], ['free3', 'free1', 'free2'])
+        self.assertEqual(
+            dict(GenericTokenWithMetadata.objects.filter(app='testapp2').values_list('token', 'object_id')),
+            {'free1': testusers[1].id, 'free2': testusers[2].id, 'free3': testusers[0].id})
+
     def test_filter_by_content_object(self):
         testobject1 = mommy.make(get_user_model())
         testobject2 = mommy.make(get_user_model())
@@ -64,6 +129,60 @@ class TestGenericTokenWithMetadata(TestCase):
             token='test-token2', app='testapp2').content_object, testuser)
         self.assertEquals(GenericTokenWithMetadata.objects.count(), 0)
 
+    def test_unsafe_pop_does_not_exist(self):
+        with self.assertRaises(GenericTokenWithMetadata.DoesNotExist):
+            GenericTokenWithMetadata.objects.unsafe_pop(token='test-token1', app='testapp1')
+
+    def test_delete_returning(self):
+        testuser = mommy.make(get_user_model())
+        self._create_generic_token_with_metadata(user=testuser, app='testapp1', token='test-token1',
+                                                 metadata={'type': 'email'})
+        self._create_generic_token_with_metadata(user=testuser, app='testapp2', token='test-token2')
+        with self.assertNumQueries(1):
+            deleted_tokens = GenericTokenWithMetadata.objects.filter(app='testapp1').delete_returning()
+        self.assertEqual([token.token for token in deleted_tokens], ['test-token1'])
+        self.assertEqual(deleted_tokens[0].metadata, {'type': 'email'})
+        self.assertEqual(deleted_tokens[0].content_object, testuser)
+        self.assertEqual(list(GenericTokenWithMetadata.objects.values_list('token', flat=True)), ['test-token2'])
+
+    def test_get_and_check_for_single_use(self):
+        testuser = mommy.make(get_user_model())
+        self._create_generic_token_with_metadata(user=testuser, token='single', single_use=True)
+        self._create_generic_token_with_metadata(user=testuser, token='multi', single_use=False)
+        with self.assertNumQueries(4):  # SAVEPOINT, SELECT ... FOR UPDATE, DELETE ... RETURNING, RELEASE SAVEPOINT
+            self.assertEqual(GenericTokenWithMetadata.objects.get_and_check_for_single_use(token='single').token,
+                             'single')
+        self.assertEqual(GenericTokenWithMetadata.objects.get_and_check_for_single_use(token='multi').token, 'multi')
+        self.assertEqual(list(GenericTokenWithMetadata.objects.values_list('token', flat=True)), ['multi'])
+
+    def test_get_and_check_for_single_use_multiple_objects_returned(self):
+        testuser = mommy.make(get_user_model())
+        self._create_generic_token_with_metadata(user=testuser, app='testapp1', token='single1', single_use=True)
+        self._create_generic_token_with_metadata(user=testuser, app='testapp1', token='single2', single_use=True)
+        with self.assertRaises(GenericTokenWithMetadata.MultipleObjectsReturned):
+            GenericTokenWithMetadata.objects.get_and_check_for_single_use(app='testapp1')
+        self.assertEqual(
+            set(GenericTokenWithMetadata.objects.values_list('token', flat=True)),
+            {'single1', 'single2'})
+
+    def test_get_and_check_for_single_use_multiple_objects_returned_mixed_single_use(self):
+        testuser = mommy.make(get_user_model())
+        self._create_generic_token_with_metadata(user=testuser, app='testapp1', token='single', single_use=True)
+        self._create_generic_token_with_metadata(user=testuser, app='testapp1', token='multi', single_use=False)
+        with self.assertRaises(GenericTokenWithMetadata.MultipleObjectsReturned):
+            GenericTokenWithMetadata.objects.get_and_check_for_single_use(app='testapp1')
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 2)
+
+    def test_decrement_code_attempts(self):
+        testuser = mommy.make(get_user_model())
+        self._create_generic_token_with_metadata(user=testuser, token='a', attempts=2)
+        self._create_generic_token_with_metadata(user=testuser, token='b', attempts=0)
+        self._create_generic_token_with_metadata(user=testuser, token='c', attempts=None)
+        with self.assertNumQueries(1):
+            self.assertEqual(GenericTokenWithMetadata.objects.all().decrement_code_attempts(), [1])
+        self.assertEqual(GenericTokenWithMetadata.objects.get(token='b').attempts, 0)
+        self.assertIsNone(GenericTokenWithMetadata.objects.get(token='c').attempts)
+
     def test_filter_not_expired(self):
         unexpired_generic_token_with_metadata = self._create_generic_token_with_metadata(
             user=mommy.make(get_user_model()), token='test-token1',
@@ -166,6 +285,78 @@ class TestGenericTokenWithMetadata(TestCase):
         self.assertEquals(GenericTokenWithMetadata.objects.first(),
                           unexpired_generic_token_with_metadata)
 
+    def test_delete_expired_in_batches(self):
+        unexpired_generic_token_with_metadata = self._create_generic_token_with_metadata(
+            user=mommy.make(get_user_model()), token='test-token1',
+            expiration_datetime=datetime(2015, 1, 1, 14, 30))
+        for index in range(5):
+            self._create_generic_token_with_metadata(
+                user=mommy.make(get_user_model()), token=f'test-expired-token{index}',
+                expiration_datetime=datetime(2015, 1, 1, 13, 30))
+
+        progress = []
+        with mock.patch('atelier.generic_token_with_metadata.models._get_current_datetime',
+                        lambda: datetime(2015, 1, 1, 14)):
+            deleted_count = GenericTokenWithMetadata.objects.delete_expired(
+                batch_size=2, sleep_seconds=0,
+                progress_callback=lambda batch_count, total_count: progress.append((batch_count, total_count)))
+        self.assertEqual(deleted_count, 5)
+        self.assertEqual(progress, [(2, 2), (2, 4), (1, 5)])
+        self.assertEqual(list(GenericTokenWithMetadata.objects.all()), [unexpired_generic_token_with_metadata])
+
+    def test_delete_expired_max_batches(self):
+        for index in range(5):
+            self._create_generic_token_with_metadata(
+                user=mommy.make(get_user_model()), token=f'test-expired-token{index}',
+                expiration_datetime=datetime(2015, 1, 1, 13, 30))
+
+        with mock.patch('atelier.generic_token_with_metadata.models._get_current_datetime',
+                        lambda: datetime(2015, 1, 1, 14)):
+            deleted_count = GenericTokenWithMetadata.objects.delete_expired(
+                batch_size=2, sleep_seconds=0, max_batches=2)
+        self.assertEqual(deleted_count, 4)
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 1)
+
+    def test_purge_expired_tokens_task_reschedules(self):
+        from atelier.generic_token_with_metadata import tasks
+        self._create_generic_token_with_metadata(
+            user=mommy.make(get_user_model()), token='test-token1',
+            expiration_datetime=datetime(2015, 1, 1, 13, 30))
+        with mock.patch('atelier.generic_token_with_metadata.models._get_current_datetime',
+                        lambda: datetime(2015, 1, 1, 14)), \
+                mock.patch.object(tasks, '_reschedule_purge_expired_tokens') as mock_reschedule:
+            self.assertEqual(tasks.purge_expired_tokens(reschedule_seconds=60, sleep_seconds=0), 1)
+        mock_reschedule.assert_called_once_with(interval_seconds=60, batch_size=None, sleep_seconds=0)
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 0)
+
+    def test_schedule_purge_expired_tokens_when_already_scheduled(self):
+        from atelier.generic_token_with_metadata import tasks
+        queue = mock.Mock()
+        queue.connection.get.return_value = b'scheduled-job-id'
+        with mock.patch.object(tasks, '_get_queue', return_value=queue), \
+                mock.patch('rq.job.Job.exists', return_value=True):
+            self.assertFalse(tasks.schedule_purge_expired_tokens(interval_seconds=60))
+        queue.enqueue_in.assert_not_called()
+
+    def test_schedule_purge_expired_tokens(self):
+        from atelier.generic_token_with_metadata import tasks
+        queue = mock.Mock()
+        queue.connection.get.return_value = None
+        queue.enqueue_in.return_value = mock.Mock(id='new-job-id')
+        with mock.patch.object(tasks, '_get_queue', return_value=queue):
+            self.assertTrue(tasks.schedule_purge_expired_tokens(interval_seconds=60))
+        queue.connection.set.assert_called_once_with(tasks.PURGE_EXPIRED_TOKENS_SCHEDULED_JOB_KEY, 'new-job-id')
+
+    def test_purge_expired_tokens_does_not_reschedule_when_replaced_by_another_job(self):
+        from atelier.generic_token_with_metadata import tasks
+        queue = mock.Mock()
+        queue.connection.get.return_value = b'other-job-id'
+        with mock.patch.object(tasks, '_get_queue', return_value=queue), \
+                mock.patch('rq.get_current_job', return_value=mock.Mock(id='this-job-id')), \
+                mock.patch.object(tasks, 'schedule_purge_expired_tokens') as mock_schedule:
+            tasks._reschedule_purge_expired_tokens(interval_seconds=60)
+        mock_schedule.assert_not_called()
+
     def test_is_expired(self):
         unexpired_generic_token_with_metadata = self._create_generic_token_with_metadata(
             user=mommy.make(get_user_model()), token='test-token1',
@@ -184,3 +375,73 @@ class TestGenericTokenWithMetadata(TestCase):
             user=mommy.make(get_user_model()), token='test-token2',
             expiration_datetime=None)
         self.assertFalse(tokenobject.is_expired())
+
+
+class TestCodeVerification(TestCase):
+    def setUp(self):
+        self.user = mommy.make(get_user_model())
+        self.code_kwargs = dict(content_type=ContentType.objects.get_for_model(self.user), object_id=self.user.id,
+                                app='testapp', code_type='email')
+
+    def _generate_code(self, attempts=3):
+        return GenericTokenWithMetadata.objects.generate_short_living_token(
+            app='testapp', content_object=self.user, code_type='email', attempts=attempts, length=4)
+
+    def test_has_usable_code(self):
+        self.assertFalse(GenericTokenWithMetadata.objects.has_usable_code(**self.code_kwargs))
+        self._generate_code()
+        self.assertTrue(GenericTokenWithMetadata.objects.has_usable_code(**self.code_kwargs))
+        self.assertFalse(GenericTokenWithMetadata.objects.has_usable_code(
+            **dict(self.code_kwargs, code_type='mobile')))
+
+    def test_verify_and_pop_code_valid(self):
+        token = self._generate_code()
+        self.assertEqual(
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code=token.token, **self.code_kwargs),
+            (True, None))
+        self.assertFalse(GenericTokenWithMetadata.objects.has_usable_code(**self.code_kwargs))
+
+    def test_verify_and_pop_code_invalid_decrements_attempts(self):
+        self._generate_code(attempts=2)
+        self.assertEqual(
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs),
+            (False, 1))
+        self.assertEqual(
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs),
+            (False, 0))
+        self.assertFalse(GenericTokenWithMetadata.objects.has_usable_code(**self.code_kwargs))
+        with self.assertRaises(GenericTokenWithMetadata.DoesNotExist):
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs)
+
+    def test_verify_and_pop_code_is_single_query(self):
+        token = self._generate_code()
+        with self.assertNumQueries(1):
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs)
+        with self.assertNumQueries(1):
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code=token.token, **self.code_kwargs)
+
+    def test_verify_and_pop_code_invalid_decrements_all_usable_codes(self):
+        self._generate_code(attempts=3)
+        self._generate_code(attempts=1)
+        self.assertEqual(
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs),
+            (False, 2))
+        self.assertEqual(
+            sorted(GenericTokenWithMetadata.objects.values_list('attempts', flat=True)), [0, 2])
+
+    def test_verify_and_pop_code_no_code(self):
+        with self.assertRaises(GenericTokenWithMetadata.DoesNotExist):
+            GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs)
+
+    def test_token_store(self):
+        token_store = mock.Mock()
+        token_store.verify_and_pop_code.return_value = (False, 2)
+        with mock.patch('atelier.generic_token_with_metadata.token_store.get_token_store', lambda: token_store):
+            token = self._generate_code()
+            self.assertEqual(
+                GenericTokenWithMetadata.objects.verify_and_pop_code(code='invalid', **self.code_kwargs),
+                (False, 2))
+        self.assertEqual(GenericTokenWithMetadata.objects.count(), 0)
+        self.assertEqual(token_store.add_code.call_args[1]['token'], token.token)
+        self.assertEqual(token_store.add_code.call_args[1]['attempts'], 3)
+        self.assertEqual(token_store.add_code.call_args[1]['code_type'], 'email')
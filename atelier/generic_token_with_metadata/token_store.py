@@ -0,0 +1,133 @@
+"""
+Optional cache tier for short living tokens (E.g.: login codes).
+
+Enabled by setting ``GENERIC_TOKEN_WITH_METADATA_TOKEN_STORE`` to the dotted path of
+a token store class, like ``'atelier.generic_token_with_metadata.token_store.RedisTokenStore'``.
+When enabled, ``GenericTokenWithMetadata.objects.generate_short_living_token()``
+stores the token in the cache instead of the database, and ``has_usable_code()`` and
+``verify_and_pop_code()`` use the cache.
+
+Durable tokens (E.g.: password reset and email confirmation tokens created with
+``generate()`` or ``prolong_or_generate()``) are not cached. They are only stored in
+the database, and ``pop()``, ``get_and_check_for_single_use()`` and ``get_and_validate()``
+always query the database. These tokens are looked up rarely, and popping a
+single use token is a single ``DELETE ... RETURNING`` query that a write-through
+cache could not save, so caching them would only add invalidation problems.
+"""
+import django_rq
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class RedisTokenStore(object):
+    """
+    Stores short living codes in Redis hashes keyed by app, content object and code type,
+    with the expiration datetime of the token as the native Redis TTL.
+
+    There is at most one code per key, so generating a new code replaces the previous one.
+
+    Uses the Redis connection of the RQ queue named by the ``GENERIC_TOKEN_WITH_METADATA_REDIS_QUEUE``
+    setting (defaults to ``"default"``).
+    """
+    key_prefix = 'generic_token_with_metadata:code'
+
+    #: Checks the code, and pops it if it is correct, or decrements the remaining attempts if not.
+    #: Returns ``nil`` if there is no code, else ``{verified, attempts_left}`` where attempts_left is
+    #: ``-1`` if the code has no attempts limit.
+    verify_and_pop_script = """
+local values = redis.call('HMGET', KEYS[1], 'token', 'attempts', 'single_use')
+local token, attempts, single_use = values[1], values[2], values[3]
+if not token then
+    return nil
+end
+if token == ARGV[1] then
+    if single_use == '1' then
+        redis.call('DEL', KEYS[1])
+    end
+    return {1, tonumber(attempts or '-1')}
+end
+if not attempts then
+    return {0, -1}
+end
+local attempts_left = redis.call('HINCRBY', KEYS[1], 'attempts', -1)
+if attempts_left <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return {0, attempts_left}
+"""
+
+    def __init__(self, connection=None):
+        self._connection = connection
+        self._verify_and_pop = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            self._connection = django_rq.get_connection(
+                getattr(settings, 'GENERIC_TOKEN_WITH_METADATA_REDIS_QUEUE', None) or 'default')
+        return self._connection
+
+    def make_key(self, app, content_type_id, object_id, code_type):
+        return f'{self.key_prefix}:{app}:{content_type_id}:{object_id}:{code_type or ""}'
+
+    def add_code(self, app, content_type_id, object_id, code_type, token, expiration_datetime,
+                 attempts=None, single_use=True):
+        """
+        Add a code. Replaces any existing code for the same app, object and code type.
+        """
+        key = self.make_key(app=app, content_type_id=content_type_id, object_id=object_id, code_type=code_type)
+        mapping = {'token': token, 'single_use': '1' if single_use else '0'}
+        if attempts is not None:
+            mapping['attempts'] = attempts
+        pipeline = self.connection.pipeline(transaction=True)
+        pipeline.delete(key)
+        pipeline.hset(key, mapping=mapping)
+        pipeline.pexpireat(key, expiration_datetime)
+        pipeline.execute()
+
+    def has_usable_code(self, app, content_type_id, object_id, code_type):
+        key = self.make_key(app=app, content_type_id=content_type_id, object_id=object_id, code_type=code_type)
+        return bool(self.connection.exists(key))
+
+    def verify_and_pop_code(self, app, content_type_id, object_id, code_type, code):
+        """
+        Verify the given ``code`` in a single round trip to Redis.
+
+        Returns:
+            tuple: ``None`` if there is no usable code. Else ``(verified, attempts_left)``
+            where ``attempts_left`` is ``None`` if the code has no attempts limit.
+        """
+        if self._verify_and_pop is None:
+            self._verify_and_pop = self.connection.register_script(self.verify_and_pop_script)
+        key = self.make_key(app=app, content_type_id=content_type_id, object_id=object_id, code_type=code_type)
+        result = self._verify_and_pop(keys=[key], args=[code])
+        if result is None:
+            return None
+        verified, attempts_left = result
+        return bool(verified), None if attempts_left == -1 else attempts_left
+
+
+_token_store = None
+
+
+def get_token_store():
+    """
+    Get the token store configured with the ``GENERIC_TOKEN_WITH_METADATA_TOKEN_STORE``
+    setting, or ``None`` if tokens are only stored in the database.
+    """
+    global _token_store
+    if _token_store is None:
+        token_store_class_path = getattr(settings, 'GENERIC_TOKEN_WITH_METADATA_TOKEN_STORE', None)
+        if not token_store_class_path:
+            return None
+        _token_store = import_string(token_store_class_path)()
+    return _token_store
+
+
+@receiver(setting_changed)
+def _reset_token_store_on_setting_changed(setting, **kwargs):
+    global _token_store
+    if setting in ('GENERIC_TOKEN_WITH_METADATA_TOKEN_STORE', 'GENERIC_TOKEN_WITH_METADATA_REDIS_QUEUE'):
+        _token_store = None
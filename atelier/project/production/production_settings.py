@@ -43,6 +43,7 @@ RQ_QUEUES = {
 # MAILGUN_API_KEY = os.environ.get('MAILGUN_API_KEY')
 # MAILGUN_SENDER_DOMAIN = os.environ.get('MAILGUN_SENDER_DOMAIN')
 # MAILGUN_API_BASE_URL = f'https://api.eu.mailgun.net/v3/{MAILGUN_SENDER_DOMAIN}'
+# MAILGUN_WEBHOOK_SIGNING_KEY = os.environ.get('MAILGUN_WEBHOOK_SIGNING_KEY')
 #
 # IEVV_SMS_DEFAULT_BACKEND_ID = 'linkmobility'
 # LINKMOBILITY_USERNAME = os.environ.get('LINKMOBILITY_USERNAME')
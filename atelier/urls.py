@@ -14,7 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 
 from atelier import views
 
@@ -38,5 +38,6 @@ urlpatterns = [
     path('auth/reset-password/', views.PasswordResetView.as_view(), name='reset_password'),
     path('auth/reset-password-confirm/<str:token>/',
          views.ConfirmPasswordResetView.as_view(), name='reset_password_confirm'),
+    path('messages/', include('atelier.atelier_messages.urls')),
 
 ]
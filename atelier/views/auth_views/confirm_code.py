@@ -6,7 +6,7 @@ from django.shortcuts import reverse, redirect
 from django.utils.translation import ugettext
 from django.views.generic import FormView
 
-from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata, GenericTokenExpiredError
+from atelier.generic_token_with_metadata.models import GenericTokenWithMetadata
 from atelier.models import User
 from atelier.views.forms.auth_forms import ConfirmCodeForm
 
@@ -17,7 +17,7 @@ class ConfirmCodeView(FormView):
     _user = None
 
     def dispatch(self, request, *args, **kwargs):
-        if not self.get_usable_tokens().exists():
+        if not GenericTokenWithMetadata.objects.has_usable_code(**self.get_code_kwargs()):
             raise Http404()
         return super().dispatch(request, *args, **kwargs)
 
@@ -40,31 +40,24 @@ class ConfirmCodeView(FormView):
             context['email'] = user.email
         return context
 
-    def get_usable_tokens(self):
-        return GenericTokenWithMetadata.objects.filter_usable_by_content_type_and_id_in_app(
-            content_type=ContentType.objects.get_for_model(User), object_id=self.kwargs.get('user_id'),
-            app=User._meta.app_label).filter(metadata__type=self.kwargs.get('type'), metadata__attempts__gt=0)
+    def get_code_kwargs(self):
+        return dict(content_type=ContentType.objects.get_for_model(User), object_id=self.kwargs.get('user_id'),
+                    app=User._meta.app_label, code_type=self.kwargs.get('type'))
 
     def form_valid(self, form):
         try:
-            self.get_usable_tokens().get_and_check_for_single_use(token=form.data.get('code'))
+            verified, attempts_left = GenericTokenWithMetadata.objects.verify_and_pop_code(
+                code=form.data.get('code'), **self.get_code_kwargs())
         except GenericTokenWithMetadata.DoesNotExist:
-            token = self.get_usable_tokens().first()
-            if token:
-                metadata = token.metadata
-                if metadata['attempts'] > 0:
-                    metadata['attempts'] -= 1
-                    self.get_usable_tokens().update(metadata=metadata)
-                    messages.warning(
-                        self.request,
-                        ugettext(f'The code was invalid. You have {metadata["attempts"]} attempts left'),
-                        extra_tags='alert-warning'
-                    )
-                    return redirect(reverse(
-                        'confirm_code', kwargs={'user_id': self.kwargs.get('user_id'), 'type': self.kwargs.get('type')}
-                    ))
-            raise Http404()
-        except GenericTokenExpiredError:
             raise Http404()
+        if not verified:
+            messages.warning(
+                self.request,
+                ugettext(f'The code was invalid. You have {attempts_left} attempts left'),
+                extra_tags='alert-warning'
+            )
+            return redirect(reverse(
+                'confirm_code', kwargs={'user_id': self.kwargs.get('user_id'), 'type': self.kwargs.get('type')}
+            ))
         login(self.request, self.get_user(), backend='django.contrib.auth.backends.ModelBackend')
         return super().form_valid(form)
@@ -26,8 +26,7 @@ class LoginView(TemplateView):
     @staticmethod
     def get_auth_code(user, code_type):
         return GenericTokenWithMetadata.objects.generate_short_living_token(
-            app=User._meta.app_label, content_object=user, minutes=5, metadata={'type': code_type, 'attempts': 3},
-            length=4
+            app=User._meta.app_label, content_object=user, minutes=5, code_type=code_type, attempts=3, length=4
         ).token
 
     @property
@@ -61,7 +60,7 @@ class LoginView(TemplateView):
         message_dict.update(
             dict(to_phone_number=user.phone_number) if code_type == PHONE_TYPE else dict(
                 to_email=email if email is not None else user.email))
-        SystemMessage.objects.send(**message_dict)
+        SystemMessage.objects.send(transactional=True, **message_dict)
         return self.get_confirm_redirect(user, code_type)
 
     def get(self, request, *args, **kwargs):
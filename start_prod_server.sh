@@ -1,4 +1,7 @@
 #!/bin/sh
 python manage.py collectstatic --noinput &&
 daphne atelier.asgi:application -b 0.0.0.0 -p $PORT --proxy-headers &
-python manage.py rqworker
\ No newline at end of file
+python manage.py atelier_messages_send_scheduled_messages --loop &
+python manage.py atelier_messages_apply_retention --schedule-interval 86400
+python manage.py atelier_generic_token_with_metadata_delete_expired --schedule-interval 3600
+python manage.py rqworker --with-scheduler
\ No newline at end of file